@@ -0,0 +1,142 @@
+import utime
+from scheduler import Scheduler
+
+# Tuning rules from the ultimate gain Ku and period Tu: Kp = a * Ku, Kd = Kp * b * Tu
+RULES = {
+    'zn': (0.8, 1.0 / 8.0),             # Ziegler-Nichols PD, fast with some overshoot
+    'tl': (1.0 / 2.2, 1.0 / 6.3),       # Tyreus-Luyben, more damped and robust
+    'no_overshoot': (0.2, 1.0 / 3.0),   # Ziegler-Nichols without overshoot, the most cautious
+}
+
+def relay_test(sensors, motors, middle_of_line, dt, speed=60.0, relay=20.0, hysteresis=0.2,
+               cycles=6, settle_cycles=2, epsilon=0.0, battery_constant=1.0, timeout_ms=10000):
+    """
+    Drives along the line with a bang-bang relay in place of the controller: the steering is
+    +relay or -relay depending on the side of the line, with a hysteresis around the middle.
+    The loop settles into an oscillation whose amplitude and period give the ultimate gain
+    and period of the steering loop at this speed. Put the robot on a straight of about 2 m.
+    * sensors, motors: Initialized hardware
+    * middle_of_line: Position the relay switches around
+    * dt: Period of the loop in seconds
+    * speed: Base speed of the test
+    * relay: Amplitude of the steering
+    * hysteresis: Error (in sensor spacings) beyond which the relay switches, against the noise
+    * cycles: Oscillation periods measured
+    * settle_cycles: Periods skipped before measuring
+    * epsilon: All sensors below this (in sensor units) count as a lost line, which aborts the test
+    * battery_constant: Scaling of the motor speeds, as in the LineFollower, so that Ku is in its units
+    * timeout_ms: Longest duration of the test
+    Returns (Ku, Tu in seconds, amplitude of the error), or None if the line was lost or
+    no steady oscillation was found in time.
+    """
+    # The controller output is Kp * error with a negative Kp, so is the relay
+    output = -relay
+    switches = 0
+    period_start = 0
+    periods = []
+    amplitudes = []
+    low = 0.0
+    high = 0.0
+    scheduler = Scheduler(dt)
+    motors.start()
+    start = utime.ticks_ms()
+    try:
+        while len(periods) < cycles:
+            if utime.ticks_diff(utime.ticks_ms(), start) > timeout_ms:
+                return None
+            sensors.read_sensors()
+            if max(sensors.voltages) <= epsilon:
+                return None
+            error = middle_of_line - sensors.get_current_line_position()
+            if error < low:
+                low = error
+            if error > high:
+                high = error
+            if error > hysteresis and output > 0.0 or error < -hysteresis and output < 0.0:
+                output = -output
+                if output > 0.0:
+                    # One full period between the switches to a positive output
+                    now = utime.ticks_us()
+                    if switches > settle_cycles:
+                        periods.append(utime.ticks_diff(now, period_start) / 1000000)
+                        amplitudes.append((high - low) / 2)
+                    switches += 1
+                    period_start = now
+                    low = 0.0
+                    high = 0.0
+            motors.set_direction(battery_constant * speed, battery_constant * output)
+            scheduler.wait()
+    finally:
+        motors.stop()
+
+    tu = sum(periods) / len(periods)
+    amplitude = sum(amplitudes) / len(amplitudes)
+    if amplitude <= hysteresis:
+        return None
+    # Describing function of a relay with hysteresis
+    ku = 4 * relay / (3.14159265 * (amplitude * amplitude - hysteresis * hysteresis) ** 0.5)
+    return ku, tu, amplitude
+
+def gains(ku, tu, rule='tl'):
+    """
+    PD gains from the ultimate gain and period, with the signs of main.py.
+    Returns (Kp, Kd).
+    """
+    a, b = RULES[rule]
+    kp = a * ku
+    return -kp, -kp * b * tu
+
+def safe_speed(test_speed, ku, kp, gain_margin=1.5):
+    """
+    Base speed up to which Kp keeps the gain margin. The gain of the steering loop grows
+    about in proportion with the speed, so the ultimate gain falls as 1/speed. Not
+    extrapolated beyond twice the speed of the test.
+    """
+    return min(test_speed * ku / (gain_margin * abs(kp)), 2.0 * test_speed)
+
+def save_gains(path, kp, kd, base_speed):
+    """
+    Writes the tuned constants to a file on the flash, one 'NAME value' line each.
+    """
+    with open(path, 'w') as f:
+        f.write('Kp %.4f\nKd %.4f\nBASE_SPEED %.1f\n' % (kp, kd, base_speed))
+
+def load_gains(path):
+    """
+    Reads the constants written by save_gains.
+    Returns (Kp, Kd, BASE_SPEED), or None if the file is missing or invalid.
+    """
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 2:
+                    values[fields[0]] = float(fields[1])
+    except (OSError, ValueError):
+        return None
+    if 'Kp' not in values or 'Kd' not in values or 'BASE_SPEED' not in values:
+        return None
+    return values['Kp'], values['Kd'], values['BASE_SPEED']
+
+def autotune(sensors, motors, middle_of_line, dt, path, rule='tl', speed=60.0, relay=20.0, epsilon=0.0,
+             battery_constant=1.0, gain_margin=1.5):
+    """
+    Runs the relay test, derives the PD gains and the base speed, prints them as constants
+    for main.py and saves them to path.
+    Returns (Kp, Kd, BASE_SPEED), or None if the test failed.
+    """
+    result = relay_test(sensors, motors, middle_of_line, dt, speed, relay, epsilon=epsilon,
+                        battery_constant=battery_constant)
+    if result is None:
+        print("Autotune: no steady oscillation, put the robot on a straight line")
+        return None
+    ku, tu, amplitude = result
+    kp, kd = gains(ku, tu, rule)
+    base_speed = safe_speed(speed, ku, kp, gain_margin)
+    print("Autotune: Ku = %.2f, Tu = %.3f s, amplitude %.2f (%s rule)" % (ku, tu, amplitude, rule))
+    print("Kp = %.2f" % kp)
+    print("Kd = %.3f" % kd)
+    print("BASE_SPEED = %.1f" % base_speed)
+    save_gains(path, kp, kd, base_speed)
+    return kp, kd, base_speed
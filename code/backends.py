@@ -0,0 +1,406 @@
+from machine import ADC, Pin
+import utime
+
+# Sensor backends: the hardware a Sensors object reads its raw frames from. Every backend
+# has a count of sensors and a read_frame(out) method which scans all of them and writes a
+# 16-bit code per sensor, left to right, into the caller's buffer (0-65535 for 0-5 V, the
+# scale of machine.ADC.read_u16 on the 5 V sensor supply), and returns the buffer.
+# read_selected(out, selected) reads only the sensors whose byte in selected is set, for the
+# adaptive scan of Sensors, and leaves the other codes in out as they are.
+
+# Registers of the Pimoroni IO expander (special function registers of its Nuvoton MS51)
+IOE_REG_ADCRL = 0x82      # Low 4 bits of the conversion result
+IOE_REG_ADCRH = 0x83      # High 8 bits of the conversion result
+IOE_REG_ADCCON1 = 0xA1    # Bit 0 enables the ADC
+IOE_REG_ADCCON0 = 0xA8    # Bit 7 conversion done, bit 6 start a conversion, bits 3-0 the channel
+IOE_REG_AINDIDS = 0xB6    # Digital inputs disabled on the analog channels, one bit per channel
+IOE_ADCF = 0x80
+IOE_ADCS = 0x40
+IOE_ADCEN = 0x01
+# Polls of the conversion done flag before a conversion is given up
+IOE_ADC_POLLS = 10
+# ADC channel of every pin of the IO expander which has one
+IOE_ADC_CHANNELS = {7: 7, 8: 6, 9: 5, 10: 1, 11: 3, 12: 4, 13: 2, 14: 0}
+
+def _bit_flips(a, b):
+    """
+    Number of select lines which change between mux channels a and b.
+    """
+    x = a ^ b
+    flips = 0
+    while x:
+        flips += x & 1
+        x >>= 1
+    return flips
+
+def gray_scan_order(mux_channels):
+    """
+    Orders the sensors so that consecutive mux channels differ in as few select lines
+    as possible, counting the wrap from the last channel back to the first.
+    Returns a list of sensor indices in scan order.
+    """
+    n = len(mux_channels)
+    # Every step flips at least one line and a closed walk flips an even number of them
+    lower_bound = n if n % 2 == 0 else n + 1
+    best = [list(range(n)), sum(_bit_flips(mux_channels[i - 1], mux_channels[i]) for i in range(n))]
+    order = [0]
+    used = [False] * n
+    used[0] = True
+
+    def search(cost):
+        if best[1] <= lower_bound:
+            return
+        if len(order) == n:
+            total = cost + _bit_flips(mux_channels[order[-1]], mux_channels[order[0]])
+            if total < best[1]:
+                best[0] = list(order)
+                best[1] = total
+            return
+        for i in range(n):
+            if not used[i]:
+                step = _bit_flips(mux_channels[order[-1]], mux_channels[i])
+                if cost + step + (n - len(order)) >= best[1]:
+                    continue
+                used[i] = True
+                order.append(i)
+                search(cost + step)
+                order.pop()
+                used[i] = False
+
+    search(0)
+    return best[0]
+
+
+class MuxADCBackend:
+    """
+    Sensors on the inputs of an analog multiplexer, whose output goes to an ADC pin of the Pico.
+
+    Attributes:
+        mux_channels (list[int]): Mux channel of every sensor, left to right.
+        count (int): Number of sensors.
+        select_lines (list[Pin]): GPIO pins used to select MUX channel.
+        current_channel (int): Channel the select lines are set to.
+        adc (ADC): ADC object for reading sensor values.
+        scan_order (list[int]): Sensor indices in the order they are read, see gray_scan_order.
+        scan_channels (list[int]): Mux channel of every sensor in scan order.
+        settle_us (list[int]): Settle time before reading every sensor in scan order, in microseconds.
+    """
+
+    def __init__(self, mux_channels, select_pins, adc_pin, settle_us=250, gray_order=True):
+        """
+        * mux_channels: Mux channel (0-7) of every sensor, left to right
+        * select_pins: GPIO pins connected to S0, S1, S2 of the mux
+        * adc_pin: ADC pin connected to the multiplexer output (e.g., ADC0)
+        * settle_us: settle time after switching the mux, one value or a list in scan order
+        * gray_order: scan the channels so that only one select line changes between reads
+        """
+        self.mux_channels = mux_channels
+        self.count = len(mux_channels)
+
+        self.select_lines = [Pin(pin, Pin.OUT, value=0) for pin in select_pins]
+        self.current_channel = 0
+
+        self.scan_order = gray_scan_order(mux_channels) if gray_order else list(range(len(mux_channels)))
+        self.scan_channels = [mux_channels[i] for i in self.scan_order]
+        if isinstance(settle_us, (list, tuple)):
+            self.settle_us = list(settle_us)
+        else:
+            self.settle_us = [settle_us] * len(mux_channels)
+
+        self.adc = ADC(Pin(adc_pin))
+
+    def select_channel(self, channel):
+        """
+        Sets the multiplexer select lines to select the given channel (0-7)
+        """
+        for i, pin in enumerate(self.select_lines):
+            pin.value((channel >> i) & 1)
+        self.current_channel = channel
+
+    def switch_channel(self, channel):
+        """
+        Selects the given channel (0-7) writing only the select lines which change.
+        """
+        changed = channel ^ self.current_channel
+        i = 0
+        while changed:
+            if changed & 1:
+                self.select_lines[i].value((channel >> i) & 1)
+            changed >>= 1
+            i += 1
+        self.current_channel = channel
+
+    def read_frame(self, out):
+        """
+        Reads all sensors in scan order into out, by sensor index.
+        """
+        scan_order = self.scan_order
+        scan_channels = self.scan_channels
+        settle_us = self.settle_us
+        adc = self.adc
+        for k in range(len(scan_order)):
+            self.switch_channel(scan_channels[k])
+            utime.sleep_us(settle_us[k])
+            out[scan_order[k]] = adc.read_u16()
+        return out
+
+    def read_selected(self, out, selected):
+        """
+        Reads the selected sensors in scan order into out, by sensor index. A skipped sensor
+        costs neither a switch nor a settle time. The settle time of a sensor was calibrated
+        after the one before it in scan order; after another one it is still within max_us.
+        * selected: bytearray with a nonzero byte for every sensor to read
+        """
+        scan_order = self.scan_order
+        scan_channels = self.scan_channels
+        settle_us = self.settle_us
+        adc = self.adc
+        for k in range(len(scan_order)):
+            i = scan_order[k]
+            if selected[i]:
+                self.switch_channel(scan_channels[k])
+                utime.sleep_us(settle_us[k])
+                out[i] = adc.read_u16()
+        return out
+
+    def read_channel(self, channel, settle_us, repeats=1):
+        """
+        Average raw reading of one channel after the given settle time.
+        """
+        self.switch_channel(channel)
+        utime.sleep_us(settle_us)
+        total = 0
+        for _ in range(repeats):
+            total += self.adc.read_u16()
+        return total / repeats
+
+    def calibrate_settle(self, max_us=250, candidates=(0, 5, 10, 15, 20, 25, 30, 40, 50, 60, 70, 80, 90, 100, 120, 140, 160, 200),
+                         repeats=4, tolerance=0.02, margin=1.1, min_step=0.3):
+        """
+        Measures the shortest settle time after which every channel reads the same as after
+        max_us, when switched to from the channel read before it in scan order.
+        The residual is measured relative to the voltage step seen during calibration and
+        scaled to a full 0-5 V step, so the robot only needs to stand on the line with some
+        sensors on it and some off. Channels without a usable step get the largest settle
+        time measured on the others. Updates self.settle_us and returns it.
+        * max_us: Settle time considered to be fully settled
+        * candidates: Settle times tried, in increasing order
+        * repeats: Number of switches averaged for every candidate
+        * tolerance: Allowed error in volts for a full 0-5 V step
+        * margin: Safety factor applied to the measured settle times
+        * min_step: Smallest voltage step between channels usable for the measurement
+        """
+        n = len(self.scan_channels)
+        measured = [None] * n
+        for k in range(n):
+            previous = self.scan_channels[k - 1]
+            channel = self.scan_channels[k]
+            start = self.read_channel(previous, max_us, repeats) / 65535.0 * 5
+            settled = self.read_channel(channel, max_us, repeats) / 65535.0 * 5
+            step = settled - start
+            if abs(step) < min_step:
+                continue
+            for settle_us in candidates:
+                total = 0.0
+                for _ in range(repeats):
+                    self.read_channel(previous, max_us)
+                    total += self.read_channel(channel, settle_us)
+                residual = abs(total / repeats / 65535.0 * 5 - settled) / abs(step)
+                if residual * 5.0 <= tolerance:
+                    measured[k] = min(max_us, int(settle_us * margin + 0.5))
+                    break
+            else:
+                measured[k] = max_us
+
+        known = [t for t in measured if t is not None]
+        fallback = max(known) if known else max_us
+        self.settle_us = [fallback if t is None else t for t in measured]
+        return self.settle_us
+
+
+class IOExpanderBackend:
+    """
+    Sensors on the ADC pins of a Pimoroni IO expander breakout, read over I2C.
+    The input() of the Pimoroni library costs 16 bus transactions per sensor: it rewrites the
+    channel, the analog input and the enable registers bit by bit (a read and a write each),
+    clears the done flag, starts the conversion, polls the flag and reads the two result
+    registers one at a time. The batched scan sets the analog inputs up once and then takes
+    three transactions per sensor: one write of the channel together with the start bit (which
+    also clears the done flag), a poll of the done flag and one read of both result registers.
+    The conversion usually ends before the first poll; without the poll a slower conversion
+    would leave the result of the previous channel, or half of a new one, in the registers.
+
+    Attributes:
+        i2c (I2C): Bus of the expander, machine.I2C or PimoroniI2C.
+        address (int): I2C address of the expander.
+        pins (list[int]): Expander pin of every sensor, left to right.
+        count (int): Number of sensors.
+        ioe (BreakoutIOExpander): The Pimoroni driver, used for the pin modes and by the unbatched scan, or None.
+        batched (bool): Scan with the register writes and reads above, False reads every pin with ioe.input.
+        burst (bool): Read both result registers in one transfer, False reads them one at a time
+            as the Pimoroni library does (four transactions per sensor).
+        commands (bytearray): Value of ADCCON0 starting the conversion of every sensor.
+        code_scale (float): Factor from a 12-bit result on the vref scale to a 16-bit code on the 0-5 V scale.
+        command, result (bytearray): Transfer buffers, preallocated so that a scan creates no objects.
+        all_selected (bytearray): Every sensor selected, the read_selected of a whole frame.
+    """
+
+    def __init__(self, i2c, pins, address=0x18, vref=3.3, ioe=None, batched=True, burst=True):
+        """
+        * i2c: Bus of the expander
+        * pins: Expander pins of the sensors (7-14), left to right
+        * address: I2C address of the expander
+        * vref: Supply voltage of the expander, the full scale of its ADC
+        * ioe: BreakoutIOExpander on the same bus, puts the pins in ADC mode; required if not batched
+        * batched, burst: See the attributes
+        """
+        if not batched and ioe is None:
+            raise ValueError("the unbatched scan needs the BreakoutIOExpander")
+        self.i2c = i2c
+        self.address = address
+        self.pins = list(pins)
+        self.count = len(self.pins)
+        self.ioe = ioe
+        self.batched = batched
+        self.burst = burst
+        self.commands = bytearray([IOE_ADCS | IOE_ADC_CHANNELS[pin] for pin in self.pins])
+        self.code_scale = 65535.0 * vref / (4095 * 5.0)
+        self.command = bytearray(1)
+        self.result = bytearray(2)
+        self.all_selected = bytearray(b'\x01' * self.count)
+        self.setup()
+
+    def setup(self):
+        """
+        Puts the pins in ADC mode, disables their digital inputs and enables the ADC.
+        """
+        if self.ioe is not None:
+            for pin in self.pins:
+                self.ioe.set_mode(pin, self.ioe.PIN_ADC)
+        mask = 0
+        for pin in self.pins:
+            mask |= 1 << IOE_ADC_CHANNELS[pin]
+        self.command[0] = mask
+        self.i2c.writeto_mem(self.address, IOE_REG_AINDIDS, self.command)
+        self.command[0] = IOE_ADCEN
+        self.i2c.writeto_mem(self.address, IOE_REG_ADCCON1, self.command)
+
+    def read_frame(self, out):
+        """
+        Converts every sensor in turn into out.
+        """
+        return self.read_selected(out, self.all_selected)
+
+    def read_selected(self, out, selected):
+        """
+        Converts the selected sensors in turn into out.
+        * selected: bytearray with a nonzero byte for every sensor to read
+        """
+        code_scale = self.code_scale
+        if not self.batched:
+            ioe = self.ioe
+            for i in range(self.count):
+                if selected[i]:
+                    out[i] = int(ioe.input(self.pins[i]) * code_scale + 0.5)
+            return out
+
+        i2c = self.i2c
+        address = self.address
+        commands = self.commands
+        command = self.command
+        result = self.result
+        for i in range(self.count):
+            if not selected[i]:
+                continue
+            command[0] = commands[i]
+            i2c.writeto_mem(address, IOE_REG_ADCCON0, command)
+            polls = 0
+            i2c.readfrom_mem_into(address, IOE_REG_ADCCON0, command)
+            while not command[0] & IOE_ADCF:
+                polls += 1
+                if polls == IOE_ADC_POLLS:
+                    raise RuntimeError("timeout waiting for the ADC conversion")
+                i2c.readfrom_mem_into(address, IOE_REG_ADCCON0, command)
+            if self.burst:
+                i2c.readfrom_mem_into(address, IOE_REG_ADCRL, result)
+                low = result[0]
+                high = result[1]
+            else:
+                i2c.readfrom_mem_into(address, IOE_REG_ADCRH, command)
+                high = command[0]
+                i2c.readfrom_mem_into(address, IOE_REG_ADCRL, command)
+                low = command[0]
+            out[i] = int(((high << 4) | (low & 0x0F)) * code_scale + 0.5)
+        return out
+
+
+class ReplayBackend:
+    """
+    Frames recorded earlier, played back in order, e.g. to run the sensor pipeline and the
+    controller offline on a log of a run. A frame is read until one of its sensors is read a
+    second time, so the window of the adaptive scan and the rest read when it falls back come
+    from the same frame.
+
+    Attributes:
+        frames (list): Frames of raw codes, one value per sensor, left to right.
+        count (int): Number of sensors.
+        index (int): Frame being read.
+        taken (bytearray): Sensors of the frame at index which have been read.
+        all_selected (bytearray): Every sensor selected, the read_selected of a whole frame.
+        loop (bool): Start over after the last frame, False repeats the last frame.
+    """
+
+    def __init__(self, frames, loop=True):
+        """
+        * frames: Sequence of frames of 16-bit codes
+        * loop: See the attributes
+        """
+        self.frames = frames
+        self.count = len(frames[0])
+        self.index = 0
+        self.taken = bytearray(self.count)
+        self.all_selected = bytearray(b'\x01' * self.count)
+        self.loop = loop
+
+    @classmethod
+    def from_voltages(cls, frames, loop=True):
+        """
+        A replay of frames recorded in volts on the 0-5 scale (read_raw_voltages).
+        """
+        codes = []
+        for frame in frames:
+            codes.append([min(65535, max(0, int(voltage / 5.0 * 65535 + 0.5))) for voltage in frame])
+        return cls(codes, loop)
+
+    def rewind(self):
+        self.index = 0
+        for i in range(self.count):
+            self.taken[i] = 0
+
+    def read_frame(self, out):
+        """
+        Copies the next frame into out.
+        """
+        return self.read_selected(out, self.all_selected)
+
+    def read_selected(self, out, selected):
+        """
+        Copies the selected codes of the frame being read into out, moving on to the next
+        frame first if one of them has been read from it already.
+        """
+        taken = self.taken
+        count = self.count
+        for i in range(count):
+            if selected[i] and taken[i]:
+                self.index += 1
+                if self.index == len(self.frames):
+                    self.index = 0 if self.loop else self.index - 1
+                for k in range(count):
+                    taken[k] = 0
+                break
+        frame = self.frames[self.index]
+        for i in range(count):
+            if selected[i]:
+                out[i] = frame[i]
+                taken[i] = 1
+        return out
@@ -0,0 +1,95 @@
+from array import array
+
+class Battery:
+    """
+    Battery voltage compensation of the motor speeds. The supply voltage is sampled every
+    sample_every calls of update(), filtered and looked up in a gain table precomputed from
+    hand-measured (voltage, gain) points, and the gain is handed to Motors, which multiplies
+    the speeds by it. The control loop itself does only that multiply.
+
+    Attributes:
+        read_voltage (callable): Returns the battery voltage in volts.
+        table (array('f')): Gain for every table_step volts from table_min to table_max.
+        voltage (float): Filtered battery voltage, None before the first sample.
+        gain (float): Gain for the filtered voltage.
+        motors (Motors): Optional motors whose gain is kept up to date.
+    """
+
+    def __init__(self, read_voltage, points=((7.54, 1.0), (8.86, 0.47)), motors=None, alpha=0.2,
+                 sample_every=50, table_min=6.0, table_max=10.0, table_step=0.02):
+        """
+        * read_voltage: Function returning the battery voltage in volts
+        * points: (voltage, gain) pairs at which the gain keeps the usual speed, interpolated linearly
+          between them and held constant beyond the first and the last one
+        * motors: Motors to set the gain of after every sample
+        * alpha: Weight of a new sample in the filtered voltage
+        * sample_every: Number of update() calls between samples
+        * table_min, table_max, table_step: Voltage range and resolution of the gain table
+        """
+        self.read_voltage = read_voltage
+        self.motors = motors
+        self.alpha = alpha
+        self.sample_every = sample_every
+        self.table_min = table_min
+        self.table_step = table_step
+        self.table = self.build_table(sorted(points), table_min, table_max, table_step)
+        self.voltage = None
+        self.gain = 1.0
+        self.calls = 0
+
+    @staticmethod
+    def build_table(points, table_min, table_max, table_step):
+        """
+        Interpolates the gain points over the voltage range.
+        """
+        size = int((table_max - table_min) / table_step + 0.5) + 1
+        table = array('f', [0.0] * size)
+        for i in range(size):
+            voltage = table_min + i * table_step
+            if voltage <= points[0][0]:
+                gain = points[0][1]
+            elif voltage >= points[-1][0]:
+                gain = points[-1][1]
+            else:
+                k = 1
+                while points[k][0] < voltage:
+                    k += 1
+                (v0, g0), (v1, g1) = points[k - 1], points[k]
+                gain = g0 + (g1 - g0) * (voltage - v0) / (v1 - v0)
+            table[i] = gain
+        return table
+
+    def lookup(self, voltage):
+        """
+        Gain of the table entry nearest to the voltage.
+        """
+        index = int((voltage - self.table_min) / self.table_step + 0.5)
+        if index < 0:
+            index = 0
+        elif index >= len(self.table):
+            index = len(self.table) - 1
+        return self.table[index]
+
+    def sample(self):
+        """
+        Reads the voltage now and updates the filtered voltage and the gain.
+        Returns the gain.
+        """
+        voltage = self.read_voltage()
+        if self.voltage is None:
+            self.voltage = voltage
+        else:
+            self.voltage += self.alpha * (voltage - self.voltage)
+        self.gain = self.lookup(self.voltage)
+        if self.motors is not None:
+            self.motors.gain = self.gain
+        return self.gain
+
+    def update(self):
+        """
+        Called once per control step (or scan), samples every sample_every calls.
+        """
+        self.calls += 1
+        if self.calls >= self.sample_every:
+            self.calls = 0
+            self.sample()
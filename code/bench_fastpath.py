@@ -0,0 +1,111 @@
+# Cost of the hot paths and time from import to the first control step with every code
+# emitter of fastpath.py. Run on the Pico with the robot modules on the flash, as sources or
+# as .mpy files built by host/build_mpy.py:
+#     mpremote run code/bench_fastpath.py
+# The motors are not started. On a computer: python -m host.bench_fastpath
+import gc
+import sys
+import utime
+
+# Modules imported afresh for every boot measurement, main.py imports all the others
+MODULES = ('main', 'fastpath', 'follower', 'sensors', 'backends', 'buffer', 'pid', 'motors', 'profiler', 'calibration',
+           'console', 'autotune', 'pipeline', 'scheduler', 'telemetry', 'lap_profile', 'battery', 'recovery', 'lookahead',
+           'remote', 'memory')
+EMITTERS = ('bytecode', 'native', 'viper')
+CALLS = 500
+
+def build(main, integer_mode, settle_us):
+    """
+    Creates the follower the way main.py does, without the optional parts.
+    """
+    from sensors import Sensors
+    from motors import Motors
+    from pid import PIDController
+    from follower import LineFollower
+    motors = Motors(main.motor_pins, main.motor_enable_pins, slew_limit=main.MOTOR_SLEW_LIMIT)
+    sensors = Sensors(main.positions_to_mux_channel, main.select_pins, main.adc_pin,
+                      threshold_min=main.THRESHOLD_MIN, threshold_max=main.THRESHOLD_MAX,
+                      memory_length=main.N_smoothing_memory, alpha=main.smoothing_alpha, settle_us=settle_us,
+                      smoothing=main.smoothing_mode, integer_mode=integer_mode, position_mode=main.POSITION_MODE)
+    pid_controller = PIDController(main.Kp, main.Kd, main.Ki, main.dt, setpoint=main.middle_of_line,
+                                   derivative_tau=main.KD_TAU, integral_limit=main.INTEGRAL_LIMIT,
+                                   schedule=main.GAIN_SCHEDULE)
+    return LineFollower(sensors, motors, pid_controller, middle_of_line=main.middle_of_line, dt=main.dt,
+                        epsilon=main.EPSILON, epsilon_upper=main.EPSILON_UPPER, border_mode=main.border_mode,
+                        n_direction_memory=main.N_direction_memory, k_se=main.K_se, k_sd=main.K_sd,
+                        base_speed=main.BASE_SPEED, tight_turn_speed=main.TIGHT_TURN_SPEED,
+                        proportion=main.PROPORTION, battery_constant=main.battery_constant,
+                        print_averages=False)
+
+def first_step(emitter, integer_mode, ticks_us, ticks_diff):
+    """
+    Forgets the robot modules and imports them again (compiling the sources or loading the
+    .mpy files), selects the emitter, creates the follower and runs one control step.
+    Returns the microseconds to the end of the imports and to the end of the first step,
+    and the file the sensors module came from.
+    """
+    for name in MODULES:
+        if name in sys.modules:
+            del sys.modules[name]
+    gc.collect()
+    start = ticks_us()
+    main = __import__('main')
+    imported = ticks_us()
+    if emitter != 'bytecode':
+        __import__('fastpath').select(emitter)
+    follower = build(main, integer_mode, main.MUX_SETTLE_US)
+    follower.step()
+    end = ticks_us()
+    return ticks_diff(imported, start), ticks_diff(end, start), getattr(sys.modules['sensors'], '__file__', 'frozen')
+
+def timed(function, args, calls, ticks_us, ticks_diff):
+    start = ticks_us()
+    for _ in range(calls):
+        function(*args)
+    return ticks_diff(ticks_us(), start) / calls
+
+def per_call(emitter, integer_mode, ticks_us, ticks_diff, calls=CALLS):
+    """
+    Returns (name, microseconds per call) of the hot paths with the emitter selected,
+    less the cost of the timing loop.
+    """
+    main = __import__('main')
+    __import__('fastpath').select(emitter)
+    follower = build(main, integer_mode, 0)
+    sensors = follower.sensors
+    sensors.read_sensors()
+    buffer = follower.direction_buffer
+    dt = follower.dt
+    calls_of = (
+        ('read_sensors', sensors.read_sensors, ()),
+        ('truncate', sensors.truncate, (3.3, 2)),
+        ('weighted_average', sensors.get_position_weighted_average, ()),
+        ('buffer.append', buffer.append, (1.0,)),
+        ('buffer.average', buffer.average, ()),
+        ('pid.update_output', follower.pid_controller.update_output, (3.7, dt)),
+        ('set_direction', follower.motors.set_direction, (50.0, 10.0)),
+        ('step', follower.step, ()),
+    )
+    overhead = timed(lambda: None, (), calls, ticks_us, ticks_diff)
+    costs = []
+    for name, function, args in calls_of:
+        gc.collect()
+        costs.append((name, timed(function, args, calls, ticks_us, ticks_diff) - overhead))
+    follower.motors.stop()
+    return costs
+
+def run(ticks_us=utime.ticks_us, ticks_diff=utime.ticks_diff):
+    for integer_mode in (False, True):
+        print("sensors:", "integer" if integer_mode else "float")
+        print("%-18s %10s %10s %10s" % (("us per call",) + EMITTERS))
+        columns = [per_call(emitter, integer_mode, ticks_us, ticks_diff) for emitter in EMITTERS]
+        for k in range(len(columns[0])):
+            print("%-18s %10.1f %10.1f %10.1f" % (columns[0][k][0], columns[0][k][1],
+                                                  columns[1][k][1], columns[2][k][1]))
+        for emitter in EMITTERS:
+            imports, step, source = first_step(emitter, integer_mode, ticks_us, ticks_diff)
+            print("%-8s imports %8d us, first step after %8d us (%s)" % (emitter, imports, step, source))
+        print()
+
+if __name__ == '__main__':
+    run()
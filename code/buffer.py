@@ -1,28 +1,129 @@
+# Moments: the values are summed as integer multiples of 1/MOMENT_SCALE
+MOMENT_SHIFT = 10
+MOMENT_SCALE = 1 << MOMENT_SHIFT
+
 class CyclicBuffer:
-    def __init__(self, size):
+    """
+    Fixed-size window of the latest values with a running sum. With moments=True it also keeps
+    running sums of the squares and of the values weighted by their age, so that the variance,
+    the slope and the curvature over the window cost no scan of the buffer.
+
+    Attributes:
+        size (int): Length of the window.
+        count (int): Number of values held, up to size.
+        sum (float): Sum of the values held.
+        fixed (list): The values held as integer multiples of 1/MOMENT_SCALE (moments only, else None).
+        fixed_sum (int): Sum of the fixed values (moments only).
+        sum_squares (int): Sum of their squares (moments only).
+        weighted_sum (int): Sum of i * value, i counting steps from the oldest value (moments only).
+        weighted_sum2 (int): Sum of i * i * value (moments only).
+        append (method): append_moments when the moments are kept.
+    """
+
+    def __init__(self, size, moments=False):
         self.size = size
         self.buffer = [0.0] * size
+        self.fixed = [0] * size if moments else None
+        self.clear()
+        if moments:
+            self.append = self.append_moments
+
+    def clear(self):
+        """
+        Forgets the values held, reusing the storage.
+        """
+        for i in range(self.size):
+            self.buffer[i] = 0.0
+        if self.fixed is not None:
+            for i in range(self.size):
+                self.fixed[i] = 0
         self.index = 0
         self.count = 0
         self.sum = 0.0
+        self.fixed_sum = 0
+        self.sum_squares = 0
+        self.weighted_sum = 0
+        self.weighted_sum2 = 0
 
     def append(self, value):
-        # Remove the value being overwritten from the sum
-        overwritten = self.buffer[self.index]
-        self.sum -= overwritten
-        # Add the new value
-        self.buffer[self.index] = value
-        self.sum += value
-        # Move index
-        self.index = (self.index + 1) % self.size
+        index = self.index
+        buffer = self.buffer
+        # The value being overwritten leaves the sum, the new one enters it
+        self.sum = self.sum - buffer[index] + value
+        buffer[index] = value
+        index += 1
+        self.index = 0 if index == self.size else index
         # Update count (for first 'size' elements)
         if self.count < self.size:
             self.count += 1
 
+    def append_moments(self, value):
+        """
+        append() which also updates the moments in O(1). They are kept over the values rounded
+        to 1/MOMENT_SCALE as integers, which add up exactly: running float sums would carry the
+        rounding errors of every step along for as long as the buffer runs.
+        """
+        index = self.index
+        fixed = self.fixed
+        overwritten = fixed[index]
+        value_fixed = round(value * MOMENT_SCALE)
+        count = self.count
+        if count == self.size:
+            # The oldest value leaves (its weights are 0) and the others grow one step younger:
+            # i becomes i - 1, so i*i*y becomes i*i*y - 2*i*y + y
+            rest = self.fixed_sum - overwritten
+            self.weighted_sum2 += rest - 2 * self.weighted_sum
+            self.weighted_sum -= rest
+            count -= 1
+        self.fixed_sum += value_fixed - overwritten
+        self.sum_squares += value_fixed * value_fixed - overwritten * overwritten
+        self.weighted_sum += count * value_fixed
+        self.weighted_sum2 += count * count * value_fixed
+        fixed[index] = value_fixed
+        CyclicBuffer.append(self, value)
+
     def average(self):
         if self.count == 0:
             return 0.0
         return self.sum / self.count
 
+    def variance(self):
+        """
+        Variance of the values held (moments only).
+        """
+        count = self.count
+        if count == 0:
+            return 0.0
+        mean = self.fixed_sum / count
+        variance = (self.sum_squares / count - mean * mean) / (MOMENT_SCALE * MOMENT_SCALE)
+        # The division may round a zero variance below zero
+        return variance if variance > 0.0 else 0.0
+
+    def slope(self):
+        """
+        Change per step of the least-squares line through the values held (moments only).
+        """
+        n = self.count
+        if n < 2:
+            return 0.0
+        # Centred on the middle of the window, sum(t) = 0 and sum(t*t) = n(n*n - 1)/12
+        return (self.weighted_sum - 0.5 * (n - 1) * self.fixed_sum) * 12.0 / (n * (n * n - 1) * MOMENT_SCALE)
+
+    def curvature(self):
+        """
+        Second difference per step of the least-squares parabola through the values held
+        (moments only), 0 with fewer than three values.
+        """
+        n = self.count
+        if n < 3:
+            return 0.0
+        middle = 0.5 * (n - 1)
+        # Sums over t = i - middle, the odd powers of t sum to 0
+        t2 = n * (n * n - 1) / 12.0
+        t4 = t2 * (3 * n * n - 7) / 20.0
+        t2_sum = self.weighted_sum2 - 2.0 * middle * self.weighted_sum + middle * middle * self.fixed_sum
+        # y = a*t*t + b*t + c, the second difference is 2a
+        return 2.0 * (n * t2_sum - t2 * self.fixed_sum) / ((n * t4 - t2 * t2) * MOMENT_SCALE)
+
     def __len__(self):
-        return self.count
\ No newline at end of file
+        return self.count
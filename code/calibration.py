@@ -0,0 +1,142 @@
+import utime
+
+def record_extremes(sensors, motors=None, duration_ms=4000, sweep_speed=35.0, sweep_ms=300):
+    """
+    Records the lowest and highest raw voltage of every sensor while the sensors pass
+    over the line and the background. With motors given, the robot standing on the line
+    swings left and right in place; otherwise move it over the line by hand.
+    * sensors: Sensors to calibrate
+    * motors: Optional Motors to sweep the sensors with
+    * duration_ms: Length of the recording, rounded to whole swings so the robot ends facing the line
+    * sweep_speed: Speed of the swings in place
+    * sweep_ms: Duration of the first swing, later swings take twice as long to cross back
+    Returns (list of minima, list of maxima) in volts.
+    """
+    n = len(sensors.voltages)
+    lows = [5.0] * n
+    highs = [0.0] * n
+    raw = [0.0] * n
+
+    if motors is not None:
+        motors.start()
+        # Swings end at odd multiples of sweep_ms, the robot is back in the middle at even ones
+        duration_ms = max(2, int(duration_ms / (2 * sweep_ms) + 0.5) * 2) * sweep_ms
+    start = utime.ticks_ms()
+    swing_end = sweep_ms
+    direction = 1.0
+    try:
+        while True:
+            elapsed = utime.ticks_diff(utime.ticks_ms(), start)
+            if elapsed >= duration_ms:
+                break
+            if motors is not None:
+                if elapsed >= swing_end:
+                    direction = -direction
+                    swing_end += 2 * sweep_ms
+                motors.tight_turn(direction * sweep_speed, 1.0)
+
+            sensors.read_raw_voltages(raw)
+            for i in range(n):
+                if raw[i] < lows[i]:
+                    lows[i] = raw[i]
+                if raw[i] > highs[i]:
+                    highs[i] = raw[i]
+    finally:
+        if motors is not None:
+            motors.stop()
+    return lows, highs
+
+def thresholds_from_extremes(lows, highs, default_min, default_max, margin_low=0.3, margin_high=0.05, min_range=0.5):
+    """
+    Turns recorded extremes into per-sensor truncation thresholds. The lower threshold sits
+    margin_low of the sensor's range above its background level, so the floor noise is cut
+    off, and the upper one margin_high below its line level.
+    Sensors whose range is below min_range volts did not see both the line and the background
+    and keep the default thresholds.
+    Returns (list of threshold_min, list of threshold_max).
+    """
+    mins = []
+    maxs = []
+    for low, high in zip(lows, highs):
+        span = high - low
+        if span < min_range:
+            mins.append(default_min)
+            maxs.append(default_max)
+        else:
+            mins.append(low + margin_low * span)
+            maxs.append(high - margin_high * span)
+    return mins, maxs
+
+def save_thresholds(path, mins, maxs):
+    """
+    Writes the per-sensor thresholds to a file on the flash, one 'min max' line per sensor.
+    """
+    with open(path, 'w') as f:
+        for low, high in zip(mins, maxs):
+            f.write('%.4f %.4f\n' % (low, high))
+
+def load_thresholds(path, count):
+    """
+    Reads thresholds written by save_thresholds, one pair for each of count sensors.
+    Returns (list of threshold_min, list of threshold_max), or None if the file is missing or invalid.
+    """
+    mins = []
+    maxs = []
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) != 2:
+                    continue
+                low = float(fields[0])
+                high = float(fields[1])
+                if high <= low:
+                    return None
+                mins.append(low)
+                maxs.append(high)
+    except (OSError, ValueError):
+        return None
+    if len(mins) != count:
+        return None
+    return mins, maxs
+
+def save_settle(path, settle_us):
+    """
+    Writes the settle times of the mux to a file on the flash, one per line in scan order.
+    """
+    with open(path, 'w') as f:
+        for t in settle_us:
+            f.write('%d\n' % t)
+
+def load_settle(path, count=7):
+    """
+    Reads settle times written by save_settle.
+    Returns a list of settle times in microseconds in scan order, or None if the file is missing or invalid.
+    """
+    settle_us = []
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                t = int(line)
+                if t < 0:
+                    return None
+                settle_us.append(t)
+    except (OSError, ValueError):
+        return None
+    if len(settle_us) != count:
+        return None
+    return settle_us
+
+def calibrate(sensors, path, default_min, default_max, motors=None, duration_ms=4000):
+    """
+    Records the extremes, derives per-sensor thresholds, saves them to path and applies them to sensors.
+    Returns (list of threshold_min, list of threshold_max).
+    """
+    lows, highs = record_extremes(sensors, motors, duration_ms)
+    mins, maxs = thresholds_from_extremes(lows, highs, default_min, default_max)
+    save_thresholds(path, mins, maxs)
+    sensors.set_thresholds(mins, maxs)
+    return mins, maxs
@@ -0,0 +1,155 @@
+import sys
+import select
+
+# Commands setting a value: name -> (object, attribute), the object being 'pid', 'follower' or 'sensors'
+SETTINGS = {
+    'kp': ('pid', 'Kp'),
+    'kd': ('pid', 'Kd'),
+    'ki': ('pid', 'Ki'),
+    'base': ('follower', 'base_speed'),
+    'turn': ('follower', 'tight_turn_speed'),
+    'prop': ('follower', 'proportion'),
+    'kse': ('follower', 'k_se'),
+    'ksd': ('follower', 'k_sd'),
+    'eps': ('follower', 'epsilon'),
+    'epsu': ('follower', 'epsilon_upper'),
+    'tmin': ('sensors', 'threshold_min'),
+    'tmax': ('sensors', 'threshold_max'),
+}
+
+class Console:
+    """
+    Live tuning over the USB serial console while the control loop runs. Every `every` steps
+    the input is polled with a zero timeout; the characters waiting are then read into a line
+    buffer and a complete line is executed as a command:
+        kp -30      set a value (see SETTINGS), eps and epsu in volts on the 0-5 scale
+        dump        print all the values
+        help        print the commands
+    The values are changed in place on the live objects, so they hold until the next boot.
+    With a GAIN_SCHEDULE the gains are set from the schedule again at the next step, and with
+    lap learning the base speed is planned from the profile. Changing the thresholds in the
+    integer mode rebuilds the lookup table, which overruns the period it is done in.
+
+    Attributes:
+        follower (LineFollower): Loop body whose controller and constants are tuned.
+        sensors (Sensors): Sensors whose thresholds are tuned (not the SensorPipeline).
+        every (int): Steps between polls of the input.
+        countdown (int): Steps to the next poll.
+        stream: Input the commands are read from, a byte stream.
+        poller (poll): Poll object with the stream registered for input.
+        line (bytearray): Characters of the command being typed, up to its capacity.
+        length (int): Number of characters in line.
+        char (bytearray): One-byte buffer the input is read into.
+    """
+
+    def __init__(self, follower, sensors, every=10, stream=None, capacity=32):
+        """
+        * follower, sensors: The live objects, see the attributes
+        * every: Steps between polls of the input
+        * stream: Input, sys.stdin.buffer (the USB serial console) if not given
+        * capacity: Longest command, longer lines are cut
+        """
+        self.follower = follower
+        self.sensors = sensors
+        self.every = every
+        self.countdown = every
+        self.stream = stream if stream is not None else sys.stdin.buffer
+        self.poller = select.poll()
+        self.poller.register(self.stream, select.POLLIN)
+        self.line = bytearray(capacity)
+        self.length = 0
+        self.char = bytearray(1)
+
+    def poll(self):
+        """
+        Call once per step, after the step. Costs a countdown, and a poll every `every` steps.
+        Returns True if a command was executed.
+        """
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.every
+        if not self.poller.poll(0):
+            return False
+        return self.receive()
+
+    def receive(self):
+        """
+        Reads the characters waiting, executing every complete line.
+        Returns True if a command was executed.
+        """
+        executed = False
+        while self.poller.poll(0):
+            if not self.stream.readinto(self.char):
+                break
+            char = self.char[0]
+            if char == 10 or char == 13:
+                if self.length:
+                    self.execute(bytes(self.line[:self.length]).decode())
+                    self.length = 0
+                    executed = True
+            elif self.length < len(self.line):
+                self.line[self.length] = char
+                self.length += 1
+        return executed
+
+    def execute(self, command):
+        """
+        Runs one command line and prints the reply.
+        """
+        fields = command.split()
+        if not fields:
+            return
+        name = fields[0].lower()
+        if name == 'dump':
+            self.dump()
+        elif name == 'help':
+            print("commands: dump, help, or one of %s with a value" % ' '.join(sorted(SETTINGS)))
+        elif name in SETTINGS and len(fields) == 2:
+            try:
+                value = float(fields[1])
+            except ValueError:
+                print("not a number:", fields[1])
+                return
+            self.set(name, value)
+            print(name, self.get(name))
+        else:
+            print("unknown command:", command)
+
+    def target(self, name):
+        owner, attribute = SETTINGS[name]
+        if owner == 'pid':
+            return self.follower.pid_controller, attribute
+        if owner == 'sensors':
+            return self.sensors, attribute
+        return self.follower, attribute
+
+    def set(self, name, value):
+        """
+        Sets a value of SETTINGS on the live object.
+        """
+        obj, attribute = self.target(name)
+        if name == 'eps' or name == 'epsu':
+            value = self.sensors.to_sensor_units(value)
+        if name == 'tmin':
+            self.sensors.set_thresholds(value, self.sensors.threshold_max)
+        elif name == 'tmax':
+            self.sensors.set_thresholds(self.sensors.threshold_min, value)
+        else:
+            setattr(obj, attribute, value)
+        if name == 'ki':
+            obj.select_update()
+
+    def get(self, name):
+        """
+        Current value of a setting, eps and epsu in volts.
+        """
+        obj, attribute = self.target(name)
+        value = getattr(obj, attribute)
+        if (name == 'eps' or name == 'epsu') and self.sensors.integer_mode:
+            value = value / self.sensors.to_sensor_units(1.0)
+        return value
+
+    def dump(self):
+        for name in sorted(SETTINGS):
+            print(name, self.get(name))
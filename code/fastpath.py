@@ -0,0 +1,291 @@
+# Variants of the hot paths of the control loop compiled to machine code by the native and
+# viper emitters of MicroPython instead of being interpreted as bytecode. The emitters are
+# directives of the compiler and cannot be applied to the methods once they are compiled, so
+# the bodies are copies of those of the methods they replace. A change to a method must be
+# made to its copy too: python -m host.check_fastpath fails until the two are the same again.
+# On CPython (host/micropython.py) the decorators do nothing and the variants run as plain Python.
+import utime
+import micropython
+from backends import MuxADCBackend
+from buffer import CyclicBuffer
+from motors import Motors, DUTY_SCALE
+from pid import PIDController
+from profiler import STAGE_SCAN
+from sensors import Sensors, LOOKUP_SHIFT, FIXED_SHIFT, WEIGHT_SCALE
+
+# Code emitters of the hot paths, see select()
+EMITTERS = ('bytecode', 'native', 'viper')
+
+try:
+    ptr16
+except NameError:
+    # The pointer cast of the viper emitter, plain Python elsewhere
+    def ptr16(buffer):
+        return buffer
+
+# Sensors
+
+@micropython.native
+def read_frame_native(self, out):
+    scan_order = self.scan_order
+    scan_channels = self.scan_channels
+    settle_us = self.settle_us
+    adc = self.adc
+    for k in range(len(scan_order)):
+        self.switch_channel(scan_channels[k])
+        utime.sleep_us(settle_us[k])
+        out[scan_order[k]] = adc.read_u16()
+    return out
+
+@micropython.native
+def read_selected_native(self, out, selected):
+    scan_order = self.scan_order
+    scan_channels = self.scan_channels
+    settle_us = self.settle_us
+    adc = self.adc
+    for k in range(len(scan_order)):
+        i = scan_order[k]
+        if selected[i]:
+            self.switch_channel(scan_channels[k])
+            utime.sleep_us(settle_us[k])
+            out[i] = adc.read_u16()
+    return out
+
+@micropython.native
+def read_sensors_native(self):
+    raw = self.scan(self.raw)
+    if self.profiler is not None:
+        self.profiler.mark(STAGE_SCAN)
+
+    lookup = self.lookup
+    voltages = self.voltages
+    if lookup is not None:
+        for i in range(len(voltages)):
+            voltages[i] = lookup[raw[i] >> LOOKUP_SHIFT]
+    elif self.integer_mode:
+        for i in range(len(voltages)):
+            weight = ((raw[i] >> LOOKUP_SHIFT) * self.scales_fixed[i] + self.offsets_fixed[i]) >> FIXED_SHIFT
+            if weight < 0:
+                weight = 0
+            elif weight > 5 * WEIGHT_SCALE:
+                weight = 5 * WEIGHT_SCALE
+            voltages[i] = weight
+    else:
+        for i in range(len(voltages)):
+            voltages[i] = (raw[i] / 65535.0) * 5
+
+    self.get_truncated_and_smoothed_voltages()
+    return voltages
+
+@micropython.viper
+def _convert_lookup_viper(lookup, raw, voltages, n: int):
+    table = ptr16(lookup)
+    codes = ptr16(raw)
+    shift = int(LOOKUP_SHIFT)
+    for i in range(n):
+        voltages[i] = table[codes[i] >> shift]
+
+def read_sensors_viper(self):
+    # The table lookup of the integer mode typed, the other modes as read_sensors_native
+    lookup = self.lookup
+    if lookup is None:
+        return read_sensors_native(self)
+    raw = self.scan(self.raw)
+    if self.profiler is not None:
+        self.profiler.mark(STAGE_SCAN)
+    voltages = self.voltages
+    _convert_lookup_viper(lookup, raw, voltages, len(raw))
+    self.get_truncated_and_smoothed_voltages()
+    return voltages
+
+@micropython.native
+def truncate_native(self, voltage, i=0):
+    val = voltage * self.scales[i] + self.offsets[i]
+    if val < 0.0:
+        return 0.0
+    if val > 5.0:
+        return 5.0
+    return val
+
+@micropython.native
+def get_position_weighted_average_native(self, voltages=None):
+    if voltages is None:
+        voltages = self.voltages
+    if self.integer_mode:
+        total_weight = 0
+        weighted_sum = 0
+        for i in range(len(voltages)):
+            voltage = voltages[i]
+            total_weight += voltage
+            weighted_sum += (i + 1) * voltage
+        return weighted_sum / total_weight if total_weight != 0 else 0
+    total_weight = 0.0
+    weighted_sum = 0.0
+    for i in range(len(voltages)):
+        voltage = voltages[i]
+        total_weight += voltage
+        weighted_sum += float(i + 1) * voltage
+    return weighted_sum / total_weight if total_weight != 0 else 0
+
+@micropython.viper
+def _weighted_average_viper(voltages, n: int):
+    total_weight = 0
+    weighted_sum = 0
+    for i in range(n):
+        voltage = int(voltages[i])
+        total_weight += voltage
+        weighted_sum += (i + 1) * voltage
+    if total_weight == 0:
+        return 0.0
+    return float(weighted_sum) / float(total_weight)
+
+def get_position_weighted_average_viper(self, voltages=None):
+    # The integer weights summed as machine words, the float mode as the native variant
+    if voltages is None:
+        voltages = self.voltages
+    if self.integer_mode:
+        return _weighted_average_viper(voltages, len(voltages))
+    return get_position_weighted_average_native(self, voltages)
+
+# CyclicBuffer
+
+@micropython.native
+def append_native(self, value):
+    index = self.index
+    buffer = self.buffer
+    self.sum = self.sum - buffer[index] + value
+    buffer[index] = value
+    index += 1
+    self.index = 0 if index == self.size else index
+    if self.count < self.size:
+        self.count += 1
+
+@micropython.native
+def average_native(self):
+    if self.count == 0:
+        return 0.0
+    return self.sum / self.count
+
+# PIDController
+
+@micropython.native
+def update_pd_native(self, measured_value, dt=None):
+    if dt is None or dt <= 0:
+        dt = self.dt
+    error = self.setpoint - measured_value
+    derivative = (self.prev_measured - measured_value) / dt
+    self.prev_measured = measured_value
+    self.error = error
+    self.derivative = derivative
+    return self.Kp * error + self.Kd * derivative
+
+@micropython.native
+def update_pid_native(self, measured_value, dt=None):
+    if dt is None or dt <= 0:
+        dt = self.dt
+    error = self.setpoint - measured_value
+    derivative = (self.prev_measured - measured_value) / dt
+    self.prev_measured = measured_value
+    tau = self.derivative_tau
+    if tau > 0.0:
+        previous = self.derivative
+        derivative = previous + dt / (tau + dt) * (derivative - previous)
+    self.error = error
+    self.derivative = derivative
+
+    Ki = self.Ki
+    if Ki != 0.0:
+        integral = self.integral
+        if not self.saturated or Ki * error * self.output <= 0.0:
+            integral += error * dt
+            limit = self.integral_limit
+            if limit is not None and not -limit <= integral <= limit:
+                integral = limit if integral > 0.0 else -limit
+            self.integral = integral
+        output = self.Kp * error + self.Kd * derivative + Ki * integral
+    else:
+        output = self.Kp * error + self.Kd * derivative
+    self.output = output
+    return output
+
+# Motors
+
+@micropython.native
+def write_native(self, index, duty):
+    duties = self.duties
+    if duties[index] != duty:
+        duties[index] = duty
+        self.outputs[index].duty_u16(duty)
+
+@micropython.native
+def set_speeds_native(self, left_motor_speed, right_motor_speed):
+    gain = self.gain
+    left_motor_speed *= gain
+    right_motor_speed *= gain
+    self.saturated = not (-100.0 <= left_motor_speed <= 100.0 and -100.0 <= right_motor_speed <= 100.0)
+    if self.saturated:
+        left_motor_speed = max(min(left_motor_speed, 100.0), -100.0)
+        right_motor_speed = max(min(right_motor_speed, 100.0), -100.0)
+
+    slew_limit = self.slew_limit
+    if slew_limit is not None:
+        left_motor_speed = self.limit_reversal(self.left_speed, left_motor_speed, slew_limit)
+        right_motor_speed = self.limit_reversal(self.right_speed, right_motor_speed, slew_limit)
+    self.left_speed = left_motor_speed
+    self.right_speed = right_motor_speed
+
+    write = self.write
+    if left_motor_speed > 0:
+        write(0, int(left_motor_speed * DUTY_SCALE))
+        write(1, 0)
+    else:
+        write(0, 0)
+        write(1, int(-left_motor_speed * DUTY_SCALE))
+
+    if right_motor_speed > 0:
+        write(2, int(right_motor_speed * DUTY_SCALE))
+        write(3, 0)
+    else:
+        write(2, 0)
+        write(3, int(-right_motor_speed * DUTY_SCALE))
+
+@micropython.native
+def set_direction_native(self, base_speed, direction):
+    self.set_speeds(base_speed + direction, base_speed - direction)
+
+# Methods replaced by every emitter: (class, name, native variant, viper variant)
+VARIANTS = (
+    (MuxADCBackend, 'read_frame', read_frame_native, read_frame_native),
+    (MuxADCBackend, 'read_selected', read_selected_native, read_selected_native),
+    (Sensors, 'read_sensors', read_sensors_native, read_sensors_viper),
+    (Sensors, 'truncate', truncate_native, truncate_native),
+    (Sensors, 'get_position_weighted_average', get_position_weighted_average_native,
+     get_position_weighted_average_viper),
+    (CyclicBuffer, 'append', append_native, append_native),
+    (CyclicBuffer, 'average', average_native, average_native),
+    (PIDController, 'update_pd', update_pd_native, update_pd_native),
+    (PIDController, 'update_pid', update_pid_native, update_pid_native),
+    (Motors, 'write', write_native, write_native),
+    (Motors, 'set_speeds', set_speeds_native, set_speeds_native),
+    (Motors, 'set_direction', set_direction_native, set_direction_native),
+)
+
+# The interpreted methods, to go back to
+BYTECODE = [getattr(cls, name) for cls, name, _, _ in VARIANTS]
+
+def select(emitter):
+    """
+    Puts the variants of the given emitter in place of the methods, 'bytecode' restores
+    the interpreted ones. Methods bound in constructors (Sensors.get_position,
+    Sensors.scan, PIDController.update_output) follow for objects constructed afterwards.
+    """
+    if emitter not in EMITTERS:
+        raise ValueError("emitter must be 'bytecode', 'native' or 'viper'")
+    for k in range(len(VARIANTS)):
+        cls, name, native, viper = VARIANTS[k]
+        if emitter == 'native':
+            setattr(cls, name, native)
+        elif emitter == 'viper':
+            setattr(cls, name, viper)
+        else:
+            setattr(cls, name, BYTECODE[k])
@@ -0,0 +1,242 @@
+from buffer import CyclicBuffer
+from profiler import STAGE_TRUNCATE, STAGE_POSITION, STAGE_PID, STAGE_LOGIC, STAGE_PRINT, STAGE_MOTORS
+from telemetry import FLAG_TIGHT_TURN, FLAG_LEFT, FLAG_PAUSED, FLAG_STOPPED
+from recovery import RecoveryStateMachine, FOLLOWING, LOST_LEFT, LOST_RIGHT, REACQUIRE
+
+class LineFollower:
+    """
+    Body of the control loop: reads the sensors, runs the PD controller and drives the motors.
+    Handles the sharp turns by turning in place in the direction remembered from the
+    outermost sensors until any sensor sees the line again, as decided by the
+    RecoveryStateMachine.
+
+    Attributes:
+        sensors (Sensors): Sensor array.
+        motors (Motors): Motor driver.
+        pid_controller (PIDController): Controller of the line position, told about the motor
+            saturation and the speed after every step.
+        profiler (Profiler): Optional per-stage timing of the step, None when not profiling.
+        telemetry (Telemetry): Optional record of every step, None when not recording.
+        lap_profile (LapProfile): Optional lap learning which plans the base speed, None when not learning.
+        lookahead (LookAhead): Optional slowdown ahead of the curves predicted from the error history,
+            whose history is then the direction_buffer; None to react to the current error only.
+        recovery (RecoveryStateMachine): State of the lost-line recovery.
+        left (bool): Tells which direction we should turn if we lose the line next step.
+    """
+
+    def __init__(self, sensors, motors, pid_controller, middle_of_line=4.0, dt=0.01,
+                 epsilon=0.5, epsilon_upper=4.0, border_mode='average', n_direction_memory=10,
+                 k_se=0.15, k_sd=0.15, base_speed=100.0, tight_turn_speed=125.0, proportion=1.5,
+                 battery_constant=0.8, print_averages=False, profiler=None, telemetry=None, lap_profile=None,
+                 recovery=None, lookahead=None):
+        """
+        * sensors, motors, pid_controller: Initialized hardware and controller
+        * middle_of_line: Point we consider to be the desired position
+        * dt: Nominal time step in seconds, used when step() is not given the measured one
+        * epsilon: Lower sensor inputs are considered to not be on the line
+        * epsilon_upper: Higher sensor inputs are considered to be on the line
+        * border_mode: 'last' or 'average', how the direction of a sharp turn is decided
+        * n_direction_memory: Length of memory of the outermost sensors
+        * k_se, k_sd: Speed scaling for error and derivative values
+        * base_speed: The speed at which the robot moves when the line is perfectly aligned
+        * tight_turn_speed: The speed for tight turns
+        * proportion: Proportion of wheel speeds for tight turns
+        * battery_constant: Scaling of all motor speeds
+        * print_averages: Print the outermost sensor averages every step ('average' mode)
+        * profiler: Profiler to time the stages of the step with, also handed to the sensors
+        * telemetry: Telemetry to record the state of every step into
+        * lap_profile: LapProfile recording the track on the first run and planning the base speed on later ones
+        * recovery: RecoveryStateMachine with the timing of the lost-line recovery, the original
+          behaviour if not given
+        * lookahead: LookAhead lowering the speed before the curves
+        """
+        self.sensors = sensors
+        self.motors = motors
+        self.pid_controller = pid_controller
+        self.middle_of_line = middle_of_line
+        self.dt = dt
+        # Thresholds in the units of sensors.voltages
+        self.epsilon = sensors.to_sensor_units(epsilon)
+        self.epsilon_upper = sensors.to_sensor_units(epsilon_upper)
+        self.border_mode = border_mode
+        self.n_direction_memory = n_direction_memory
+        self.k_se = k_se
+        self.k_sd = k_sd
+        self.base_speed = base_speed
+        self.tight_turn_speed = tight_turn_speed
+        self.proportion = proportion
+        self.battery_constant = battery_constant
+        self.print_averages = print_averages
+        self.profiler = profiler
+        sensors.profiler = profiler
+        self.telemetry = telemetry
+        self.lap_profile = lap_profile
+        self.recovery = recovery if recovery is not None else RecoveryStateMachine()
+        self.lookahead = lookahead
+
+        # Initialize turn detection variables
+        self.direction_buffer = CyclicBuffer(5) if lookahead is None else lookahead.history
+        self.left_sensor_readings = CyclicBuffer(n_direction_memory)
+        self.right_sensor_readings = CyclicBuffer(n_direction_memory)
+        self.steps_line_right = 0       # Number of time steps since line was read by leftmost sensor
+        self.steps_line_left = 0        # Number of time steps since line was read by rightmost sensor
+
+        # Robot state flags
+        self.left = True                # Tells which direction we should turn if we lose the line next step
+
+    def reset(self):
+        """
+        Forgets the error history, the controller state and the smoothed readings, called after the robot is turned off.
+        """
+        # The buffers are cleared in place, so that stopping allocates nothing
+        if self.lookahead is not None:
+            self.lookahead.reset()
+        else:
+            self.direction_buffer.clear()
+        self.sensors.reset_smoothing()
+        self.recovery.reset()
+        self.pid_controller.reset()
+
+    def step(self, dt=None):
+        """
+        Executes one time step of the control loop.
+        * dt: Measured time since the previous step in seconds, self.dt if not given
+        """
+        sensors = self.sensors
+        motors = self.motors
+        profiler = self.profiler
+
+        sensors.read_sensors()
+        if profiler is not None:
+            profiler.mark(STAGE_TRUNCATE)
+        position_weighted_average = sensors.get_current_line_position()
+        if profiler is not None:
+            profiler.mark(STAGE_POSITION)
+
+        pid_controller = self.pid_controller
+        control_output = pid_controller.update_output(position_weighted_average, dt)
+        error = pid_controller.error
+        derivative = pid_controller.derivative
+        if profiler is not None:
+            profiler.mark(STAGE_PID)
+        base_speed = self.base_speed if self.lap_profile is None else self.lap_profile.base_speed(self.base_speed)
+        speed = base_speed / (1 + self.k_se * abs(error) + self.k_sd * abs(derivative))
+
+        # If all sensors do not see the line or all see the line, make a tight turn to get back on the line
+        # One pass without a generator, which would allocate every step
+        all_off_line = True
+        all_on_line = True
+        epsilon = self.epsilon
+        epsilon_upper = self.epsilon_upper
+        for voltage in sensors.voltages:
+            if voltage >= epsilon:
+                all_off_line = False
+            if voltage <= epsilon_upper:
+                all_on_line = False
+        state = self.recovery.update(not (all_off_line or all_on_line), self.left)
+        if state == LOST_LEFT or state == LOST_RIGHT:
+            if profiler is not None:
+                profiler.mark(STAGE_LOGIC)
+            # A neutral update to the PID controller and error buffer
+            pid_controller.update_output(self.middle_of_line, dt)
+            if profiler is not None:
+                profiler.mark(STAGE_PID)
+            self.direction_buffer.append(0.0)
+            if state == LOST_LEFT:
+                motors.tight_turn(-self.battery_constant * self.tight_turn_speed, self.proportion)
+            else:
+                motors.tight_turn(self.battery_constant * self.tight_turn_speed, self.proportion)
+            if profiler is not None:
+                profiler.mark(STAGE_MOTORS)
+            if self.lap_profile is not None:
+                self.lap_profile.update(self.dt if dt is None else dt, motors.left_speed, motors.right_speed,
+                                        error, control_output, True)
+            if self.telemetry is not None:
+                self.record(position_weighted_average, error, derivative, FLAG_TIGHT_TURN)
+            return
+
+        # Brake the spinning after ending the sharp turn (or stay stopped) instead of following
+        if state != FOLLOWING:
+            if profiler is not None:
+                profiler.mark(STAGE_LOGIC)
+            if state == REACQUIRE:
+                # Pulse against the turn which found the line, a zero pulse just stops the wheels
+                brake = self.recovery.brake_gain * self.battery_constant * self.tight_turn_speed
+                motors.start()
+                motors.tight_turn(brake if self.recovery.turned_left else -brake, self.proportion)
+                flags = FLAG_PAUSED
+            else:
+                motors.stop()
+                flags = FLAG_STOPPED
+            if profiler is not None:
+                profiler.mark(STAGE_MOTORS)
+            if self.lap_profile is not None:
+                self.lap_profile.update(self.dt if dt is None else dt, motors.left_speed, motors.right_speed,
+                                        error, control_output, False)
+            if self.telemetry is not None:
+                self.record(position_weighted_average, error, derivative, flags)
+            return
+
+        if self.border_mode == 'last':
+
+            if sensors.voltages[0] > self.epsilon_upper:
+                self.steps_line_left = 0
+            else:
+                self.steps_line_left += 1
+
+            if sensors.voltages[-1] > self.epsilon_upper:
+                self.steps_line_right = 0
+            else:
+                self.steps_line_right += 1
+
+            if self.steps_line_left < self.steps_line_right:
+                self.left = True
+            else:
+                self.left = False
+
+        if self.border_mode == 'average':
+
+            self.left_sensor_readings.append(max(sensors.voltages[0], 0.0))
+            self.right_sensor_readings.append(max(sensors.voltages[-1], 0.0))
+
+            if self.print_averages:
+                if profiler is not None:
+                    profiler.mark(STAGE_LOGIC)
+                print('l=' + str(self.left_sensor_readings.average() + 1.0) + ' r=' + str(self.right_sensor_readings.average() + 1.0))
+                if profiler is not None:
+                    profiler.mark(STAGE_PRINT)
+
+            if self.left_sensor_readings.average() > self.right_sensor_readings.average():
+                self.left = True
+            else:
+                self.left = False
+
+        self.direction_buffer.append(error)
+        if self.lookahead is not None:
+            # Slow down ahead of a curve predicted from the error history
+            speed *= self.lookahead.update()
+
+        if profiler is not None:
+            profiler.mark(STAGE_LOGIC)
+        motors.set_direction(self.battery_constant * speed, self.battery_constant * control_output)
+        pid_controller.saturated = motors.saturated
+        if pid_controller.gain_tables is not None:
+            pid_controller.set_speed(speed)
+        if profiler is not None:
+            profiler.mark(STAGE_MOTORS)
+        if self.lap_profile is not None:
+            self.lap_profile.update(self.dt if dt is None else dt, motors.left_speed, motors.right_speed,
+                                    error, control_output, False)
+        if self.telemetry is not None:
+            self.record(position_weighted_average, error, derivative, 0)
+
+    def record(self, position, error, derivative, flags):
+        """
+        Adds the state of the step to the telemetry.
+        """
+        if self.left:
+            flags |= FLAG_LEFT
+        self.telemetry.record(self.sensors.voltages, position, error, derivative,
+                              self.motors.left_speed, self.motors.right_speed, flags)
+        if self.profiler is not None:
+            self.profiler.mark(STAGE_PRINT)
@@ -0,0 +1,194 @@
+from array import array
+
+# Flags of the bins of the profile
+EVENT_TIGHT_TURN = 1    # The line was lost (or all sensors saw it) in the bin
+
+class LapProfile:
+    """
+    Lap learning. On the first run the profile of the track is recorded: mean line error,
+    mean steering output and the sharp turns, in bins of driven progress. On later runs the
+    progress is matched against the recorded profile and the base speed is planned ahead:
+    faster on the known straights and slower from a few bins before the known sharp turns.
+
+    Progress is the integral of the commanded forward speed (in speed percent times seconds),
+    which grows with the distance driven whatever the speed is, so a faster run stays matched.
+    It is pulled back to the recorded sharp turns whenever the robot loses the line near one.
+
+    Attributes:
+        recording (bool): True while recording the profile, False while following it.
+        bin_progress (float): Progress covered by one bin of the profile.
+        count (int): Number of bins recorded.
+        errors (array('H')): Mean absolute line error of every bin, in thousandths.
+        outputs (array('H')): Mean absolute control output of every bin, in hundredths.
+        events (array('B')): EVENT_* flags of every bin.
+        plan (array('f')): Base speed planned for every bin while following.
+        progress (float): Progress since the start of the run.
+    """
+
+    def __init__(self, capacity=1024, bin_progress=4.0, straight_speed=125.0, turn_speed=60.0,
+                 curve_gain=0.005, lookahead_bins=4, sync_bins=15):
+        """
+        * capacity: Maximum number of bins, the profile ends there
+        * bin_progress: Progress covered by one bin
+        * straight_speed: Base speed planned for a straight
+        * turn_speed: Base speed planned for a sharp turn
+        * curve_gain: Reduction of the planned speed per unit of the recorded control output
+        * lookahead_bins: Number of bins ahead whose speed limit already applies, to brake in time
+        * sync_bins: How many bins away from the progress a recorded sharp turn can be matched
+        """
+        self.capacity = capacity
+        self.bin_progress = bin_progress
+        self.straight_speed = straight_speed
+        self.turn_speed = turn_speed
+        self.curve_gain = curve_gain
+        self.lookahead_bins = lookahead_bins
+        self.sync_bins = sync_bins
+
+        self.errors = array('H', [0] * capacity)
+        self.outputs = array('H', [0] * capacity)
+        self.events = array('B', [0] * capacity)
+        self.plan = array('f', [0.0] * capacity)
+        self.count = 0
+        self.recording = True
+        self.restart()
+
+    def restart(self):
+        """
+        Starts a new run from the start line.
+        """
+        self.progress = 0.0
+        self.bin_error = 0.0
+        self.bin_output = 0.0
+        self.bin_steps = 0
+        self.bin_events = 0
+        self.in_turn = False
+
+    def update(self, dt, left_speed, right_speed, error, control_output, tight_turn):
+        """
+        Advances the progress by one control step and records the step into the profile.
+        * dt: Duration of the step in seconds
+        * left_speed, right_speed: Speeds commanded to the motors in the step
+        * error, control_output: Line error and output of the controller
+        * tight_turn: Whether the step turned in place because the line was lost
+        """
+        forward = (left_speed + right_speed) * 0.5
+        if forward > 0.0:
+            self.progress += forward * dt
+
+        if not self.recording:
+            if tight_turn and not self.in_turn:
+                self.synchronize()
+            self.in_turn = tight_turn
+            return
+
+        self.bin_error += abs(error)
+        self.bin_output += abs(control_output)
+        self.bin_steps += 1
+        if tight_turn:
+            self.bin_events |= EVENT_TIGHT_TURN
+        while self.count < self.capacity and self.progress >= (self.count + 1) * self.bin_progress:
+            steps = self.bin_steps if self.bin_steps else 1
+            self.errors[self.count] = min(int(self.bin_error / steps * 1000), 65535)
+            self.outputs[self.count] = min(int(self.bin_output / steps * 100), 65535)
+            self.events[self.count] = self.bin_events
+            self.count += 1
+            self.bin_error = 0.0
+            self.bin_output = 0.0
+            self.bin_steps = 0
+            self.bin_events = 0
+
+    def synchronize(self):
+        """
+        Moves the progress to the start of the nearest recorded sharp turn, if there is one
+        within sync_bins, as the robot has just lost the line.
+        """
+        index = int(self.progress / self.bin_progress)
+        best = -1
+        for distance in range(self.sync_bins + 1):
+            for candidate in (index - distance, index + distance):
+                if 0 <= candidate < self.count and self.events[candidate] & EVENT_TIGHT_TURN \
+                        and (candidate == 0 or not self.events[candidate - 1] & EVENT_TIGHT_TURN):
+                    best = candidate
+                    break
+            if best >= 0:
+                break
+        if best >= 0:
+            self.progress = best * self.bin_progress
+
+    def base_speed(self, default):
+        """
+        Returns the planned base speed at the current progress, or default while recording
+        and past the end of the profile.
+        """
+        if self.recording:
+            return default
+        index = int(self.progress / self.bin_progress)
+        if index >= self.count:
+            return default
+        return self.plan[index]
+
+    def finish(self):
+        """
+        Ends the recording, plans the speeds and switches to following the profile.
+        """
+        self.recording = False
+        self.plan_speeds()
+        self.restart()
+
+    def plan_speeds(self):
+        """
+        Plans the base speed of every bin: the speed limit of a bin falls with its recorded
+        control output and is turn_speed in the sharp turns, and every bin takes the lowest
+        limit of the lookahead_bins after it.
+        """
+        plan = self.plan
+        for i in range(self.count):
+            if self.events[i] & EVENT_TIGHT_TURN:
+                plan[i] = self.turn_speed
+            else:
+                limit = self.straight_speed / (1.0 + self.curve_gain * self.outputs[i] / 100.0)
+                plan[i] = max(limit, self.turn_speed)
+        # Forwards, so the bins after i still hold their own limits
+        for i in range(self.count):
+            end = min(i + self.lookahead_bins + 1, self.count)
+            lowest = plan[i]
+            for j in range(i + 1, end):
+                if plan[j] < lowest:
+                    lowest = plan[j]
+            plan[i] = lowest
+
+    def save(self, path):
+        """
+        Writes the recorded profile to a file on the flash.
+        """
+        with open(path, 'wb') as f:
+            f.write(array('f', [self.bin_progress]))
+            f.write(array('H', [self.count]))
+            f.write(memoryview(self.errors)[:self.count])
+            f.write(memoryview(self.outputs)[:self.count])
+            f.write(memoryview(self.events)[:self.count])
+
+    def load(self, path):
+        """
+        Reads a profile written by save() and switches to following it.
+        Returns False, and keeps recording, if the file is missing or invalid.
+        """
+        header = array('f', [0.0])
+        count = array('H', [0])
+        try:
+            with open(path, 'rb') as f:
+                if f.readinto(header) != 4 or f.readinto(count) != 2:
+                    return False
+                n = count[0]
+                if n == 0 or n > self.capacity:
+                    return False
+                if f.readinto(memoryview(self.errors)[:n]) != 2 * n \
+                        or f.readinto(memoryview(self.outputs)[:n]) != 2 * n \
+                        or f.readinto(memoryview(self.events)[:n]) != n:
+                    return False
+        except OSError:
+            return False
+        self.bin_progress = header[0]
+        self.count = n
+        self.finish()
+        return True
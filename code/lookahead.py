@@ -0,0 +1,77 @@
+from buffer import CyclicBuffer
+
+class LookAhead:
+    """
+    Anticipates curves from the history of the line error. A parabola fitted to the last
+    errors (kept in O(1) by the running moments of CyclicBuffer) gives their trend and second
+    difference, which extrapolate the error a few steps ahead. While the line is heading for
+    the outer sensors the speed is lowered before it gets there, and once the trend flattens
+    the speed is raised again gradually.
+
+    Attributes:
+        window (int): Number of errors the trend is fitted to.
+        history (CyclicBuffer): The last errors with their moments, the direction_buffer of the LineFollower.
+        horizon (float): Steps ahead the error is extrapolated to.
+        margin (float): Predicted error (in sensor spacings) from which the speed is lowered.
+        edge (float): Predicted error at which the speed is lowered to min_scale, the outer sensors.
+        min_scale (float): Smallest speed factor.
+        recover (float): Share of the way back to the target speed factor made per step.
+        scale (float): Speed factor of the last step.
+        predicted (float): Error extrapolated in the last step.
+    """
+
+    def __init__(self, window=8, horizon=5.0, margin=1.5, edge=3.0, min_scale=0.4, recover=0.2):
+        """
+        * window: Number of errors the trend is fitted to, at least 3
+        * horizon: Steps ahead the error is extrapolated to
+        * margin: Predicted error from which the speed is lowered
+        * edge: Predicted error at which the speed is lowest, the position of the outer sensors
+        * min_scale: Speed factor at the edge
+        * recover: Share of the way back to full speed made per step once the trend flattens
+        """
+        assert window >= 3, "The window must hold at least three errors"
+        assert edge > margin, "The edge must lie beyond the margin"
+        self.window = window
+        self.horizon = horizon
+        self.margin = margin
+        self.edge = edge
+        self.min_scale = min_scale
+        self.recover = recover
+        self.history = None
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the error history and returns to full speed.
+        """
+        if self.history is None:
+            self.history = CyclicBuffer(self.window, moments=True)
+        else:
+            self.history.clear()
+        self.scale = 1.0
+        self.predicted = 0.0
+
+    def update(self):
+        """
+        Extrapolates the error from the history, to which the error of this step was appended.
+        Returns the factor of the speed.
+        """
+        history = self.history
+        error = history.buffer[history.index - 1]
+        horizon = self.horizon
+        predicted = error + history.slope() * horizon + 0.5 * history.curvature() * horizon * horizon
+        self.predicted = predicted
+
+        target = 1.0
+        # Only when the line moves outwards, a trend back to the middle needs no braking
+        if abs(predicted) > abs(error) and abs(predicted) > self.margin:
+            excess = (abs(predicted) - self.margin) / (self.edge - self.margin)
+            target = self.min_scale if excess >= 1.0 else 1.0 - (1.0 - self.min_scale) * excess
+
+        scale = self.scale
+        if target < scale:
+            scale = target
+        else:
+            scale += self.recover * (target - scale)
+        self.scale = scale
+        return scale
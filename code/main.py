@@ -1,16 +1,51 @@
-from time import sleep
-import time
+from utime import sleep
+import utime as time
 from sensors import Sensors
+from backends import IOExpanderBackend
 from motors import Motors
 from pid import PIDController
-from buffer import CyclicBuffer
-import _thread
-from machine import Pin, time_pulse_us
+from follower import LineFollower
+from profiler import Profiler
+import calibration
+import autotune
+from pipeline import SensorPipeline
+from scheduler import Scheduler
+from telemetry import Telemetry, FLAG_RAW
+from lap_profile import LapProfile
+from battery import Battery
+from recovery import RecoveryStateMachine
+from lookahead import LookAhead
+from remote import Remote
+from console import Console
+from memory import MemoryManager
+import micropython
 
 DEBUG = False
 # MODE = 'line pos'
 MODE = 'sensor voltages'
-# MODE='remote'
+# MODE = 'raw frames'   # Record unprocessed readings into the telemetry for host/replay.py (push the robot along the track)
+# MODE='remote'        # Print the state of the remote and the length of the last pulse
+
+AUTOTUNE = False        # Tune Kp, Kd and BASE_SPEED with a relay test at boot (on a straight line), print and save them
+AUTOTUNE_FILE = 'gains.txt'   # Tuned constants on the flash, used in place of Kp, Kd and BASE_SPEED; delete it to go back
+AUTOTUNE_RULE = 'tl'    # 'zn' (Ziegler-Nichols), 'tl' (Tyreus-Luyben, damped) or 'no_overshoot'
+AUTOTUNE_SPEED = 60.0   # Base speed of the relay test
+AUTOTUNE_RELAY = 20.0   # Steering of the relay test, either way
+
+DUAL_CORE = False       # Scan the sensors on the second core
+CONSOLE = False         # Take tuning commands (kp -30, base 110, eps 0.4, dump, help) on the USB serial while running
+CONSOLE_EVERY = 10      # Control steps between polls of the console input
+HOT_PATHS = 'native'    # Emitter of the hot paths in fastpath.py: 'native', 'viper' (integer sensors) or 'bytecode'
+
+PROFILE = False         # Time the stages of every step and dump the statistics when stopped
+PROFILE_FILE = None     # Path on the flash to write the dump to, e.g. 'profile.txt'; None prints it
+REPORT_JITTER = True    # Print the missed deadlines and jitter of the control loop when stopped
+GC_CONTROL = False      # No automatic garbage collection while running, collect in the slack at the end of a period
+GC_COLLECT_US = 2000    # Initial time budgeted for a collection, grows to the longest one measured
+GC_RESERVE = 16384      # Free heap bytes below which a collection is forced even without the time for it
+TELEMETRY = True        # Record every step into a ring buffer instead of printing (read with host/telemetry_decode.py)
+TELEMETRY_RECORDS = 512 # Number of most recent steps kept
+TELEMETRY_FILE = None   # Path on the flash to write the records to when stopped, e.g. 'telemetry.bin'; None prints them
 
 # Pins for the motors, multiplexer and remote control
 motor_pins = {
@@ -25,6 +60,9 @@ select_pins = (27, 12, 13)
 adc_pin = 28 
 
 rc_pin = 26
+REMOTE = False              # Start and stop with the IR remote on rc_pin; False runs at once
+REMOTE_TOGGLE_US = 50000    # Pulses longer than this (us) toggle the robot on and off, shorter ones are noise
+REMOTE_ACTIVE_LEVEL = 1     # Level of rc_pin during a pulse
 
 # Mapping of sensor position to multiplexer channel
 # leftmost sensor is at 1.0 and rightmost is at 7.0
@@ -43,13 +81,34 @@ positions_to_mux_channel = [5, 0, 1, 2, 3, 4, 6]
 # Sensor constants
 THRESHOLD_MIN = 3.4      # Minimun voltage for sensor input thresholding
 THRESHOLD_MAX = 5.0     # Maximum voltage for sensor input thresholding
+CALIBRATION_FILE = 'calibration.txt'  # Per-sensor thresholds on the flash, used instead of the two above if present
+CALIBRATE_THRESHOLDS = False  # Swing over the line at boot, save new per-sensor thresholds (robot standing on the line)
 EPSILON = 0.5           # Lower sensor inputs are considered to not be on the line
 EPSILON_UPPER = 4.      # Higher sensor inputs are considered to be on the line
 N_smoothing_memory = 2  # Length of memory buffer for sensor smoothing
 smoothing_alpha = 0.99  # Alpha parameter for sensor smoothing
+smoothing_mode = 'ema'  # Exponential moving average with smoothing_alpha
+# smoothing_mode = 'window'  # Mean of the last N_smoothing_memory readings
+# smoothing_mode = None
+INTEGER_SENSORS = False # Integer sensor pipeline: lookup table from raw ADC codes, integer line position
+POSITION_MODE = 'average'   # Line position from the weighted average of all sensors
+# POSITION_MODE = 'centroid'  # Weighted average of the strongest sensor and its neighbours, ignores reflections
+# POSITION_MODE = 'peak'      # Parabola through the strongest sensor and its neighbours
 # border_mode = 'last'
 border_mode = 'average'
 N_direction_memory = 10
+MUX_SETTLE_US = 250     # Settle time after switching the multiplexer, upper bound for calibration
+CALIBRATE_SETTLE = False # Measure the settle time of every channel at boot and save it (robot standing on the line)
+SETTLE_FILE = 'settle.txt'  # Measured settle times on the flash, used instead of MUX_SETTLE_US if present
+ADAPTIVE_SCAN = False   # Read only the sensors around the line, all of them every FULL_SCAN_EVERY steps or when the line leaves them
+FULL_SCAN_EVERY = 20    # Control steps between full scans of the adaptive scan
+SCAN_MARGIN = 1         # Sensors read on either side of those which saw the line in the previous step
+SENSOR_BACKEND = 'mux'  # 'mux' for the sensors behind the multiplexer, 'ioexpander' for a Pimoroni IO expander breakout
+# The expander variant has five sensors on a 3.3 V supply: set middle_of_line to 3.0 and the thresholds to that scale
+IOE_PINS = (13, 11, 9, 7, 10)   # Expander pins of the sensors, left to right
+IOE_I2C_PINS = {"sda": 12, "scl": 13}   # Breakout Garden socket
+IOE_ADDRESS = 0x18
+IOE_BURST = True        # Read both ADC result registers in one transfer, False if the firmware does not advance the register
 
 # Motor speed constants
 K_se = 0.15              # Speed scaling for error values
@@ -57,47 +116,78 @@ K_sd = 0.15             # Speed scaling for derivative values
 TIGHT_TURN_SPEED = 125.0 # The speed for tight turns
 BASE_SPEED = 100.0         # The speed at which the robot moves when the line is perfectly aligned
 PROPORTION = 1.5        # Proportion of wheel speeds for tight turns
+RECOVERY_BRAKE_STEPS = 1    # Steps of braking after the line is found again, 0 to follow it at once
+RECOVERY_BRAKE_GAIN = 0.3   # Braking pulse against the turn as a share of TIGHT_TURN_SPEED, 0 stops the wheels
+RECOVERY_LOST_TIMEOUT = None  # Steps of searching for the line after which the robot stops, None for never
+MOTOR_SLEW_LIMIT = None # Largest change of a wheel speed per step when it reverses (e.g. 40.0), None for no limit
+
+# Lap learning: record the track on the first run, plan the base speed ahead on later runs
+LAP_LEARNING = False
+LAP_FILE = 'lap_profile.bin'  # Profile on the flash, delete it to record the track again
+LAP_STRAIGHT_SPEED = 125.0    # Base speed planned on the known straights
+LAP_TURN_SPEED = 60.0         # Base speed planned in the known sharp turns
+LAP_CURVE_GAIN = 0.005        # Reduction of the planned speed with the recorded steering
+LAP_LOOKAHEAD_BINS = 4        # Braking starts this many bins (about 2.5 cm each) before a slower one
+
+# Curve look-ahead: slow down when the error history predicts the line reaching the outer sensors
+LOOKAHEAD = False
+LOOKAHEAD_WINDOW = 8          # Number of errors the trend and its second difference are fitted to
+LOOKAHEAD_HORIZON = 5.0       # Steps ahead the error is extrapolated to
+LOOKAHEAD_MARGIN = 1.5        # Predicted error (sensor spacings) from which the speed is lowered
+LOOKAHEAD_MIN_SCALE = 0.4     # Speed factor when the line is predicted at the outer sensors
+LOOKAHEAD_RECOVER = 0.2       # Share of the way back to full speed per step once the trend flattens
 
 # PID constants
 middle_of_line = 4.0    # Point we consider to be the desired position
-dt = 0.01               # Time step in seconds
+dt = 0.01               # Time step in seconds (period of the control loop, e.g. 0.002-0.005 for 200-500 Hz)
 Kp = -25.0               # Proportional gain
 Kd = -0.4               # Derivative gain
 Ki = -0.0              # Integral gain
+KD_TAU = 0.0            # Time constant of the derivative filter in seconds, 0 for the raw derivative
+INTEGRAL_LIMIT = None   # Largest magnitude of the integral (anti-windup), None for no limit
+GAIN_SCHEDULE = None    # (speed, Kp, Kd, Ki) points to schedule the gains on the speed, None for the fixed gains above
+# GAIN_SCHEDULE = ((40.0, -20.0, -0.4, 0.0), (100.0, -25.0, -0.4, 0.0))
 
 battery_constant = 0.8
 # 8.86 - 0.47
 # 7.54 - 1.0
 
+# Battery voltage compensation, replaces battery_constant when on
+BATTERY_COMPENSATION = False
+BATTERY_MUX_CHANNEL = 7     # Spare multiplexer input wired to the battery through a divider
+BATTERY_DIVIDER = 3.0       # Battery volts per volt at the ADC, e.g. 3.0 for a 20k/10k divider
+BATTERY_GAIN_POINTS = ((7.54, 1.0), (8.86, 0.47))  # (battery voltage, speed gain) measured by hand, as above
+BATTERY_SAMPLE_STEPS = 50   # Control steps between battery samples
 
-# Shared pulse signal and result
-shared = {"new_pulse": False, "pulse_len": 0}
-lock = _thread.allocate_lock()
 
-def pulse_reader(rc_PIN, lock, shared):
-    while True:
-        # Read the pulse duration (blocking)
-        pulse = time_pulse_us(rc_PIN, 1, 1000000)
-        if pulse > 0:
-            with lock:
-                if shared["new_pulse"] == False:
-                    shared["pulse_len"] = pulse
-                    shared["new_pulse"] = True
-        sleep(0.01)
+raw_voltages = None     # Buffer of the 'raw frames' debug mode, one value per sensor, allocated with the sensors
 
-
-def debug(mode, new_is_on, sensors):
+def debug(mode, new_is_on, sensors, telemetry=None, remote=None):
     start_time = time.ticks_ms()           
-    sensors.read_sensors()
-    print(sensors.voltages)
-    if mode=='line pos':
-        print(sensors.get_current_line_position())    
-        
-    if mode=='sensor voltages':
-        output = ''
-        for sensor in range(7):
-            output += 's'+str(int(sensor)) + '=' + str(sensors.voltages[sensor]) + ' '
-        print(output)
+    if mode == 'raw frames':
+        # Readings before the thresholds and smoothing, to try other settings on them offline
+        sensors.read_raw_voltages(raw_voltages)
+        if telemetry is not None:
+            telemetry.record(raw_voltages, 0.0, 0.0, 0.0, 0.0, 0.0, FLAG_RAW)
+            telemetry.drain(32)
+        else:
+            print(raw_voltages)
+    else:
+        sensors.read_sensors()
+        if telemetry is not None and mode != 'remote':
+            # Record the frame and print the records in bulk instead of formatting every frame
+            telemetry.record(sensors.voltages, sensors.get_current_line_position(), 0.0, 0.0, 0.0, 0.0, 0)
+            telemetry.drain(32)
+        else:
+            print(sensors.voltages)
+            if mode=='line pos':
+                print(sensors.get_current_line_position())    
+                
+            if mode=='sensor voltages':
+                output = ''
+                for sensor in range(len(sensors.voltages)):
+                    output += 's'+str(int(sensor)) + '=' + str(sensors.voltages[sensor]) + ' '
+                print(output)
     end_time = time.ticks_ms()
     elapsed_time_ms = time.ticks_diff(end_time, start_time)
     elapsed_time_s = elapsed_time_ms / 1000.0
@@ -106,144 +196,210 @@ def debug(mode, new_is_on, sensors):
         sleep_time = dt - elapsed_time_s
         sleep(sleep_time)
     if mode=='remote':
-        rc_PIN = Pin(rc_pin, Pin.IN)
-        if not rc_PIN.value():
-            new_is_on = False if new_is_on else True
-            sleep(0.3)
-        print(new_is_on)
-        return new_is_on
+        print(remote.is_on, remote.last_pulse_us)
+        return remote.is_on
     return False
 
 
 if __name__ == "__main__":
 
-    # Initialize remote control
-    rc_PIN = Pin(rc_pin, Pin.IN)
-    #_thread.start_new_thread(pulse_reader, [rc_PIN, lock, shared])
+    # Compile the hot paths to machine code before the objects using them are created
+    if HOT_PATHS != 'bytecode':
+        try:
+            import fastpath
+            fastpath.select(HOT_PATHS)
+        except (ImportError, SyntaxError) as error:
+            # Firmware without the native emitters runs the interpreted methods
+            print("Hot paths: bytecode,", error)
+
+    # Initialize the remote control, decoded from pin interrupts
+    remote = None
+    if REMOTE or (DEBUG and MODE == 'remote'):
+        micropython.alloc_emergency_exception_buf(100)
+        remote = Remote(rc_pin, toggle_us=REMOTE_TOGGLE_US, active_level=REMOTE_ACTIVE_LEVEL)
 
     # Initialize motors, sensors
-    motors = Motors(motor_pins, motor_enable_pins)
+    motors = Motors(motor_pins, motor_enable_pins, slew_limit=MOTOR_SLEW_LIMIT)
+    motors.start()
+    backend = None
+    if SENSOR_BACKEND == 'ioexpander':
+        from pimoroni_i2c import PimoroniI2C
+        from breakout_ioexpander import BreakoutIOExpander
+        i2c = PimoroniI2C(**IOE_I2C_PINS)
+        backend = IOExpanderBackend(i2c, IOE_PINS, IOE_ADDRESS, ioe=BreakoutIOExpander(i2c, address=IOE_ADDRESS),
+                                    burst=IOE_BURST)
+    sensors = Sensors(positions_to_mux_channel, select_pins, adc_pin, threshold_min=THRESHOLD_MIN, memory_length=N_smoothing_memory, threshold_max=THRESHOLD_MAX, alpha=smoothing_alpha, settle_us=MUX_SETTLE_US, smoothing=smoothing_mode, integer_mode=INTEGER_SENSORS, position_mode=POSITION_MODE, backend=backend, adaptive_scan=ADAPTIVE_SCAN, full_scan_every=FULL_SCAN_EVERY, scan_margin=SCAN_MARGIN)
+    raw_voltages = [0.0] * len(sensors.voltages)
+    if backend is None:
+        if CALIBRATE_SETTLE:
+            settle_us = sensors.calibrate_settle(MUX_SETTLE_US)
+            calibration.save_settle(SETTLE_FILE, settle_us)
+            print("Settle times (us):", settle_us)
+        else:
+            settle_us = calibration.load_settle(SETTLE_FILE, len(sensors.voltages))
+            if settle_us is not None:
+                sensors.backend.settle_us = settle_us
+    if CALIBRATE_THRESHOLDS:
+        print("Thresholds:", calibration.calibrate(sensors, CALIBRATION_FILE, THRESHOLD_MIN, THRESHOLD_MAX, motors))
+    else:
+        thresholds = calibration.load_thresholds(CALIBRATION_FILE, len(sensors.voltages))
+        if thresholds is not None:
+            sensors.set_thresholds(*thresholds)
+
+    # Initialize the battery voltage compensation
+    battery = None
+    if BATTERY_COMPENSATION:
+        battery = Battery(lambda: sensors.read_channel(BATTERY_MUX_CHANNEL, MUX_SETTLE_US) / 65535 * 5 * BATTERY_DIVIDER,
+                          BATTERY_GAIN_POINTS, motors, sample_every=BATTERY_SAMPLE_STEPS)
+        battery.sample()
+        print("Battery:", battery.voltage, "V, gain", battery.gain)
+
+    # Tune the PD gains with a relay test, or take those of an earlier one
+    if AUTOTUNE:
+        tuned = autotune.autotune(sensors, motors, middle_of_line, dt, AUTOTUNE_FILE, AUTOTUNE_RULE, AUTOTUNE_SPEED,
+                                  AUTOTUNE_RELAY, epsilon=sensors.to_sensor_units(EPSILON),
+                                  battery_constant=1.0 if BATTERY_COMPENSATION else battery_constant)
+    else:
+        tuned = autotune.load_gains(AUTOTUNE_FILE)
+    if tuned is not None:
+        Kp, Kd, BASE_SPEED = tuned
+    # The calibration and the relay test leave the motors stopped
     motors.start()
-    sensors = Sensors(positions_to_mux_channel, select_pins, adc_pin, threshold_min=THRESHOLD_MIN, memory_length=N_smoothing_memory, threshold_max=THRESHOLD_MAX, alpha=smoothing_alpha)
-
-    # Initialize turn detection variables
-    direction_buffer = CyclicBuffer(5)
-    left_sensor_readings = CyclicBuffer(N_direction_memory)
-    right_sensor_readings = CyclicBuffer(N_direction_memory)
-    steps_line_right = 0       # Number of time steps since line was read by leftmost sensor
-    steps_line_left = 0        # Number of time steps since line was read by rightmost sensor
 
     # Initialize PID controller
-    pid_controller = PIDController(Kp, Kd, Ki, dt, setpoint=middle_of_line)
+    pid_controller = PIDController(Kp, Kd, Ki, dt, setpoint=middle_of_line, derivative_tau=KD_TAU,
+                                   integral_limit=INTEGRAL_LIMIT, schedule=GAIN_SCHEDULE)
+
+    # Initialize the optional stage timing
+    profiler = Profiler(deadline_us=int(dt * 1000000)) if PROFILE else None
+
+    # Initialize the lost-line recovery
+    recovery = RecoveryStateMachine(RECOVERY_BRAKE_STEPS, RECOVERY_BRAKE_GAIN, RECOVERY_LOST_TIMEOUT)
+
+    # Initialize the curve look-ahead
+    lookahead = None
+    if LOOKAHEAD:
+        lookahead = LookAhead(LOOKAHEAD_WINDOW, LOOKAHEAD_HORIZON, LOOKAHEAD_MARGIN, middle_of_line - 1.0,
+                              LOOKAHEAD_MIN_SCALE, LOOKAHEAD_RECOVER)
+
+    # Initialize the step records
+    telemetry = Telemetry(TELEMETRY_RECORDS, 1000 if INTEGER_SENSORS else 1, len(sensors.voltages)) if TELEMETRY else None
+
+    # Initialize the lap learning, following the saved profile if there is one
+    lap_profile = None
+    if LAP_LEARNING:
+        lap_profile = LapProfile(straight_speed=LAP_STRAIGHT_SPEED, turn_speed=LAP_TURN_SPEED,
+                                 curve_gain=LAP_CURVE_GAIN, lookahead_bins=LAP_LOOKAHEAD_BINS)
+        print("Lap profile:", "following" if lap_profile.load(LAP_FILE) else "recording")
+
+    # Initialize the fixed-rate loop timing
+    scheduler = Scheduler(dt)
+
+    # Initialize the sensor scan on the second core
+    pipeline = SensorPipeline(sensors) if DUAL_CORE and not DEBUG else None
+    control_sensors = pipeline if pipeline is not None else sensors
+    if pipeline is not None and battery is not None:
+        # The mux belongs to the second core, the battery is sampled there between frames
+        pipeline.background = battery.update
+
+    # Initialize the control loop body with turn detection
+    follower = LineFollower(control_sensors, motors, pid_controller, middle_of_line=middle_of_line, dt=dt,
+                            epsilon=EPSILON, epsilon_upper=EPSILON_UPPER, border_mode=border_mode,
+                            n_direction_memory=N_direction_memory, k_se=K_se, k_sd=K_sd,
+                            base_speed=BASE_SPEED, tight_turn_speed=TIGHT_TURN_SPEED,
+                            proportion=PROPORTION, battery_constant=1.0 if BATTERY_COMPENSATION else battery_constant,
+                            print_averages=not TELEMETRY, profiler=profiler, telemetry=telemetry,
+                            lap_profile=lap_profile, recovery=recovery, lookahead=lookahead)
+
+    # Initialize the live tuning console
+    console = Console(follower, sensors, CONSOLE_EVERY) if CONSOLE else None
+
+    memory = None
 
     # Robot state flags
-    after_sharp_turn = False   # Tells if we just got out of a sharp turn
     stopped = False            # Tells if the motors are stopped  
-    left = True                # Tells which direction we should turn if we lose the line next step
-    is_on = False              # Tells if the robot is active (on/off from remote)
+    is_on = remote is None     # Tells if the robot is active (on/off from remote)
         
     try:
         if DEBUG:
             while True:
-                is_on = debug(MODE, is_on, sensors)
+                is_on = debug(MODE, is_on, sensors, telemetry, remote)
+
+        if pipeline is not None:
+            pipeline.start()
 
+        scheduler.start()
+        if GC_CONTROL:
+            memory = MemoryManager(scheduler, GC_COLLECT_US, reserve=GC_RESERVE)
         while True:
-            with lock:
-                if shared["new_pulse"]:
-                    print("Pulse length:", shared["pulse_len"], "us")
-                    if shared["pulse_len"] > 50000:
-                        is_on = False if is_on else True
-                    shared["pulse_len"] = 0
-                    shared["new_pulse"] = False
-            is_on = True
+            # Toggled by the remote decoder between steps
+            if remote is not None:
+                is_on = remote.is_on
             if not is_on:
                 if not stopped:
                     stopped = True
                     motors.stop()
                     # Reset the buffer after being turned off
-                    direction_buffer = CyclicBuffer(N_direction_memory)
-                sleep(dt)
+                    follower.reset()
+                    # The next run starts from the start line
+                    if lap_profile is not None:
+                        if lap_profile.recording:
+                            lap_profile.save(LAP_FILE)
+                            lap_profile.finish()
+                        else:
+                            lap_profile.restart()
+                # Write out the records of the run while there is nothing else to do
+                if telemetry is not None:
+                    telemetry.drain(16)
+                if console is not None:
+                    console.poll()
+                if memory is not None:
+                    memory.step()
+                scheduler.wait()
                 continue
             else:
                 if stopped:
                     stopped = False
                     motors.start()
 
-            # Measure start time for equal timesteps
-            start_time = time.ticks_ms()
-
-            sensor_voltages = sensors.read_sensors()
-            position_weighted_average = sensors.get_current_line_position()
-
-            control_output, error, derivative = pid_controller.update(position_weighted_average)
-            speed = BASE_SPEED / (1 + K_se * abs(error) + K_sd * abs(derivative))
-            
-            # If all sensors do not see the line or all see the line, make a tight turn to get back on the line
-            all_off_line = all(voltage < EPSILON for voltage in sensors.voltages)
-            all_on_line  = all(voltage > EPSILON_UPPER for voltage in sensors.voltages)
-            if all_off_line or all_on_line:
-                # A neutral update to the PID controller and error buffer
-                pid_controller.update(middle_of_line)
-                direction_buffer.append(0.0)
-                # Update flag that we were executing a sharp turn this time step
-                after_sharp_turn = True
-                motors.stop()
-                motors.start()
-                if left:
-                    motors.tight_turn(-battery_constant * TIGHT_TURN_SPEED, PROPORTION)
-                else:
-                    motors.tight_turn(battery_constant * TIGHT_TURN_SPEED, PROPORTION)    
-            else:
-
-                # Stop the motors and try to stop spinning after ending the sharp turn
-                if after_sharp_turn:
-                    motors.stop()
-                    after_sharp_turn = False
-                    sleep(dt)
-                    motors.start()
-                    continue
-
-                if border_mode == 'last':
+            if profiler is not None:
+                profiler.start()
+            # The controller gets the measured period instead of the nominal dt
+            follower.step(scheduler.dt)
+            if profiler is not None:
+                profiler.end()
 
-                    if sensors.voltages[0] > EPSILON_UPPER:
-                        steps_line_left = 0
-                    else:
-                        steps_line_left += 1
+            # Sample the battery now and then in the slack of the period
+            if battery is not None and pipeline is None:
+                battery.update()
 
-                    if sensors.voltages[6] > EPSILON_UPPER:
-                        steps_line_right = 0
-                    else:
-                        steps_line_right += 1
+            # Take a tuning command in the slack of the period
+            if console is not None:
+                console.poll()
 
-                    if steps_line_left < steps_line_right:
-                        left = True
-                    else:
-                        left = False
+            # Collect the garbage if the rest of the period allows
+            if memory is not None:
+                memory.step()
 
-                if border_mode == 'average':
+            # Sleep until the next deadline to maintain the loop frequency
+            scheduler.wait()
 
-                    left_sensor_readings.append(max(sensors.voltages[0], 0.0))
-                    right_sensor_readings.append(max(sensors.voltages[6], 0.0))
-                    
-                    print('l=' + str(left_sensor_readings.average() + 1.0) + ' r=' + str(right_sensor_readings.average() + 1.0)) 
-
-                    if left_sensor_readings.average() > right_sensor_readings.average():
-                        left = True
-                    else:
-                        left = False
-                
-                motors.set_direction(battery_constant * speed, battery_constant * control_output)
-                direction_buffer.append(error)
-            
-            end_time = time.ticks_ms()
-            elapsed_time_ms = time.ticks_diff(end_time, start_time)
-            elapsed_time_s = elapsed_time_ms / 1000.0
-            if elapsed_time_s < dt:
-                # Sleep for the remaining time to maintain the loop frequency
-                sleep_time = dt - elapsed_time_s
-                sleep(sleep_time)
-                
     except KeyboardInterrupt:
         pass
     finally:
         motors.stop()
+        if memory is not None:
+            memory.stop()
+            memory.report()
+        if remote is not None:
+            remote.close()
+        if lap_profile is not None and lap_profile.recording:
+            lap_profile.save(LAP_FILE)
+        if pipeline is not None:
+            pipeline.stop()
+        if profiler is not None:
+            profiler.dump(PROFILE_FILE)
+        if REPORT_JITTER:
+            scheduler.report()
+        if telemetry is not None:
+            telemetry.dump(TELEMETRY_FILE)
@@ -0,0 +1,103 @@
+import gc
+import utime
+
+class MemoryManager:
+    """
+    Keeps the garbage collector out of the control steps. The automatic collection is off
+    while the loop runs, and the heap is collected at the end of a period, when the time left
+    to the deadline is longer than the longest collection seen so far. With the automatic
+    collection off MicroPython raises MemoryError instead of collecting when the heap runs
+    out, so below `reserve` free bytes a collection is forced even if it overruns the period.
+    Measures how much every step allocates with gc.mem_alloc.
+
+    Attributes:
+        scheduler (Scheduler): Timing of the loop, tells the time left in the period.
+        collect_us (int): Time budgeted for a collection, the longest one measured so far.
+        margin_us (int): Time kept free before the deadline on top of collect_us.
+        min_bytes (int): Allocated bytes since the last collection below which none is done.
+        reserve (int): Free bytes below which a collection is forced.
+        last_alloc (int): gc.mem_alloc at the end of the previous step.
+        collected_alloc (int): gc.mem_alloc after the last collection.
+        steps (int): Number of steps measured.
+        total_growth (int): Bytes allocated by the steps, for the mean.
+        max_growth (int): Most bytes allocated by a single step.
+        collections (int): Collections done in the slack.
+        forced (int): Collections forced by the reserve.
+        max_collect_us (int): Longest collection.
+    """
+
+    def __init__(self, scheduler, collect_us=2000, margin_us=200, min_bytes=1024, reserve=16384):
+        """
+        * scheduler: Scheduler of the loop
+        * collect_us: Initial budget of a collection in microseconds
+        * margin_us, min_bytes, reserve: See the attributes
+        """
+        self.scheduler = scheduler
+        self.collect_us = collect_us
+        self.margin_us = margin_us
+        self.min_bytes = min_bytes
+        self.reserve = reserve
+        self.start()
+
+    def start(self):
+        """
+        Collects, turns the automatic collection off and clears the statistics.
+        """
+        gc.collect()
+        gc.disable()
+        self.last_alloc = gc.mem_alloc()
+        self.collected_alloc = self.last_alloc
+        self.steps = 0
+        self.total_growth = 0
+        self.max_growth = 0
+        self.collections = 0
+        self.forced = 0
+        self.max_collect_us = 0
+
+    def stop(self):
+        """
+        Turns the automatic collection back on.
+        """
+        gc.enable()
+
+    def collect(self):
+        start = utime.ticks_us()
+        gc.collect()
+        duration = utime.ticks_diff(utime.ticks_us(), start)
+        if duration > self.max_collect_us:
+            self.max_collect_us = duration
+        if duration > self.collect_us:
+            self.collect_us = duration
+        self.collected_alloc = gc.mem_alloc()
+
+    def step(self):
+        """
+        Call at the end of every step, before waiting for the deadline. Measures what the
+        step allocated and collects if there is garbage and time for it, or too little heap.
+        """
+        allocated = gc.mem_alloc()
+        growth = allocated - self.last_alloc
+        self.steps += 1
+        self.total_growth += growth
+        if growth > self.max_growth:
+            self.max_growth = growth
+        if gc.mem_free() < self.reserve:
+            self.collect()
+            self.forced += 1
+        elif (allocated - self.collected_alloc >= self.min_bytes
+              and self.scheduler.remaining_us() > self.collect_us + self.margin_us):
+            self.collect()
+            self.collections += 1
+        self.last_alloc = gc.mem_alloc()
+
+    def report(self):
+        """
+        Prints the allocation per step and the collections.
+        """
+        if self.steps == 0:
+            print("# memory: no steps")
+            return
+        print("# memory steps=%d alloc_per_step mean=%.1f max=%d bytes" % (
+            self.steps, self.total_growth / self.steps, self.max_growth))
+        print("# gc collections=%d forced=%d collect_us max=%d free=%d" % (
+            self.collections, self.forced, self.max_collect_us, gc.mem_free()))
@@ -2,74 +2,128 @@ from machine import Pin, PWM
 
 # motor wires connection: left then right; black, beige, black, beige
 
+DUTY_SCALE = 655.35     # duty_u16 per percent of speed
+
 class Motors:
-    def __init__(self, motor_pins, enable_pins, pwm_freq=1000):
+    """
+    Output layer of the two motors. The PWM objects are held directly and the last duty
+    written to each of them is remembered, so a write is issued only when a duty changes,
+    and the enable pins are written only when the motors are really started or stopped.
+
+    Attributes:
+        motors (dict): PWM of every motor pin, by name.
+        left_speed, right_speed (float): Last commanded speeds in percent, for telemetry.
+        enabled (bool): State of the enable pins, None before they were first written.
+        slew_limit (float): Largest change of a wheel speed per update when it reverses, None for no limit.
+        gain (float): Factor of all speeds, kept up to date by Battery to compensate the supply voltage.
+        saturated (bool): Whether a speed of the last set_speeds() call was clipped to 100%, which
+            tells the PID controller that its output was not applied in full.
+    """
+
+    def __init__(self, motor_pins, enable_pins, pwm_freq=1000, slew_limit=None):
         """
         Initializes the motors with the given pins and frequency.
         * motor_pins: A dictionary mapping motor names to their corresponding pins.
         * enable_pins: A list of enable pins for each motor.
         * pwm_freq: The PWM frequency for the motors.
+        * slew_limit: Largest change of a wheel speed in percent per update when the wheel reverses,
+          which keeps the wheels from slipping; None to reverse at once.
         """
         self.motors = {name: PWM(Pin(pin)) for name, pin in motor_pins.items()}
         self.enable_pins = [Pin(pin, Pin.OUT) for pin in enable_pins] if enable_pins else None
         self.pwm_freq = pwm_freq
+        self.slew_limit = slew_limit
+        self.gain = 1.0
+        self.saturated = False
 
         for motor in self.motors.values():
             motor.freq(self.pwm_freq)
 
-    def set_direction(self, base_speed, direction):
-        
-        right_motor_speed = max(min(base_speed - direction, 100.0), -100.0)
-        left_motor_speed = max(min(base_speed + direction, 100.0), -100.0)
+        # Direct references in the order of self.duties
+        self.outputs = (self.motors["left_forward"], self.motors["left_reverse"],
+                        self.motors["right_forward"], self.motors["right_reverse"])
+        self.duties = [-1, -1, -1, -1]  # Unknown until written
+        self.enabled = None
+        # Last commanded speeds in percent, for telemetry
+        self.left_speed = 0.0
+        self.right_speed = 0.0
+
+    def write(self, index, duty):
+        duties = self.duties
+        if duties[index] != duty:
+            duties[index] = duty
+            self.outputs[index].duty_u16(duty)
+
+    def set_speeds(self, left_motor_speed, right_motor_speed):
+        """
+        Drives the wheels at the given speeds in percent, negative for reverse, times the gain.
+        Speeds beyond 100% are clipped and flagged in self.saturated. Only the duties which change are written.
+        """
+        gain = self.gain
+        left_motor_speed *= gain
+        right_motor_speed *= gain
+        self.saturated = not (-100.0 <= left_motor_speed <= 100.0 and -100.0 <= right_motor_speed <= 100.0)
+        if self.saturated:
+            left_motor_speed = max(min(left_motor_speed, 100.0), -100.0)
+            right_motor_speed = max(min(right_motor_speed, 100.0), -100.0)
+
+        slew_limit = self.slew_limit
+        if slew_limit is not None:
+            left_motor_speed = self.limit_reversal(self.left_speed, left_motor_speed, slew_limit)
+            right_motor_speed = self.limit_reversal(self.right_speed, right_motor_speed, slew_limit)
+        self.left_speed = left_motor_speed
+        self.right_speed = right_motor_speed
 
-        if (right_motor_speed > 0):
-            self.motors["right_forward"].duty_u16(int(right_motor_speed * 655.35))
-            self.motors["right_reverse"].duty_u16(0)
+        write = self.write
+        if left_motor_speed > 0:
+            write(0, int(left_motor_speed * DUTY_SCALE))
+            write(1, 0)
         else:
-            self.motors["right_forward"].duty_u16(0)
-            self.motors["right_reverse"].duty_u16(int(-right_motor_speed * 655.35))
+            write(0, 0)
+            write(1, int(-left_motor_speed * DUTY_SCALE))
 
-        if (left_motor_speed > 0):
-            self.motors["left_forward"].duty_u16(int(left_motor_speed * 655.35))
-            self.motors["left_reverse"].duty_u16(0)
+        if right_motor_speed > 0:
+            write(2, int(right_motor_speed * DUTY_SCALE))
+            write(3, 0)
         else:
-            self.motors["left_forward"].duty_u16(0)
-            self.motors["left_reverse"].duty_u16(int(-left_motor_speed * 655.35))
-            
+            write(2, 0)
+            write(3, int(-right_motor_speed * DUTY_SCALE))
+
+    @staticmethod
+    def limit_reversal(current, target, slew_limit):
+        """
+        Limits the change from current to target speed to slew_limit if the wheel reverses.
+        """
+        if current * target >= 0.0:
+            return target
+        if target > current + slew_limit:
+            return current + slew_limit
+        if target < current - slew_limit:
+            return current - slew_limit
+        return target
+
+    def set_direction(self, base_speed, direction):
+        self.set_speeds(base_speed + direction, base_speed - direction)
+
     def tight_turn(self, direction, proportion):
-        
-        if direction >= 0.0:
-            left_motor_speed = (direction / proportion)
-            right_motor_speed = -direction
-        else:
-            left_motor_speed = direction
-            right_motor_speed = -direction / proportion
-            
-        if (right_motor_speed > 0):
-            self.motors["right_forward"].duty_u16(int(right_motor_speed * 655.35))
-            self.motors["right_reverse"].duty_u16(0)
-        else:
-            self.motors["right_forward"].duty_u16(0)
-            self.motors["right_reverse"].duty_u16(int(-right_motor_speed * 655.35))
 
-        if (left_motor_speed > 0):
-            self.motors["left_forward"].duty_u16(int(left_motor_speed * 655.35))
-            self.motors["left_reverse"].duty_u16(0)
+        if direction >= 0.0:
+            self.set_speeds(direction / proportion, -direction)
         else:
-            self.motors["left_forward"].duty_u16(0)
-            self.motors["left_reverse"].duty_u16(int(-left_motor_speed * 655.35))
-            
+            self.set_speeds(direction, -direction / proportion)
 
     def stop(self):
-        for motor in self.motors.values():
-            motor.duty_u16(0)
-        if self.enable_pins:
-            for enable_pin in self.enable_pins:
-                enable_pin.value(0)
+        self.left_speed = 0.0
+        self.right_speed = 0.0
+        for index in range(4):
+            self.write(index, 0)
+        self.set_enabled(False)
 
     def start(self):
-        if self.enable_pins:
-            for enable_pin in self.enable_pins:
-                enable_pin.value(1)
+        self.set_enabled(True)
 
-        
\ No newline at end of file
+    def set_enabled(self, enabled):
+        if self.enable_pins and self.enabled != enabled:
+            for enable_pin in self.enable_pins:
+                enable_pin.value(1 if enabled else 0)
+        self.enabled = enabled
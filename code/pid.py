@@ -1,22 +1,168 @@
+from array import array
+
 class PIDController:
-    def __init__(self, Kp, Kd, Ki, dt, setpoint=0.0):
+    """
+    PID controller with a low-pass filtered derivative on the measurement, an integral
+    which stops growing while the motors are saturated and gains scheduled on the speed.
+    With the defaults it computes exactly the plain PID it replaces.
+
+    Attributes:
+        Kp, Kd, Ki (float): Gains in use, set from the schedule by set_speed().
+        setpoint (float): Desired value of the measurement.
+        derivative_tau (float): Time constant of the derivative filter in seconds, 0 for no filtering.
+        integral_limit (float): Largest magnitude of the integral, None for no limit.
+        error (float): Error of the last update.
+        derivative (float): Derivative of the error of the last update, filtered with derivative_tau.
+        output (float): Control output of the last update (update_pid only).
+        saturated (bool): Set by the caller when the last output could not be applied in full
+            (see Motors.saturated); the integral then does not grow further into the saturation.
+        schedule_step (float): Speed between the entries of the gain tables.
+        gain_tables (tuple): Kp, Kd and Ki tables (array('f')) over the speed, None without a schedule.
+        update_output (method): update_pd when the controller is a plain PD one (no Ki, filter or
+            schedule), which skips the integral and the filter, else update_pid. Returns the output
+            alone, for the control loop; update() returns the (output, error, derivative) tuple.
+    """
+
+    def __init__(self, Kp, Kd, Ki, dt, setpoint=0.0, derivative_tau=0.0, integral_limit=None,
+                 schedule=None, schedule_step=5.0, schedule_max=150.0):
+        """
+        * Kp, Kd, Ki: Gains, used until the first set_speed() call when there is a schedule
+        * dt: Nominal time step in seconds
+        * setpoint: Desired value of the measurement
+        * derivative_tau: Time constant of the derivative low-pass filter in seconds, 0 for the raw derivative
+        * integral_limit: Largest magnitude of the integral, None for no limit
+        * schedule: (speed, Kp, Kd, Ki) points, interpolated linearly between them and held
+          constant beyond the first and the last one; None for fixed gains
+        * schedule_step, schedule_max: Resolution and range of the speed of the gain tables
+        """
         self.Kp = Kp
         self.Kd = Kd
         self.Ki = Ki
         self.integral = 0.0
-        self.prev_error = 0.0
         assert dt > 0, "Time step must be positive"
         self.dt = dt
         self.setpoint = setpoint
+        self.derivative_tau = derivative_tau
+        self.integral_limit = integral_limit
+        self.schedule_step = schedule_step
+        self.gain_tables = None
+        if schedule:
+            self.gain_tables = self.build_tables(sorted(schedule), schedule_step, schedule_max)
+        self.select_update()
+        self.reset()
+
+    def select_update(self):
+        """
+        Binds update_output to update_pd or update_pid, again after Ki or derivative_tau changed.
+        """
+        if self.Ki == 0.0 and self.derivative_tau <= 0.0 and self.gain_tables is None:
+            self.update_output = self.update_pd
+        else:
+            self.update_output = self.update_pid
+
+    def reset(self):
+        """
+        Forgets the integral and the derivative history.
+        """
+        self.integral = 0.0
+        self.prev_measured = self.setpoint
+        self.error = 0.0
+        self.derivative = 0.0
+        self.output = 0.0
+        self.saturated = False
+
+    @staticmethod
+    def build_tables(points, step, maximum):
+        """
+        Interpolates the Kp, Kd and Ki of the schedule points over the speed range.
+        """
+        size = int(maximum / step + 0.5) + 1
+        tables = (array('f', [0.0] * size), array('f', [0.0] * size), array('f', [0.0] * size))
+        for i in range(size):
+            speed = i * step
+            if speed <= points[0][0]:
+                gains = points[0][1:]
+            elif speed >= points[-1][0]:
+                gains = points[-1][1:]
+            else:
+                k = 1
+                while points[k][0] < speed:
+                    k += 1
+                p0, p1 = points[k - 1], points[k]
+                t = (speed - p0[0]) / (p1[0] - p0[0])
+                gains = [g0 + (g1 - g0) * t for g0, g1 in zip(p0[1:], p1[1:])]
+            for table, gain in zip(tables, gains):
+                table[i] = gain
+        return tables
 
-    def update(self, measured_value):
+    def set_speed(self, speed):
+        """
+        Selects the gains of the table entry nearest to the speed, for the next update.
+        """
+        tables = self.gain_tables
+        if tables is None:
+            return
+        index = int(abs(speed) / self.schedule_step + 0.5)
+        if index >= len(tables[0]):
+            index = len(tables[0]) - 1
+        self.Kp = tables[0][index]
+        self.Kd = tables[1][index]
+        self.Ki = tables[2][index]
+
+    def update(self, measured_value, dt=None):
         """
         Update the PID controller with the measured value.
         * measured_value: The current value to be controlled.
-        Returns the control output.
+        * dt: Time since the previous update in seconds, the constant dt if not given.
+        Returns (output, error, derivative): the control output, the error and the (filtered)
+        derivative of the error, taken from the measurement so that a change of the setpoint
+        does not kick the output.
+        """
+        output = self.update_output(measured_value, dt)
+        return output, self.error, self.derivative
+
+    def update_pd(self, measured_value, dt=None):
         """
+        update_pid without the integral and the derivative filter.
+        """
+        if dt is None or dt <= 0:
+            dt = self.dt
+        error = self.setpoint - measured_value
+        derivative = (self.prev_measured - measured_value) / dt
+        self.prev_measured = measured_value
+        self.error = error
+        self.derivative = derivative
+        return self.Kp * error + self.Kd * derivative
+
+    def update_pid(self, measured_value, dt=None):
+        """
+        update() returning the control output alone. The error and the derivative are left in
+        self.error and self.derivative: a returned tuple would be allocated on every call.
+        """
+        if dt is None or dt <= 0:
+            dt = self.dt
         error = self.setpoint - measured_value
-        derivative = (error - self.prev_error) / self.dt
-        self.prev_error = error
-        self.integral += error * self.dt
-        return self.Kp * error + self.Kd * derivative + self.Ki * self.integral, error, derivative
\ No newline at end of file
+        derivative = (self.prev_measured - measured_value) / dt
+        self.prev_measured = measured_value
+        tau = self.derivative_tau
+        if tau > 0.0:
+            previous = self.derivative
+            derivative = previous + dt / (tau + dt) * (derivative - previous)
+        self.error = error
+        self.derivative = derivative
+
+        Ki = self.Ki
+        if Ki != 0.0:
+            integral = self.integral
+            # Conditional integration: no further windup in the direction of the saturation
+            if not self.saturated or Ki * error * self.output <= 0.0:
+                integral += error * dt
+                limit = self.integral_limit
+                if limit is not None and not -limit <= integral <= limit:
+                    integral = limit if integral > 0.0 else -limit
+                self.integral = integral
+            output = self.Kp * error + self.Kd * derivative + Ki * integral
+        else:
+            output = self.Kp * error + self.Kd * derivative
+        self.output = output
+        return output
@@ -0,0 +1,136 @@
+import _thread
+import utime
+from profiler import STAGE_SCAN
+
+class SensorPipeline:
+    """
+    Scans the sensors continuously on the second core and hands complete frames to the
+    control loop on the first one, so the control rate is not limited by the mux settle times.
+    Stands in for Sensors in the control loop: read_sensors() takes the latest complete frame.
+
+    Frames are double-buffered. Core 1 fills the back buffer without locking and publishes it
+    by flipping the front index; core 0 copies the front buffer. The flip and the copy are the
+    only code under the lock, so a frame being copied is never overwritten.
+
+    Attributes:
+        sensors (Sensors): Sensors scanned by core 1, not to be touched by core 0 while running.
+        voltages (list): Latest frame taken by core 0, in the units of sensors.voltages.
+        sequence (int): Sequence number of the frame in voltages, 0 before the first frame.
+        timestamp_us (int): ticks_us at which the frame in voltages was completed.
+        reused (int): Number of control steps which got no new frame.
+        skipped (int): Number of frames published but never taken by the control loop.
+        profiler (Profiler): Optional timing of the frame handoff, None when not profiling.
+        background (callable): Optional function called by core 1 after every frame, e.g. to sample
+            other mux channels, which core 0 may not do while the pipeline runs.
+        reset_requested (bool): Set by core 0 to have core 1 reset the smoothing before its next scan.
+    """
+
+    def __init__(self, sensors):
+        self.sensors = sensors
+        self.integer_mode = sensors.integer_mode
+        n = len(sensors.voltages)
+        zero = 0 if sensors.integer_mode else 0.0
+        self.frames = [[zero] * n, [zero] * n]
+        self.frame_sequences = [0, 0]
+        self.frame_timestamps = [0, 0]
+        self.front = 0
+        self.lock = _thread.allocate_lock()
+
+        self.voltages = [zero] * n
+        self.sequence = 0
+        self.timestamp_us = 0
+        self.reused = 0
+        self.skipped = 0
+        self.profiler = None
+        self.background = None
+        self.reset_requested = False
+
+        self.running = False
+        self.finished = True
+
+    def start(self):
+        """
+        Starts the acquisition on the second core and waits for the first frame.
+        """
+        self.running = True
+        self.finished = False
+        _thread.start_new_thread(self.acquire, ())
+        while self.frame_sequences[self.front] == 0 and not self.finished:
+            utime.sleep_ms(1)
+
+    def stop(self):
+        """
+        Stops the acquisition and waits until the second core has left the loop.
+        """
+        self.running = False
+        while not self.finished:
+            utime.sleep_ms(1)
+
+    def acquire(self):
+        """
+        Acquisition loop run by the second core.
+        """
+        sensors = self.sensors
+        frames = self.frames
+        sequence = 0
+        try:
+            while self.running:
+                if self.reset_requested:
+                    # Cleared first, so that a request made during the reset is not lost
+                    self.reset_requested = False
+                    sensors.reset_smoothing()
+                voltages = sensors.read_sensors()
+                back = 1 - self.front
+                frame = frames[back]
+                for i in range(len(frame)):
+                    frame[i] = voltages[i]
+                sequence += 1
+                self.frame_sequences[back] = sequence
+                self.frame_timestamps[back] = utime.ticks_us()
+                with self.lock:
+                    self.front = back
+                if self.background is not None:
+                    self.background()
+        finally:
+            self.finished = True
+
+    def read_sensors(self):
+        """
+        Takes the latest complete frame into self.voltages.
+        Returns self.voltages.
+        """
+        voltages = self.voltages
+        with self.lock:
+            front = self.front
+            frame = self.frames[front]
+            for i in range(len(voltages)):
+                voltages[i] = frame[i]
+            sequence = self.frame_sequences[front]
+            self.timestamp_us = self.frame_timestamps[front]
+
+        if sequence == self.sequence:
+            self.reused += 1
+        elif self.sequence and sequence > self.sequence + 1:
+            self.skipped += sequence - self.sequence - 1
+        self.sequence = sequence
+
+        if self.profiler is not None:
+            self.profiler.mark(STAGE_SCAN)
+        return voltages
+
+    def get_current_line_position(self):
+        return self.sensors.get_position(self.voltages)
+
+    def to_sensor_units(self, voltage):
+        return self.sensors.to_sensor_units(voltage)
+
+    def reset_smoothing(self):
+        """
+        Sensors.reset_smoothing, done by core 1 between two frames while it is scanning: the
+        smoothing state is its own then, and a reset from core 0 would tear the frame being
+        smoothed. The frames published before still come from the old smoothing.
+        """
+        if self.finished:
+            self.sensors.reset_smoothing()
+        else:
+            self.reset_requested = True
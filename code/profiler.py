@@ -0,0 +1,117 @@
+from array import array
+import utime
+
+# Stages of the control step, each mark() closes the stage which just ran
+STAGE_SCAN = 0        # Mux scan with the settle sleeps in Sensors.read_sensors
+STAGE_TRUNCATE = 1    # Truncation (and smoothing) of the voltages
+STAGE_POSITION = 2    # Line position from the voltages
+STAGE_PID = 3         # PIDController.update_output
+STAGE_LOGIC = 4       # Speed, line loss checks and sharp turn direction
+STAGE_PRINT = 5       # Printing of the outermost sensor averages or the telemetry record
+STAGE_MOTORS = 6      # Duty writes in Motors
+STAGE_NAMES = ('scan', 'truncate', 'position', 'pid', 'logic', 'print', 'motors')
+
+class Profiler:
+    """
+    Opt-in per-stage timing of the control step.
+    Durations in microseconds are stored in a preallocated ring buffer, one row per step
+    with a column per stage and the whole step in the last column, so timing the loop
+    allocates nothing. Statistics are computed only by summary() after the run.
+
+    Attributes:
+        deadline_us (int): Step duration above which the step counts as an overrun.
+        capacity (int): Number of most recent steps kept.
+        samples (array('I')): Ring buffer of capacity rows of len(STAGE_NAMES) + 1 durations.
+        steps (int): Number of steps recorded in total.
+        overruns (int): Number of steps longer than deadline_us.
+    """
+
+    def __init__(self, deadline_us=10000, capacity=512):
+        self.deadline_us = deadline_us
+        self.capacity = capacity
+        self.columns = len(STAGE_NAMES) + 1
+        self.samples = array('I', [0] * (capacity * self.columns))
+        self.steps = 0
+        self.overruns = 0
+        self.row = 0
+        self.step_start = 0
+        self.last = 0
+
+    def start(self):
+        """
+        Begins timing a step.
+        """
+        samples = self.samples
+        row = self.row
+        for column in range(self.columns):
+            samples[row + column] = 0
+        self.step_start = self.last = utime.ticks_us()
+
+    def mark(self, stage):
+        """
+        Attributes the time since the previous mark to the given stage.
+        """
+        now = utime.ticks_us()
+        self.samples[self.row + stage] += utime.ticks_diff(now, self.last)
+        self.last = now
+
+    def end(self):
+        """
+        Finishes timing a step and counts it as an overrun if it missed the deadline.
+        """
+        total = utime.ticks_diff(utime.ticks_us(), self.step_start)
+        self.samples[self.row + self.columns - 1] = total
+        if total > self.deadline_us:
+            self.overruns += 1
+        self.steps += 1
+        self.row += self.columns
+        if self.row >= len(self.samples):
+            self.row = 0
+
+    def column(self, index):
+        """
+        Durations of one stage over the recorded steps (allocates, use after the run).
+        """
+        rows = min(self.steps, self.capacity)
+        return [self.samples[row * self.columns + index] for row in range(rows)]
+
+    def summary(self):
+        """
+        Returns a list of (stage name, min, mean, p99, max) in microseconds,
+        the last entry is the whole step.
+        """
+        result = []
+        names = STAGE_NAMES + ('step',)
+        for index in range(self.columns):
+            values = sorted(self.column(index))
+            if not values:
+                result.append((names[index], 0, 0, 0, 0))
+                continue
+            p99 = values[min(len(values) - 1, (len(values) * 99) // 100)]
+            result.append((names[index], values[0], sum(values) // len(values), p99, values[-1]))
+        return result
+
+    def dump(self, file=None):
+        """
+        Prints the statistics and the raw samples in the format read by host/profile_report.py.
+        * file: Optional path on the flash to write the dump to instead of printing
+        """
+        lines = ['# profile stages=' + ','.join(STAGE_NAMES) + ' deadline_us=' + str(self.deadline_us)
+                 + ' steps=' + str(self.steps) + ' overruns=' + str(self.overruns)]
+        lines.append('# stage min mean p99 max')
+        for name, low, mean, p99, high in self.summary():
+            lines.append('# ' + name + ' ' + str(low) + ' ' + str(mean) + ' ' + str(p99) + ' ' + str(high))
+        # Raw samples, oldest first
+        rows = min(self.steps, self.capacity)
+        first = self.row // self.columns if self.steps > self.capacity else 0
+        for k in range(rows):
+            offset = ((first + k) % self.capacity) * self.columns
+            lines.append(','.join(str(self.samples[offset + c]) for c in range(self.columns)))
+
+        if file is None:
+            for line in lines:
+                print(line)
+        else:
+            with open(file, 'w') as f:
+                for line in lines:
+                    f.write(line + '\n')
@@ -0,0 +1,102 @@
+# States of the lost-line recovery
+FOLLOWING = 0     # The line is seen, the PD controller steers
+LOST_LEFT = 1     # The line is lost, turning left in place to find it
+LOST_RIGHT = 2    # The line is lost, turning right in place to find it
+REACQUIRE = 3     # The line was found again, braking the turn before following it
+STOPPED = 4       # The line was lost for too long, the motors are stopped until reset
+STATE_NAMES = ('following', 'lost_left', 'lost_right', 'reacquire', 'stopped')
+
+# Events fed to the state machine every step
+LINE_SEEN = 0         # Some sensor sees the line and not all of them do
+LINE_LOST_LEFT = 1    # No sensor sees the line (or all do), it was last seen on the left
+LINE_LOST_RIGHT = 2   # As above, it was last seen on the right
+TIMEOUT = 3           # The time of the current state is up
+
+# Next state for every state and event: TRANSITIONS[state][event]
+TRANSITIONS = (
+    # LINE_SEEN  LINE_LOST_LEFT LINE_LOST_RIGHT TIMEOUT
+    (FOLLOWING,  LOST_LEFT,     LOST_RIGHT,     FOLLOWING),   # FOLLOWING
+    (REACQUIRE,  LOST_LEFT,     LOST_LEFT,      STOPPED),     # LOST_LEFT
+    (REACQUIRE,  LOST_RIGHT,    LOST_RIGHT,     STOPPED),     # LOST_RIGHT
+    (REACQUIRE,  LOST_LEFT,     LOST_RIGHT,     FOLLOWING),   # REACQUIRE
+    (STOPPED,    STOPPED,       STOPPED,        STOPPED),     # STOPPED
+)
+
+class RecoveryStateMachine:
+    """
+    Lost-line recovery as an explicit state machine. The transitions are looked up in
+    TRANSITIONS from the state and the event of the step, and every state may have a time
+    after which the TIMEOUT event fires. The LineFollower acts on the resulting state.
+
+    The defaults reproduce the original behaviour: turn in place while the line is lost
+    and stop the motors for one step when it is found again.
+
+    Attributes:
+        state (int): Current state.
+        steps (int): Number of steps spent in the current state.
+        timeouts (list): Steps after which every state times out, None for never.
+        brake_gain (float): Speed of the braking pulse in REACQUIRE as a share of the turn speed,
+            the pulse turns against the turn which found the line; 0 stops the motors.
+        turned_left (bool): Direction of the last turn in place.
+        losses (int): Number of times the line was lost.
+        recovery_steps (int): Number of steps spent turning in place and braking.
+    """
+
+    def __init__(self, brake_steps=1, brake_gain=0.0, lost_timeout_steps=None):
+        """
+        * brake_steps: Duration of REACQUIRE in steps, 0 to follow the line at once
+        * brake_gain: Speed of the braking pulse as a share of the turn speed
+        * lost_timeout_steps: Steps of turning in place after which the robot stops, None for never
+        """
+        self.timeouts = [None, lost_timeout_steps, lost_timeout_steps, brake_steps, None]
+        self.brake_gain = brake_gain
+        self.losses = 0
+        self.recovery_steps = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Starts following the line again, e.g. after the robot was turned off.
+        """
+        self.state = FOLLOWING
+        self.steps = 0
+        self.turned_left = True
+
+    def enter(self, state):
+        if state == LOST_LEFT or state == LOST_RIGHT:
+            if self.state != LOST_LEFT and self.state != LOST_RIGHT:
+                self.losses += 1
+            self.turned_left = state == LOST_LEFT
+        self.state = state
+        self.steps = 0
+
+    def update(self, line_seen, left):
+        """
+        Advances the state machine by one step.
+        * line_seen: Whether the line is seen in this step
+        * left: Whether the line was last seen on the left, deciding the direction of a turn
+        Returns the state to act on in this step.
+        """
+        if line_seen:
+            event = LINE_SEEN
+        elif left:
+            event = LINE_LOST_LEFT
+        else:
+            event = LINE_LOST_RIGHT
+        state = TRANSITIONS[self.state][event]
+        if state != self.state:
+            self.enter(state)
+
+        # A state may time out at once, e.g. REACQUIRE without braking
+        timeout = self.timeouts[self.state]
+        while timeout is not None and self.steps >= timeout:
+            state = TRANSITIONS[self.state][TIMEOUT]
+            if state == self.state:
+                break
+            self.enter(state)
+            timeout = self.timeouts[self.state]
+
+        self.steps += 1
+        if self.state != FOLLOWING and self.state != STOPPED:
+            self.recovery_steps += 1
+        return self.state
@@ -0,0 +1,104 @@
+import micropython
+from array import array
+from machine import Pin
+from utime import ticks_us, ticks_diff
+
+class Remote:
+    """
+    Start/stop input from the IR receiver, decoded from the edges of its output instead of a
+    thread blocking in time_pulse_us. The interrupt handler only stores the time and the level
+    of every edge in a preallocated ring and schedules the decoder, which measures the pulses
+    outside of the interrupt and toggles is_on on every long one. The control loop only reads
+    is_on, so a press takes effect in the next control step.
+
+    Attributes:
+        is_on (bool): Whether the robot should run, toggled by every pulse longer than toggle_us.
+        toggle_us (int): Pulses up to this length in microseconds are ignored.
+        active_level (int): Level of the pin during a pulse.
+        times (array): Ring of the edge times (ticks_us) stored by the interrupt handler.
+        levels (bytearray): Ring of the pin levels after the edges.
+        head (int): Number of edges stored by the handler.
+        tail (int): Number of edges decoded.
+        last_pulse_us (int): Length of the last complete pulse.
+        pulses (int): Number of complete pulses decoded.
+        overruns (int): Number of edges lost because the decoder fell behind the ring.
+    """
+
+    def __init__(self, pin_id, toggle_us=50000, active_level=1, is_on=False, capacity=16):
+        """
+        * pin_id: GPIO of the receiver output
+        * toggle_us: Pulses longer than this toggle is_on, shorter ones are noise
+        * active_level: Level of the pin during a pulse
+        * is_on: Initial state
+        * capacity: Size of the edge ring, a power of two
+        """
+        assert capacity & (capacity - 1) == 0, "Capacity must be a power of two"
+        self.is_on = is_on
+        self.toggle_us = toggle_us
+        self.active_level = active_level
+        self.mask = capacity - 1
+        self.times = array('i', [0] * capacity)
+        self.levels = bytearray(capacity)
+        self.head = 0
+        self.tail = 0
+        self.pending = False            # The decoder is scheduled and has not run yet
+        self.in_pulse = False
+        self.pulse_start = 0
+        self.last_pulse_us = 0
+        self.pulses = 0
+        self.overruns = 0
+        # Bound once: a bound method would be allocated in the interrupt on every edge
+        self.decode_ref = self.decode
+        self.pin = Pin(pin_id, Pin.IN)
+        self.pin.irq(handler=self.edge, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, hard=True)
+
+    def edge(self, pin):
+        """
+        Interrupt handler: stores the edge and schedules the decoder. Allocates nothing.
+        """
+        head = self.head
+        index = head & self.mask
+        self.times[index] = ticks_us()
+        self.levels[index] = pin.value()
+        self.head = head + 1
+        if not self.pending:
+            self.pending = True
+            try:
+                micropython.schedule(self.decode_ref, 0)
+            except RuntimeError:
+                # The schedule queue is full, the next edge asks again
+                self.pending = False
+
+    def decode(self, _):
+        """
+        Measures the pulses of the stored edges, run by micropython.schedule outside the interrupt.
+        """
+        self.pending = False
+        head = self.head
+        tail = self.tail
+        capacity = self.mask + 1
+        if head - tail > capacity:
+            # The oldest edges were overwritten, the pulse they belonged to is lost
+            self.overruns += head - tail - capacity
+            tail = head - capacity
+            self.in_pulse = False
+        while tail != head:
+            index = tail & self.mask
+            tail += 1
+            if self.levels[index] == self.active_level:
+                self.in_pulse = True
+                self.pulse_start = self.times[index]
+            elif self.in_pulse:
+                self.in_pulse = False
+                width = ticks_diff(self.times[index], self.pulse_start)
+                self.last_pulse_us = width
+                self.pulses += 1
+                if width > self.toggle_us:
+                    self.is_on = not self.is_on
+        self.tail = tail
+
+    def close(self):
+        """
+        Stops the interrupts of the pin.
+        """
+        self.pin.irq(handler=None)
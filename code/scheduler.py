@@ -0,0 +1,94 @@
+import utime
+
+class Scheduler:
+    """
+    Runs the control loop at a fixed rate against absolute ticks_us deadlines, so the time
+    spent in a step does not add to the period and rounding errors do not accumulate.
+    Measures the actual period for the controller and keeps jitter statistics.
+
+    Attributes:
+        period_us (int): Target period of the loop in microseconds.
+        deadline (int): ticks_us at which the next step should be released.
+        last_release (int): ticks_us at which the current step was released.
+        dt (float): Measured duration of the last period in seconds.
+        periods (int): Number of periods waited for.
+        missed (int): Number of steps which ended after their deadline.
+        max_late_us (int): Largest delay of a release after its deadline.
+        total_late_us (int): Sum of the delays of the releases, for the mean.
+        min_dt_us, max_dt_us (int): Shortest and longest measured period.
+    """
+
+    def __init__(self, dt):
+        """
+        * dt: Target period in seconds
+        """
+        assert dt > 0, "Time step must be positive"
+        self.period_us = int(dt * 1000000)
+        self.start()
+
+    def start(self):
+        """
+        Anchors the deadlines at the current time and clears the statistics.
+        """
+        now = utime.ticks_us()
+        self.deadline = utime.ticks_add(now, self.period_us)
+        self.last_release = now
+        self.dt = self.period_us / 1000000
+        self.periods = 0
+        self.missed = 0
+        self.max_late_us = 0
+        self.total_late_us = 0
+        self.min_dt_us = self.period_us
+        self.max_dt_us = self.period_us
+
+    def remaining_us(self):
+        """
+        Microseconds left to the next deadline, negative once it has passed.
+        """
+        return utime.ticks_diff(self.deadline, utime.ticks_us())
+
+    def wait(self):
+        """
+        Sleeps until the next deadline. A step which overran its deadline is counted as missed
+        and the deadlines are moved to start from now, instead of running the following steps
+        back to back to catch up.
+        Returns the measured period in seconds, also kept in self.dt.
+        """
+        remaining = utime.ticks_diff(self.deadline, utime.ticks_us())
+        if remaining > 0:
+            utime.sleep_us(remaining)
+        else:
+            self.missed += 1
+        now = utime.ticks_us()
+        late = utime.ticks_diff(now, self.deadline)
+        if late > self.max_late_us:
+            self.max_late_us = late
+        if late > 0:
+            self.total_late_us += late
+
+        if remaining > 0:
+            self.deadline = utime.ticks_add(self.deadline, self.period_us)
+        else:
+            self.deadline = utime.ticks_add(now, self.period_us)
+
+        period = utime.ticks_diff(now, self.last_release)
+        self.last_release = now
+        if period < self.min_dt_us:
+            self.min_dt_us = period
+        if period > self.max_dt_us:
+            self.max_dt_us = period
+        self.periods += 1
+        self.dt = period / 1000000
+        return self.dt
+
+    def report(self):
+        """
+        Prints the rate, missed deadlines and jitter.
+        """
+        if self.periods == 0:
+            print("# scheduler: no periods")
+            return
+        print("# scheduler period_us=%d periods=%d missed=%d (%.1f%%)" % (
+            self.period_us, self.periods, self.missed, 100.0 * self.missed / self.periods))
+        print("# jitter mean_us=%.1f max_us=%d dt_min_us=%d dt_max_us=%d" % (
+            self.total_late_us / self.periods, self.max_late_us, self.min_dt_us, self.max_dt_us))
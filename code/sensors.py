@@ -1,5 +1,13 @@
-from machine import ADC, Pin
-import utime
+from array import array
+from backends import MuxADCBackend
+from profiler import STAGE_SCAN
+
+# Integer mode: readings are integer weights with 5.0 on the 0-5 scale stored as 5 * WEIGHT_SCALE
+WEIGHT_SCALE = 1000
+# Integer mode: the lookup table is indexed by the 12 significant bits of read_u16
+LOOKUP_SHIFT = 4
+# Integer mode with per-sensor thresholds: fractional bits of the fixed-point scale and offset
+FIXED_SHIFT = 12
 
 class Sensors:
     """
@@ -9,96 +17,425 @@ class Sensors:
         - voltages are stored in lists, order of voltages is order of sensors from left to right.
 
     Attributes:
-        positions_to_mux_channel (dict): Maps sensor positions to MUX channels.
-        select_lines (list[Pin]): GPIO pins used to select MUX channel.
-        adc (ADC): ADC object for reading sensor values.
-        alpha (float): Smoothing factor for averaging over past readings.
-        memory_length (int): Number of past readings used in smoothing.
-        threshold_min (float): Voltages below this are treated as no line.
-        threshold max (float): Voltages above this are treated as line fully detected.
-        prev_voltages (list[list[float]]): History buffer of raw voltage readings.
-        smoothed_prev_sensor_values (list[float]): Truncated and averaged voltages from the history buffer.
+        backend: Hardware the frames are read from, see backends.py.
+        raw (array('H')): Last frame of raw 16-bit codes, one per sensor, filled by the backend.
+        smoothing (str): 'ema' for exponential moving average, 'window' for the mean of the
+            last memory_length readings, None for no smoothing.
+        alpha (float): Weight of the newest reading in the exponential moving average.
+        memory_length (int): Number of past readings used in the sliding window mean.
+        threshold_min (float or list[float]): Voltages below this are treated as no line, one value or one per sensor.
+        threshold max (float or list[float]): Voltages above this are treated as line fully detected.
+        scales, offsets (array('f')): Per-sensor truncation as a multiply-add, precomputed from the thresholds.
+        prev_voltages (array('f')): History buffer of truncated readings, memory_length rows of one value per sensor.
+        window_sums (array('f')): Sum of every sensor's readings in the history buffer.
+        smoothed_prev_sensor_values (array('f')): Exponential moving average of every sensor.
+        integer_mode (bool): Readings are integers scaled by WEIGHT_SCALE, produced by a lookup table
+            from the raw ADC codes; smoothing and the line position use integer arithmetic.
+        lookup (array('H')): Truncated and scaled weight for every raw code >> LOOKUP_SHIFT, None in float mode
+            and when the sensors have thresholds of their own (then scales_fixed/offsets_fixed are used).
+        profiler (Profiler): Optional timing of the scan, None when not profiling.
+        position_mode (str): Line position estimator, 'average' for the weighted average of all sensors,
+            'peak' for a parabola through the strongest sensor and its neighbours, 'centroid' for the
+            weighted average of those three only.
+        get_position (method): The estimator selected by position_mode.
+        last_peak (int): Index of the strongest sensor in the previous step, -1 if none saw the line.
+        scan (method): Reads a frame into raw, backend.read_frame or scan_adaptive.
+        adaptive_scan (bool): Read only a window of sensors around the line, see scan_adaptive.
+        full_scan_every (int): Frames between full scans of the adaptive scan.
+        scan_margin (int): Sensors read on either side of those which saw the line in the previous frame.
+        selected (bytearray): Sensors read in the last frame; the others have a raw code of 0, which
+            reads as off the line in every mode.
+        line_codes (array('H')): Raw code from which every sensor reads above its threshold_min.
+        window_first, window_last (int): Sensors at the edges of the window of the next frame,
+            window_first is -1 for a full scan.
+        scans_to_full (int): Frames to the next periodic full scan.
+        window_scans, fallbacks, full_scans (int): Frames read as a window only, as a window and
+            then the rest, and in full.
     """
 
 
-    def __init__(self, mux_channels, select_pins, adc_pin, alpha=0.9, memory_length=5, threshold_min = 0.8, threshold_max=3.4):
+    def __init__(self, mux_channels, select_pins, adc_pin, alpha=0.9, memory_length=5, threshold_min = 0.8, threshold_max=3.4, settle_us=250, gray_order=True, smoothing=None, integer_mode=False, position_mode='average', backend=None, adaptive_scan=False, full_scan_every=20, scan_margin=1):
         """
-        Initializes the sensors using an analog multiplexer.
+        Initializes the sensors using an analog multiplexer, or the given backend.
         * positions_to_mux_channel: Mapping of position float -> mux channel (0-7)
         * select_pins: GPIO pins connected to S0, S1, S2 of the mux
         * adc_pin: ADC pin connected to the multiplexer output (e.g., ADC0)
-        * alpha: smoothing factor
+        * alpha: weight of the newest reading in the exponential moving average (1.0 disables it)
         * memory_length: number of previous sensor readings to store in memory
-        * threshold_min: voltages below this are treated as no line detected
-        * threshold max: voltages above this are treated as line fully detected
+        * threshold_min: voltages below this are treated as no line detected, one value or one per sensor
+        * threshold max: voltages above this are treated as line fully detected, one value or one per sensor
+        * settle_us: settle time after switching the mux, one value or a list in scan order
+        * gray_order: scan the channels so that only one select line changes between reads
+        * smoothing: 'ema', 'window' or None, see the smoothing attribute
+        * integer_mode: use the integer pipeline, see the integer_mode attribute
+        * position_mode: 'average', 'peak' or 'centroid', see the position_mode attribute
+        * backend: MuxADCBackend, IOExpanderBackend or ReplayBackend; the mux arguments (the first
+          three, settle_us and gray_order) are only used without one
+        * adaptive_scan: read only the sensors around the line, see scan_adaptive
+        * full_scan_every: frames between full scans of the adaptive scan
+        * scan_margin: sensors read on either side of those which saw the line in the previous frame
         """
-        self.mux_channels = mux_channels
+        if backend is None:
+            backend = MuxADCBackend(mux_channels, select_pins, adc_pin, settle_us, gray_order)
+        self.backend = backend
+        n = backend.count
+        self.raw = array('H', [0] * n)
+        self.selected = bytearray(b'\x01' * n)
+        self.adaptive_scan = adaptive_scan
+        self.full_scan_every = full_scan_every
+        self.scan_margin = scan_margin
+        self.window_scans = 0
+        self.fallbacks = 0
+        self.full_scans = 0
+        if adaptive_scan:
+            self.scan = self.scan_adaptive
+        else:
+            self.scan = backend.read_frame
         self.alpha = alpha
         self.memory_length = memory_length
+
+        self.integer_mode = integer_mode
+        self.lookup = None
+        if integer_mode:
+            self.voltages = [0] * n
+        else:
+            self.voltages = [0.0] * n  # Initialize voltages for each sensor position
+        self.set_thresholds(threshold_min, threshold_max)
+
+        # Smoothing state, preallocated so that smoothing creates no containers in the loop
+        if smoothing not in (None, 'ema', 'window'):
+            raise ValueError("smoothing must be 'ema', 'window' or None")
+        self.smoothing = smoothing
+        if integer_mode:
+            self.alpha_fixed = int(alpha * 256 + 0.5)
+            self.smoothed_prev_sensor_values = array('i', [0] * n)
+            self.prev_voltages = array('H', [0] * (n * memory_length))
+            self.window_sums = array('i', [0] * n)
+        else:
+            self.smoothed_prev_sensor_values = array('f', [0.0] * n)
+            self.prev_voltages = array('f', [0.0] * (n * memory_length))
+            self.window_sums = array('f', [0.0] * n)
+        self.reset_smoothing()
+
+        if position_mode == 'average':
+            self.get_position = self.get_position_weighted_average
+        elif position_mode == 'peak':
+            self.get_position = self.get_position_peak
+        elif position_mode == 'centroid':
+            self.get_position = self.get_position_centroid
+        else:
+            raise ValueError("position_mode must be 'average', 'peak' or 'centroid'")
+        self.position_mode = position_mode
+
+        self.profiler = None
+        
+    def set_thresholds(self, threshold_min, threshold_max):
+        """
+        Sets the truncation thresholds and precomputes the scale/offset pair of every sensor,
+        so that truncating a reading costs a multiply-add and a clip.
+        * threshold_min, threshold_max: one value for all sensors or a list with one value per sensor
+        """
+        n = len(self.voltages)
+        mins = list(threshold_min) if isinstance(threshold_min, (list, tuple)) else [threshold_min] * n
+        maxs = list(threshold_max) if isinstance(threshold_max, (list, tuple)) else [threshold_max] * n
         self.threshold_min = threshold_min
         self.threshold_max = threshold_max
+        self.line_codes = array('H', [min(65535, max(0, int(mins[i] / 5.0 * 65535) + 1)) for i in range(n)])
 
-        self.select_lines = [Pin(pin, Pin.OUT) for pin in select_pins]
+        self.scales = array('f', [0.0] * n)
+        self.offsets = array('f', [0.0] * n)
+        for i in range(n):
+            scale = 5.0 / (maxs[i] - mins[i])
+            self.scales[i] = scale
+            self.offsets[i] = -mins[i] * scale
 
-        self.adc = ADC(Pin(adc_pin))
+        if not self.integer_mode:
+            return
+        uniform = min(mins) == max(mins) and min(maxs) == max(maxs)
+        if uniform:
+            self.build_lookup_table()
+            return
 
-        self.voltages = [0.0] * 7  # Initialize voltages for each sensor position
-        
-    def select_channel(self, channel):
+        # Per-sensor thresholds: a fixed-point multiply-add on the 12-bit code instead of the table
+        self.lookup = None
+        one = 1 << FIXED_SHIFT
+        code_step = (1 << LOOKUP_SHIFT) * 5 / 65535.0
+        half_step = (1 << (LOOKUP_SHIFT - 1) if LOOKUP_SHIFT else 0) * 5 / 65535.0
+        self.scales_fixed = array('i', [0] * n)
+        self.offsets_fixed = array('i', [0] * n)
+        for i in range(n):
+            self.scales_fixed[i] = int(self.scales[i] * code_step * WEIGHT_SCALE * one + 0.5)
+            self.offsets_fixed[i] = int((self.scales[i] * half_step + self.offsets[i]) * WEIGHT_SCALE * one + 0.5)
+
+    def build_lookup_table(self):
+        """
+        Precomputes the truncated and scaled weight of every raw ADC code for the integer mode.
+        Must be called again after changing the thresholds.
+        """
+        size = 65536 >> LOOKUP_SHIFT
+        lookup = array('H', [0] * size)
+        half_step = 1 << (LOOKUP_SHIFT - 1) if LOOKUP_SHIFT else 0
+        for code in range(size):
+            voltage = (((code << LOOKUP_SHIFT) + half_step) / 65535.0) * 5
+            lookup[code] = int(self.truncate(voltage) * WEIGHT_SCALE + 0.5)
+        self.lookup = lookup
+
+    def to_sensor_units(self, voltage):
         """
-        Sets the multiplexer select lines to select the given channel (0-7)
+        Converts a voltage on the 0-5 scale to the units of self.voltages,
+        e.g. to compare the readings with a threshold.
         """
-        for i, pin in enumerate(self.select_lines):
-            pin.value((channel >> i) & 1) 
+        if self.integer_mode:
+            return int(voltage * WEIGHT_SCALE + 0.5)
+        return voltage
+
+    def read_raw_voltages(self, out):
+        """
+        Reads all sensors without truncation or smoothing into out, in volts.
+        Used for calibration, not in the control loop.
+        """
+        raw = self.backend.read_frame(self.raw)
+        for i in range(len(raw)):
+            out[i] = raw[i] / 65535.0 * 5
+        return out
+
+    def read_channel(self, channel, settle_us, repeats=1):
+        """
+        Average raw reading of one mux channel, see MuxADCBackend.read_channel.
+        """
+        return self.backend.read_channel(channel, settle_us, repeats)
+
+    def calibrate_settle(self, *args, **kwargs):
+        """
+        Measures the settle times of the mux, see MuxADCBackend.calibrate_settle.
+        """
+        return self.backend.calibrate_settle(*args, **kwargs)
+
+    def scan_adaptive(self, raw):
+        """
+        Reads the window of sensors around those which saw the line in the previous frame,
+        scan_margin more on either side. All sensors are read every full_scan_every frames and
+        while the line is not known. When a sensor at an edge of the window sees the line, which
+        may be moving out of it, or none in the window sees it, the rest are read at once and
+        the frame is a full one. The sensors not read get a raw code of 0, so the line position
+        and the all-off/all-on checks of the LineFollower see them off the line, as a full scan
+        would while the line reaches them past the edges of the window. A sharp corner may bring
+        the line under an outer sensor first, which is then read at the next fallback or full
+        scan (one frame later in the corners of the simulated tracks).
+        Returns raw.
+        """
+        backend = self.backend
+        selected = self.selected
+        line_codes = self.line_codes
+        n = len(selected)
+        first = self.window_first
+        last = self.window_last
+        self.scans_to_full -= 1
+        if first < 0 or self.scans_to_full <= 0 or last - first == n - 1:
+            for i in range(n):
+                selected[i] = 1
+            backend.read_frame(raw)
+            self.scans_to_full = self.full_scan_every
+            self.full_scans += 1
+        else:
+            for i in range(n):
+                selected[i] = 1 if first <= i <= last else 0
+            backend.read_selected(raw, selected)
+            seen = False
+            for i in range(first, last + 1):
+                if raw[i] >= line_codes[i]:
+                    seen = True
+                    break
+            if (not seen or (first > 0 and raw[first] >= line_codes[first])
+                    or (last < n - 1 and raw[last] >= line_codes[last])):
+                # Fall back to a full frame, reading only the sensors outside the window
+                for i in range(n):
+                    selected[i] ^= 1
+                backend.read_selected(raw, selected)
+                for i in range(n):
+                    selected[i] = 1
+                self.scans_to_full = self.full_scan_every
+                self.fallbacks += 1
+            else:
+                for i in range(n):
+                    if not selected[i]:
+                        raw[i] = 0
+                self.window_scans += 1
+
+        # The window of the next frame
+        first = -1
+        for i in range(n):
+            if raw[i] >= line_codes[i]:
+                if first < 0:
+                    first = i
+                last = i
+        if first >= 0:
+            first -= self.scan_margin
+            last += self.scan_margin
+            if first < 0:
+                first = 0
+            if last > n - 1:
+                last = n - 1
+        self.window_first = first
+        self.window_last = last
+        return raw
 
     def read_sensors(self):
         """
-        Reads all sensors via the multiplexer.
+        Reads a frame from the backend, of all sensors or of the window of the adaptive scan.
         Returns a list of smoothed voltages.
         """
 
         # read voltages
 
-        for i, channel in enumerate(self.mux_channels):
-            self.select_channel(channel)
-            utime.sleep_us(250)
-            raw_adc = self.adc.read_u16()  # 16-bit ADC read
-            voltage = (raw_adc / 65535.0) * 5  # Convert to voltage assuming 5V reference
-            self.voltages[i] = voltage  # Store the voltage in the correct position
+        raw = self.scan(self.raw)
+        if self.profiler is not None:
+            self.profiler.mark(STAGE_SCAN)
+
+        lookup = self.lookup
+        voltages = self.voltages
+        if lookup is not None:
+            # Truncated and scaled weight straight from the table
+            for i in range(len(voltages)):
+                voltages[i] = lookup[raw[i] >> LOOKUP_SHIFT]
+        elif self.integer_mode:
+            # Per-sensor fixed-point truncation
+            for i in range(len(voltages)):
+                weight = ((raw[i] >> LOOKUP_SHIFT) * self.scales_fixed[i] + self.offsets_fixed[i]) >> FIXED_SHIFT
+                if weight < 0:
+                    weight = 0
+                elif weight > 5 * WEIGHT_SCALE:
+                    weight = 5 * WEIGHT_SCALE
+                voltages[i] = weight
+        else:
+            for i in range(len(voltages)):
+                voltages[i] = (raw[i] / 65535.0) * 5  # Convert to voltage assuming 5V reference
 
         # calculate and update the average of past readings
         self.get_truncated_and_smoothed_voltages()
 
-        return self.voltages
+        return voltages
        
-    def get_position_weighted_average(self):
+    def get_position_weighted_average(self, voltages=None):
         """
         Calculates the voltage weighted average of the sensor positions.
         Since the line is seen for high voltages, the average is calculated
         using the sensor voltages as the weights of their positions.
-        * sensor_voltages: A dictionary of sensor voltages or a list of sensor voltages
-        * voltages_in_list: you know what that is
+        * voltages: a list of sensor voltages to use instead of self.voltages
         """
+        if voltages is None:
+            voltages = self.voltages
+
+        if self.integer_mode:
+            total_weight = 0
+            weighted_sum = 0
+            for i in range(len(voltages)):
+                voltage = voltages[i]
+                total_weight += voltage
+                weighted_sum += (i + 1) * voltage
+            # The only float operation of the integer pipeline
+            return weighted_sum / total_weight if total_weight != 0 else 0
+
         total_weight = 0.0
         weighted_sum = 0.0
                 
-        for i, voltage in enumerate(self.voltages):
+        # Indexed, as enumerate would allocate an iterator and a tuple per sensor
+        for i in range(len(voltages)):
+            voltage = voltages[i]
             total_weight += voltage
 
             weighted_sum += float(i + 1) * voltage
 
         return weighted_sum / total_weight if total_weight != 0 else 0
     
-    def truncate(self, voltage):
+    def find_peak(self, voltages):
+        """
+        Returns (index, left neighbour, peak, right neighbour) of the strongest sensor,
+        a missing neighbour beyond the outermost sensor counts as 0.
+        The line moves by less than a sensor spacing per step, so the peak is looked for next to
+        the previous one first, and a reflection seen by a sensor further away is rejected.
+        All sensors are searched only when none of those sees anything. When the line has moved
+        further, the peak found next to the previous one has a higher neighbour; it is then
+        moved towards the higher neighbours until it is a local maximum.
+        """
+        n = len(voltages)
+        peak = -1
+        best = 0
+        last = self.last_peak
+        if last >= 0:
+            for i in range(last - 1 if last > 0 else 0, last + 2 if last < n - 1 else n):
+                if voltages[i] > best:
+                    best = voltages[i]
+                    peak = i
+        if peak < 0:
+            peak = 0
+            best = voltages[0]
+            for i in range(1, n):
+                if voltages[i] > best:
+                    best = voltages[i]
+                    peak = i
+        else:
+            while peak > 0 and voltages[peak - 1] > best:
+                peak -= 1
+                best = voltages[peak]
+            while peak < n - 1 and voltages[peak + 1] > best:
+                peak += 1
+                best = voltages[peak]
+        self.last_peak = peak if best > 0 else -1
+        left = voltages[peak - 1] if peak > 0 else 0
+        right = voltages[peak + 1] if peak < len(voltages) - 1 else 0
+        return peak, left, best, right
+
+    def get_position_peak(self, voltages=None):
+        """
+        Calculates the line position with sub-sensor resolution from a parabola through the
+        strongest sensor and its two neighbours. The other sensors are ignored, so reflections
+        seen by sensors away from the line do not drag the estimate.
+        * voltages: a list of sensor voltages to use instead of self.voltages
         """
-        Clips voltage value between self.threshold_min and self.threshold_max.
+        if voltages is None:
+            voltages = self.voltages
+        peak, left, best, right = self.find_peak(voltages)
+        if best <= 0:
+            return 0
+        curvature = left - 2 * best + right
+        if curvature >= 0:
+            # No maximum to fit a parabola to, e.g. all three equal
+            return peak + 1.0
+        offset = (left - right) / (2 * curvature)
+        # A flat top (saturated sensors) may put the vertex beyond the neighbours
+        if offset > 0.5:
+            offset = 0.5
+        elif offset < -0.5:
+            offset = -0.5
+        return peak + 1.0 + offset
+
+    def get_position_centroid(self, voltages=None):
+        """
+        Calculates the line position as the average of the positions of the strongest sensor and its two
+        neighbours weighted by their readings, ignoring the other sensors.
+        * voltages: a list of sensor voltages to use instead of self.voltages
+        """
+        if voltages is None:
+            voltages = self.voltages
+        peak, left, best, right = self.find_peak(voltages)
+        total_weight = left + best + right
+        if total_weight <= 0:
+            return 0
+        return peak + 1.0 + (right - left) / total_weight
+
+    def truncate(self, voltage, i=0):
+        """
+        Clips voltage value between the thresholds of sensor i.
         Rescales the values to the 0-5 range.
         """
-        val = min(self.threshold_max, voltage) if voltage > self.threshold_min else self.threshold_min
-        
-        val_01 = (val-self.threshold_min) / (self.threshold_max-self.threshold_min) 
+        val = voltage * self.scales[i] + self.offsets[i]
         
-        return val_01*5
+        if val < 0.0:
+            return 0.0
+        if val > 5.0:
+            return 5.0
+        return val
     
     def get_truncated_and_smoothed_voltages(self):
         """
@@ -107,15 +444,99 @@ class Sensors:
         voltage values between self.threshold_min and self.threshold_max.
         """
         
-        for i in range(len(self.voltages)):
-            self.voltages[i] = self.truncate(self.voltages[i])
+        # In integer mode the lookup table has already truncated the readings
+        if self.lookup is None:
+            for i in range(len(self.voltages)):
+                self.voltages[i] = self.truncate(self.voltages[i], i)
+
+        if self.smoothing == 'ema':
+            self.smooth_exponential()
+        elif self.smoothing == 'window':
+            self.smooth_window()
+
+    def reset_smoothing(self):
+        """
+        Forgets the past readings, the next reading starts the smoothing afresh
+        and the line is looked for under all sensors.
+        """
+        self.last_peak = -1
+        self.window_first = -1
+        self.window_last = -1
+        self.scans_to_full = 0
+        self.history_index = 0
+        self.history_count = 0
+        for i in range(len(self.window_sums)):
+            self.window_sums[i] = 0
+
+    def smooth_exponential(self):
+        """
+        Replaces the voltages with their exponential moving average.
+        """
+        voltages = self.voltages
+        smoothed = self.smoothed_prev_sensor_values
+        alpha = self.alpha
+        if self.history_count == 0:
+            # The first reading initializes the average
+            for i in range(len(voltages)):
+                smoothed[i] = voltages[i]
+            self.history_count = 1
+            return
+        if self.integer_mode:
+            # alpha as a fraction of 256
+            alpha = self.alpha_fixed
+            for i in range(len(voltages)):
+                value = smoothed[i] + ((alpha * (voltages[i] - smoothed[i])) >> 8)
+                smoothed[i] = value
+                voltages[i] = value
+            return
+        for i in range(len(voltages)):
+            value = smoothed[i] + alpha * (voltages[i] - smoothed[i])
+            smoothed[i] = value
+            voltages[i] = value
+
+    def smooth_window(self):
+        """
+        Replaces the voltages with the mean of their last memory_length readings.
+        Running sums make it O(1) per sensor; they are recomputed from the history
+        each time the buffer wraps so that rounding errors do not accumulate.
+        """
+        voltages = self.voltages
+        history = self.prev_voltages
+        sums = self.window_sums
+        n = len(voltages)
+        row = self.history_index * n
+
+        if self.history_count < self.memory_length:
+            self.history_count += 1
+            for i in range(n):
+                sums[i] += voltages[i]
+                history[row + i] = voltages[i]
+        else:
+            for i in range(n):
+                sums[i] += voltages[i] - history[row + i]
+                history[row + i] = voltages[i]
+
+        self.history_index += 1
+        if self.history_index == self.memory_length:
+            self.history_index = 0
+            for i in range(n):
+                total = 0
+                for k in range(i, len(history), n):
+                    total += history[k]
+                sums[i] = total
 
+        count = self.history_count
+        if self.integer_mode:
+            for i in range(n):
+                voltages[i] = sums[i] // count
+        else:
+            for i in range(n):
+                voltages[i] = sums[i] / count
 
     def get_current_line_position(self):
         """
-        Calculates position of the line as average of sensor positions
-        weighted by their smoothed n=self.memory_length last readings.
-        Updates the value of self.smoothed_prev_sensor_values.
+        Calculates position of the line from the smoothed readings
+        with the estimator selected by position_mode.
         """
-        return self.get_position_weighted_average()
+        return self.get_position()
 
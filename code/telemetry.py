@@ -0,0 +1,166 @@
+import struct
+import utime
+from binascii import hexlify
+
+# One record per control step: ticks_us, one value per sensor, line position, error,
+# derivative, commanded left and right motor speeds, flags
+HEAD_FORMAT = '<I'
+SENSOR_FORMAT = '<f'
+TAIL_FORMAT = '<5fB'
+
+def record_format(sensors=7):
+    """
+    struct format of a record with the given number of sensor values.
+    """
+    return '<I' + str(sensors + 5) + 'fB'
+
+def record_fields(sensors=7):
+    """
+    Names of the fields of a record with the given number of sensor values.
+    """
+    return (('ticks_us',) + tuple('s' + str(i + 1) for i in range(sensors))
+            + ('position', 'error', 'derivative', 'left_speed', 'right_speed', 'flags'))
+
+# Bits of the flags field
+FLAG_TIGHT_TURN = 1   # Turning in place, no sensor sees the line or all of them do
+FLAG_LEFT = 2         # A lost line would be searched for on the left
+FLAG_PAUSED = 4       # Braking (or stopped) after a sharp turn, before following the line again
+FLAG_STOPPED = 8      # Stopped by the lost-line recovery
+FLAG_RAW = 16         # The sensor values are unprocessed readings in volts (debug MODE 'raw frames')
+
+class Telemetry:
+    """
+    Records the state of every control step into a preallocated bytearray ring buffer with
+    struct.pack_into, so the control loop neither allocates nor blocks on the USB serial as
+    print() does. The records are written out in bulk by drain() when there is time for it,
+    e.g. while the robot is off, or by dump() after the run, as read by host/telemetry_decode.py.
+
+    Attributes:
+        capacity (int): Number of most recent records kept.
+        scale (int): Sensor values per volt, 1000 with the integer sensor pipeline.
+        sensors (int): Number of sensor values in a record.
+        format (str): struct format of a record, see record_format.
+        size (int): Bytes per record.
+        record (method): Packs a record, record_any or, for seven sensors, record_seven with a
+            single pack_into.
+        buffer (bytearray): Ring buffer of capacity records of size bytes.
+        steps (int): Number of records written in total.
+        drained (int): Number of records written out by drain() in total, including the lost ones.
+        lost (int): Number of records overwritten before drain() wrote them out.
+    """
+
+    def __init__(self, capacity=512, scale=1, sensors=7):
+        """
+        * capacity: Number of most recent records kept
+        * scale: Sensor values per volt
+        * sensors: Number of sensors, len(sensors.voltages)
+        """
+        self.capacity = capacity
+        self.scale = scale
+        self.sensors = sensors
+        self.format = record_format(sensors)
+        self.size = struct.calcsize(self.format)
+        if sensors == 7:
+            self.record = self.record_seven
+        else:
+            self.record = self.record_any
+        self.buffer = bytearray(capacity * self.size)
+        self.steps = 0
+        self.drained = 0
+        self.lost = 0
+        self.offset = 0
+        self.header_sent = False
+
+    def record_any(self, voltages, position, error, derivative, left_speed, right_speed, flags):
+        """
+        Packs the state of one step into the ring buffer, overwriting the oldest record when full.
+        * voltages: The sensor values of the step, self.sensors of them
+        * position, error, derivative: Line position and the PID error and derivative
+        * left_speed, right_speed: Speeds commanded to the motors
+        * flags: FLAG_* bits
+        """
+        buffer = self.buffer
+        offset = self.offset
+        struct.pack_into(HEAD_FORMAT, buffer, offset, utime.ticks_us())
+        offset += 4
+        for i in range(self.sensors):
+            struct.pack_into(SENSOR_FORMAT, buffer, offset, voltages[i])
+            offset += 4
+        struct.pack_into(TAIL_FORMAT, buffer, offset, position, error, derivative, left_speed, right_speed, flags)
+        self.offset += self.size
+        if self.offset >= len(buffer):
+            self.offset = 0
+        self.steps += 1
+
+    def record_seven(self, voltages, position, error, derivative, left_speed, right_speed, flags):
+        """
+        record_any of seven sensors in a single pack_into.
+        """
+        struct.pack_into('<I12fB', self.buffer, self.offset, utime.ticks_us(),
+                         voltages[0], voltages[1], voltages[2], voltages[3], voltages[4], voltages[5],
+                         voltages[6], position, error, derivative, left_speed, right_speed, flags)
+        self.offset += self.size
+        if self.offset >= len(self.buffer):
+            self.offset = 0
+        self.steps += 1
+
+    def header(self, encoding, records):
+        return ('# telemetry format=' + self.format + ' size=' + str(self.size) + ' sensors=' + str(self.sensors)
+                + ' scale=' + str(self.scale) + ' steps=' + str(self.steps) + ' records=' + str(records)
+                + ' encoding=' + encoding)
+
+    def pending(self):
+        """
+        Number of records kept which drain() has not written out yet.
+        """
+        return min(self.steps - self.drained, self.capacity)
+
+    def slot(self, step):
+        """
+        Memoryview of the record written at the given step, which must still be kept.
+        """
+        offset = (step % self.capacity) * self.size
+        return memoryview(self.buffer)[offset:offset + self.size]
+
+    def drain(self, max_records=16):
+        """
+        Prints up to max_records of the oldest records not written out yet as hex lines.
+        Meant to be called in bulk when the loop has time for it; prints nothing if fewer
+        than max_records are waiting, unless max_records is 0, which prints all of them.
+        Returns the number of records printed.
+        """
+        waiting = self.pending()
+        if waiting == 0 or waiting < max_records:
+            return 0
+        first = self.steps - waiting
+        if first > self.drained:
+            self.lost += first - self.drained
+        count = waiting if max_records == 0 else max_records
+        if not self.header_sent:
+            print(self.header('hex', 0))
+            self.header_sent = True
+        for step in range(first, first + count):
+            print('T ' + hexlify(self.slot(step)).decode())
+        self.drained = first + count
+        return count
+
+    def dump(self, file=None):
+        """
+        Writes out all records kept which drain() has not written out yet, oldest first,
+        in the format read by host/telemetry_decode.py.
+        * file: Optional path on the flash to write the raw records to instead of printing hex lines
+        """
+        records = self.pending()
+        first = self.steps - records
+        if first > self.drained:
+            self.lost += first - self.drained
+        if file is None:
+            print(self.header('hex', records))
+            for step in range(first, self.steps):
+                print('T ' + hexlify(self.slot(step)).decode())
+        else:
+            with open(file, 'wb') as f:
+                f.write((self.header('raw', records) + '\n').encode())
+                for step in range(first, self.steps):
+                    f.write(self.slot(step))
+        self.drained = self.steps
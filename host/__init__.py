@@ -0,0 +1,52 @@
+"""
+Host-side stand-ins for the MicroPython modules used by the robot code,
+and a simulator which drives them on a virtual clock.
+
+Call install() before importing anything from ./code:
+
+    import host
+    host.install()
+    from sensors import Sensors
+"""
+import builtins
+import os
+import sys
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code")
+
+
+def install():
+    """
+    Registers the stand-ins as `machine`, `utime` and `micropython`, and as the `pimoroni_i2c`
+    and `breakout_ioexpander` modules of the Pimoroni firmware, and puts ./code on the import path.
+    CPython's own `_thread` module is used as is. The `gc` stand-in is given to the modules of
+    ./code alone: NumPy, pytest or the multiprocessing workers of host.tune keep CPython's gc,
+    whose collections would otherwise move the virtual clock.
+    """
+    from host import breakout_ioexpander, gc, machine, micropython, pimoroni_i2c, utime
+
+    sys.modules["machine"] = machine
+    sys.modules["utime"] = utime
+    sys.modules["micropython"] = micropython
+    if getattr(builtins.__import__, "stand_in", None) is None:
+        builtins.__import__ = code_import(builtins.__import__, "gc", gc)
+    sys.modules["pimoroni_i2c"] = pimoroni_i2c
+    sys.modules["breakout_ioexpander"] = breakout_ioexpander
+    if CODE_DIR not in sys.path:
+        sys.path.insert(0, CODE_DIR)
+
+
+def code_import(import_, name, stand_in):
+    """
+    Wraps __import__ so that `import name` in a module of ./code gives the stand-in, and
+    anywhere else the module it always did.
+    """
+    def robot_import(module, globals=None, locals=None, fromlist=(), level=0):
+        if module == name and level == 0 and globals is not None:
+            path = globals.get("__file__")
+            if path and os.path.dirname(os.path.abspath(path)) == CODE_DIR:
+                return stand_in
+        return import_(module, globals, locals, fromlist, level)
+
+    robot_import.stand_in = stand_in
+    return robot_import
@@ -0,0 +1,135 @@
+"""
+Compares the full scan of the sensors with the adaptive scan of Sensors.scan_adaptive, which
+reads only the window of sensors around the line, on the default and the sharp-cornered track
+at two base speeds. Reports the sensor readings and the scan time per step on the virtual
+clock and the reduction of the latter, the lap time, the line losses and the largest
+deviation from the line.
+
+The raw frames of a full-scan lap are then played back through two Sensors, one scanning in
+full and one adaptively. The frames whose all-off/all-on decision of the LineFollower and
+whose line position differ are counted, with the largest difference of the position, the
+channels read per frame and how the frames of the adaptive scan were read. The position
+differs where a sharp corner brings the line under an outer sensor before the sensor at the
+edge of the window sees it, until the full scan of the next frame (and the smoothing) catch up.
+
+Usage (from the repository root):
+    python -m host.bench_adaptive_scan [--seeds N]
+"""
+import argparse
+
+import host
+
+SETTINGS = (
+    ("full scan", {"ADAPTIVE_SCAN": False}),
+    ("main.py constants", {"ADAPTIVE_SCAN": True}),
+    ("full scan every 5", {"ADAPTIVE_SCAN": True, "FULL_SCAN_EVERY": 5}),
+    ("margin 2", {"ADAPTIVE_SCAN": True, "SCAN_MARGIN": 2}),
+)
+
+
+def compare_frames(c, frames):
+    """
+    Plays frames of raw codes back through a full and an adaptive scan.
+    Returns (frames with a different decision, frames with a different position, largest
+    difference of the position, channels read per frame, window scans, fallbacks, full scans).
+    """
+    from backends import ReplayBackend
+    from sensors import Sensors
+
+    def make_sensors(adaptive):
+        return Sensors(c["positions_to_mux_channel"], c["select_pins"], c["adc_pin"],
+                       threshold_min=c["THRESHOLD_MIN"], threshold_max=c["THRESHOLD_MAX"],
+                       memory_length=c["N_smoothing_memory"], alpha=c["smoothing_alpha"],
+                       smoothing=c["smoothing_mode"], backend=ReplayBackend(frames, loop=False),
+                       adaptive_scan=adaptive, full_scan_every=c["FULL_SCAN_EVERY"], scan_margin=c["SCAN_MARGIN"])
+
+    full = make_sensors(False)
+    adaptive = make_sensors(True)
+    epsilon = full.to_sensor_units(c["EPSILON"])
+    epsilon_upper = full.to_sensor_units(c["EPSILON_UPPER"])
+
+    def decision(voltages):
+        return (all(v < epsilon for v in voltages), all(v > epsilon_upper for v in voltages))
+
+    decisions = 0
+    positions = 0
+    largest = 0.0
+    channels = 0
+    for _ in frames:
+        full.read_sensors()
+        adaptive.read_sensors()
+        channels += sum(adaptive.selected)
+        if decision(full.voltages) != decision(adaptive.voltages):
+            decisions += 1
+        difference = abs(full.get_current_line_position() - adaptive.get_current_line_position())
+        if difference > 1e-9:
+            positions += 1
+            largest = max(largest, difference)
+    return (decisions, positions, largest, channels / len(frames), adaptive.window_scans, adaptive.fallbacks,
+            adaptive.full_scans)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seeds", type=int, default=3)
+    args = parser.parse_args()
+
+    host.install()
+    from host.run_lap import simulate_follower
+    from host.track import default_track, sharp_track
+    import main as robot_main
+    from profiler import Profiler
+
+    tracks = (("default track", default_track()), ("sharp track", sharp_track()))
+    for track_name, track in tracks:
+        for base_speed in (100.0, 150.0):
+            print("%s, base %.0f" % (track_name, base_speed))
+            print("  %-20s %10s %10s %10s %10s %12s %8s %16s" % ("scan", "reads", "scan us", "p99 us", "reduction",
+                                                                 "mean lap", "losses", "max deviation"))
+            full_us = None
+            for name, settings in SETTINGS:
+                constants = {"BASE_SPEED": base_speed}
+                constants.update(settings)
+                reads = 0.0
+                scan_us = 0.0
+                p99 = 0
+                total_time = 0.0
+                laps = 0
+                losses = 0
+                deviation = 0.0
+                for seed in range(args.seeds):
+                    profiler = Profiler(capacity=8192)
+                    result = simulate_follower(constants, max_time=60.0, seed=seed, track=track, profiler=profiler)
+                    stage, low, mean, high_p99, high = profiler.summary()[0]
+                    reads += result.adc_reads / result.steps
+                    scan_us += mean
+                    p99 = max(p99, high_p99)
+                    losses += result.line_losses
+                    deviation = max(deviation, result.max_deviation)
+                    if result.finished:
+                        total_time += result.lap_time
+                        laps += 1
+                reads /= args.seeds
+                scan_us /= args.seeds
+                if full_us is None:
+                    full_us = scan_us
+                print("  %-20s %10.2f %10.0f %10d %9.0f%% %10.2f s %8d %13.1f mm" % (
+                    name, reads, scan_us, p99, 100.0 * (1.0 - scan_us / full_us), total_time / laps if laps else 0.0,
+                    losses, 1000.0 * deviation))
+        print()
+
+    c = {name: getattr(robot_main, name) for name in dir(robot_main) if not name.startswith("_")}
+    print("full-scan laps played back through the adaptive scan of main.py")
+    print("  %-16s %8s %10s %10s %12s %16s %10s %10s %10s" % ("track", "frames", "decisions", "positions",
+                                                            "largest", "channels/frame", "window", "fallback",
+                                                            "full"))
+    for track_name, track in tracks:
+        raw_frames = []
+        simulate_follower({"ADAPTIVE_SCAN": False}, max_time=60.0, track=track, raw_frames=raw_frames)
+        frames = [codes for _, codes, _ in raw_frames]
+        print("  %-16s %8d %10d %10d %12.4f %16.2f %10d %10d %10d" % (
+            (track_name, len(frames)) + compare_frames(c, frames)))
+
+
+if __name__ == "__main__":
+    main()
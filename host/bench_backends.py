@@ -0,0 +1,116 @@
+"""
+Scan latency of the sensor backends of code/backends.py: the multiplexer with the settle
+time of main.py, the IO expander on I2C read the way of the Pimoroni library and with the
+batched register transfers, and the replay of recorded frames. Reports the bus transactions
+and the time of a scan on the virtual clock (settle sleeps, bits on the bus), and the cost of
+Sensors.read_sensors on this host. The expander scans are checked to read the same codes,
+also with a conversion slower than a bus transaction, which the batched scan has to poll for.
+
+The bus time is that of the bits only; on the Pico every I2C call adds some tens of
+microseconds of interpreter and driver time, which makes the fewer transactions count more.
+
+Usage (from the repository root):
+    python -m host.bench_backends [--scans N]
+"""
+import argparse
+import random
+import time
+
+import host
+
+
+def measure(sensors, scans, before_scan=None):
+    """
+    Returns (transactions per scan, microseconds per scan on the virtual clock,
+    microseconds per read_sensors on this host, list of the raw frames).
+    """
+    from host.clock import clock
+    from host.machine import board
+
+    frames = []
+    transactions = board.i2c_transactions
+    start_us = clock.now_us
+    host_seconds = 0.0
+    for k in range(scans):
+        if before_scan is not None:
+            before_scan(k)
+        start = time.perf_counter()
+        sensors.read_sensors()
+        host_seconds += time.perf_counter() - start
+        frames.append(list(sensors.raw))
+    return ((board.i2c_transactions - transactions) / scans, (clock.now_us - start_us) / scans,
+            1e6 * host_seconds / scans, frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, default=200)
+    args = parser.parse_args()
+
+    host.install()
+    from backends import IOExpanderBackend, ReplayBackend
+    from breakout_ioexpander import BreakoutIOExpander, IOExpanderModel
+    from host.machine import board
+    from pimoroni_i2c import PimoroniI2C
+    import main as robot_main
+    from sensors import Sensors
+
+    c = robot_main
+
+    def make_sensors(backend=None):
+        return Sensors(c.positions_to_mux_channel, c.select_pins, c.adc_pin, threshold_min=c.THRESHOLD_MIN,
+                       threshold_max=c.THRESHOLD_MAX, settle_us=c.MUX_SETTLE_US, backend=backend)
+
+    print("%-52s %8s %14s %14s %12s" % ("backend", "sensors", "transactions", "scan us", "host us"))
+
+    def report(name, sensors, result):
+        print("%-52s %8d %14.1f %14.1f %12.1f" % (name, len(sensors.voltages), result[0], result[1], result[2]))
+
+    sensors = make_sensors()
+    report("mux, settle %d us" % c.MUX_SETTLE_US, sensors, measure(sensors, args.scans))
+
+    # Random inputs of the expander channels, the same for every scan of the same index
+    model = IOExpanderModel()
+    model.attach(c.IOE_ADDRESS)
+    rng = random.Random(1)
+    inputs = [[rng.uniform(0.0, 3.3) for _ in range(8)] for _ in range(args.scans)]
+
+    def set_inputs(k):
+        model.volts = inputs[k]
+
+    reference = None
+    mismatches = 0
+    for frequency in (100000, 400000):
+        i2c = PimoroniI2C(baudrate=frequency, **c.IOE_I2C_PINS)
+        ioe = BreakoutIOExpander(i2c, address=c.IOE_ADDRESS)
+        for name, batched, burst in (("library", False, False), ("batched", True, False),
+                                     ("batched, burst read", True, True)):
+            board.i2c_transactions = 0
+            backend = IOExpanderBackend(i2c, c.IOE_PINS, c.IOE_ADDRESS, ioe=ioe, batched=batched, burst=burst)
+            sensors = make_sensors(backend)
+            result = measure(sensors, args.scans, set_inputs)
+            report("ioexpander %d kHz, %s" % (frequency // 1000, name), sensors, result)
+            if reference is None:
+                reference = result[3]
+            mismatches += sum(frame != expected for frame, expected in zip(result[3], reference))
+
+    # An ADC clock divided down far enough that the conversion outlasts the first poll
+    model.conversion_us = 250
+    i2c = PimoroniI2C(baudrate=400000, **c.IOE_I2C_PINS)
+    ioe = BreakoutIOExpander(i2c, address=c.IOE_ADDRESS)
+    for name, batched in (("library", False), ("batched, burst read", True)):
+        backend = IOExpanderBackend(i2c, c.IOE_PINS, c.IOE_ADDRESS, ioe=ioe, batched=batched, burst=True)
+        sensors = make_sensors(backend)
+        result = measure(sensors, args.scans, set_inputs)
+        report("ioexpander 400 kHz, %s, %d us ADC" % (name, model.conversion_us), sensors, result)
+        mismatches += sum(frame != expected for frame, expected in zip(result[3], reference))
+
+    sensors = make_sensors(ReplayBackend([[rng.randrange(65536) for _ in range(7)] for _ in range(args.scans)]))
+    report("replay", sensors, measure(sensors, args.scans))
+
+    print()
+    print("expander frames differing from the library's: %d" % mismatches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Compares the static battery_constant with the battery voltage compensation (code/battery.py)
+on the simulated track, with the wheel speeds proportional to the battery voltage: laps at
+a full, a nominal and a flat battery, and a lap on a battery draining during the run.
+
+The gain points of the compensation are derived from the simulated motors here, so that the
+compensated speed equals the uncompensated one at the nominal voltage. On the robot they are
+the hand-measured BATTERY_GAIN_POINTS of main.py.
+
+Usage (from the repository root):
+    python -m host.bench_battery
+"""
+import argparse
+
+import host
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nominal", type=float, default=8.0, help="voltage at which the static constant was tuned")
+    args = parser.parse_args()
+
+    host.install()
+    from host.run_lap import simulate_follower
+    from host.simulator import BatteryModel
+    import main as robot_main
+
+    constant = robot_main.battery_constant
+    points = tuple((v / 2.0, constant * args.nominal / (v / 2.0)) for v in range(12, 21))
+    cases = [
+        ("full 8.8 V", BatteryModel(8.8, nominal_voltage=args.nominal)),
+        ("nominal %.1f V" % args.nominal, BatteryModel(args.nominal, nominal_voltage=args.nominal)),
+        ("flat 7.2 V", BatteryModel(7.2, nominal_voltage=args.nominal)),
+        ("draining 8.8 V -0.06 V/s", BatteryModel(8.8, drain=0.06, nominal_voltage=args.nominal)),
+    ]
+
+    print("%-26s %-14s %10s %8s %14s" % ("battery", "speed scaling", "lap time", "losses", "max deviation"))
+    for name, battery in cases:
+        for label, compensation in (("static", False), ("compensated", True)):
+            result = simulate_follower({"BATTERY_COMPENSATION": compensation, "BATTERY_GAIN_POINTS": points},
+                                       battery=battery)
+            lap = "%.2f s" % result.lap_time if result.finished else "DNF"
+            print("%-26s %-14s %10s %8d %11.1f mm" % (name, label, lap, result.line_losses,
+                                                      result.max_deviation * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Runs the benchmark of the code emitters (code/bench_fastpath.py) on this host with a real
+clock. On CPython the native and viper decorators do nothing, so the three columns should
+agree: it checks that every variant runs and shows the cost of the imports. The numbers
+that matter come from running the same script on the Pico.
+
+Usage (from the repository root):
+    python -m host.bench_fastpath
+"""
+import time
+
+import host
+
+
+def ticks_us():
+    return time.perf_counter() * 1e6
+
+
+def ticks_diff(end, start):
+    return end - start
+
+
+def main():
+    host.install()
+    import bench_fastpath
+    bench_fastpath.run(ticks_us, ticks_diff)
+
+
+if __name__ == "__main__":
+    main()
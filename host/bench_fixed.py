@@ -0,0 +1,112 @@
+"""
+Compares the float sensor pipeline of Sensors (voltage conversion, truncate, weighted
+average) with the integer pipeline (lookup table from raw codes, integer weighted average)
+on synthetic frames: throughput of read_sensors + get_current_line_position on this host
+and the difference between the results of the two.
+
+Usage (from the repository root):
+    python -m host.bench_fixed [--frames N]
+"""
+import argparse
+import math
+import random
+import time
+
+import host
+
+
+class ReplayADC:
+    """
+    Stands in for the ADC and returns prepared raw codes one after another.
+    """
+
+    def __init__(self, codes):
+        self.codes = codes
+        self.index = 0
+
+    def read_u16(self):
+        code = self.codes[self.index]
+        self.index += 1
+        return code
+
+
+def synthetic_frames(count, seed=0):
+    """
+    Raw ADC codes of the seven sensors over a line at a random position,
+    with background and line levels like the KTIR0711S behind the mux.
+    """
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        line = rng.uniform(0.0, 8.0)
+        frame = []
+        for i in range(7):
+            coverage = math.exp(-((i + 1 - line) ** 2) / 0.8)
+            voltage = 2.6 + 2.3 * coverage + rng.gauss(0.0, 0.02)
+            frame.append(max(0, min(65535, int(voltage / 5.0 * 65535))))
+        frames.append(frame)
+    return frames
+
+
+def run(sensors, frames):
+    """
+    Returns (seconds, list of (weights on the 0-5 scale, position)) for all frames.
+    """
+    codes = []
+    for frame in frames:
+        codes.extend(frame[i] for i in sensors.backend.scan_order)
+    sensors.backend.adc = ReplayADC(codes)
+    scale = 1000.0 if sensors.integer_mode else 1.0
+
+    results = []
+    start = time.perf_counter()
+    for _ in frames:
+        sensors.read_sensors()
+        results.append(sensors.get_current_line_position())
+    elapsed = time.perf_counter() - start
+
+    # Second pass for the weights, outside of the timing
+    sensors.backend.adc = ReplayADC(codes)
+    outputs = []
+    for position in results:
+        sensors.read_sensors()
+        outputs.append(([v / scale for v in sensors.voltages], position))
+    return elapsed, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=20000)
+    args = parser.parse_args()
+
+    host.install()
+    import main as robot_main
+    from sensors import Sensors
+
+    frames = synthetic_frames(args.frames)
+
+    def make_sensors(integer_mode):
+        return Sensors(robot_main.positions_to_mux_channel, robot_main.select_pins, robot_main.adc_pin,
+                       threshold_min=robot_main.THRESHOLD_MIN, threshold_max=robot_main.THRESHOLD_MAX,
+                       settle_us=0, integer_mode=integer_mode)
+
+    float_time, float_out = run(make_sensors(False), frames)
+    integer_time, integer_out = run(make_sensors(True), frames)
+
+    weight_error = 0.0
+    position_error = 0.0
+    for (fw, fp), (iw, ip) in zip(float_out, integer_out):
+        weight_error = max(weight_error, max(abs(a - b) for a, b in zip(fw, iw)))
+        position_error = max(position_error, abs(fp - ip))
+
+    print("%-10s %14s %14s" % ("pipeline", "frames/s", "us/frame"))
+    print("%-10s %14.0f %14.2f" % ("float", args.frames / float_time, float_time / args.frames * 1e6))
+    print("%-10s %14.0f %14.2f" % ("integer", args.frames / integer_time, integer_time / args.frames * 1e6))
+    print()
+    print("speedup: %.2fx" % (float_time / integer_time))
+    print("max weight difference: %.4f (0-5 scale)" % weight_error)
+    print("max position difference: %.5f (sensor spacings)" % position_error)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Compares laps with and without the curve look-ahead (code/lookahead.py) on the default and
+the sharp-cornered track at rising base speeds, with the soft slowdown on the current error
+which leaves the braking before the curves to the look-ahead. Reports the mean lap time, the
+line losses and the largest deviation from the line over several seeds.
+
+Usage (from the repository root):
+    python -m host.bench_lookahead [--seeds N]
+"""
+import argparse
+
+import host
+
+SETTINGS = (
+    ("off", {"LOOKAHEAD": False}),
+    ("main.py constants", {"LOOKAHEAD": True}),
+    ("min scale 0.6", {"LOOKAHEAD": True, "LOOKAHEAD_MIN_SCALE": 0.6}),
+    ("margin 1.0", {"LOOKAHEAD": True, "LOOKAHEAD_MARGIN": 1.0}),
+    ("horizon 8 steps", {"LOOKAHEAD": True, "LOOKAHEAD_HORIZON": 8.0}),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seeds", type=int, default=3)
+    args = parser.parse_args()
+
+    host.install()
+    from host.run_lap import simulate_follower
+    from host.track import default_track, sharp_track
+
+    for track_name, track in (("default track", default_track()), ("sharp track", sharp_track())):
+        for base_speed in (100.0, 150.0, 200.0):
+            print("%s, base %.0f" % (track_name, base_speed))
+            print("  %-20s %12s %8s %16s %12s" % ("look-ahead", "mean lap", "losses", "max deviation", "unfinished"))
+            for name, settings in SETTINGS:
+                constants = {"BASE_SPEED": base_speed, "K_se": 0.05, "K_sd": 0.05}
+                constants.update(settings)
+                total_time = 0.0
+                laps = 0
+                losses = 0
+                deviation = 0.0
+                unfinished = 0
+                for seed in range(args.seeds):
+                    result = simulate_follower(constants, max_time=60.0, seed=seed, track=track)
+                    if not result.finished:
+                        unfinished += 1
+                        continue
+                    total_time += result.lap_time
+                    laps += 1
+                    losses += result.line_losses
+                    deviation = max(deviation, result.max_deviation)
+                print("  %-20s %10.2f s %8d %13.1f mm %12d" % (name, total_time / laps if laps else 0.0, losses,
+                                                              1000.0 * deviation, unfinished))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Compares configurations of the PIDController (code/pid.py) on the simulated track: the
+plain PD controller of main.py, the filtered derivative, the integral with anti-windup and
+a gain schedule on the speed, and the cost of one update on this host.
+
+Usage (from the repository root):
+    python -m host.bench_pid [--seeds N]
+"""
+import argparse
+import random
+import time
+
+import host
+
+SETTINGS = [
+    ("PD (main.py)", {}),
+    ("filtered D", {"KD_TAU": 0.02}),
+    ("filtered D, Kd -0.8", {"KD_TAU": 0.02, "Kd": -0.8}),
+    ("PI-D, clamped", {"Ki": -5.0, "INTEGRAL_LIMIT": 0.5}),
+    ("PI-D, filtered, clamped", {"KD_TAU": 0.02, "Ki": -5.0, "INTEGRAL_LIMIT": 0.5}),
+    ("PI-D, anti-windup only", {"Ki": -5.0}),
+    ("gain schedule", {"GAIN_SCHEDULE": ((40.0, -20.0, -0.4, 0.0), (100.0, -25.0, -0.4, 0.0))}),
+]
+
+
+def update_cost(controller, count=100000, repeats=5):
+    """
+    Microseconds per update_output() call, the one of the control loop, on this host, the best
+    of some runs, with positions spread under the sensors.
+    """
+    rng = random.Random(0)
+    positions = [rng.uniform(1.0, 7.0) for _ in range(1000)]
+    update = controller.update_output
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(count // len(positions)):
+            for position in positions:
+                update(position, 0.01)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seeds", type=int, default=3)
+    args = parser.parse_args()
+
+    host.install()
+    from host.run_lap import simulate_follower
+    import main as robot_main
+    from pid import PIDController
+
+    print("%-26s %10s %8s %14s %10s" % ("controller", "mean lap", "losses", "max deviation", "us/update"))
+    for name, constants in SETTINGS:
+        c = {name: getattr(robot_main, name) for name in ("Kp", "Kd", "Ki", "dt", "middle_of_line", "KD_TAU",
+                                                         "INTEGRAL_LIMIT", "GAIN_SCHEDULE")}
+        c.update(constants)
+        laps = []
+        losses = 0
+        deviation = 0.0
+        for seed in range(args.seeds):
+            result = simulate_follower(constants, seed=seed)
+            if result.finished:
+                laps.append(result.lap_time)
+            losses += result.line_losses
+            deviation = max(deviation, result.max_deviation)
+        controller = PIDController(c["Kp"], c["Kd"], c["Ki"], c["dt"], setpoint=c["middle_of_line"],
+                                   derivative_tau=c["KD_TAU"], integral_limit=c["INTEGRAL_LIMIT"],
+                                   schedule=c["GAIN_SCHEDULE"])
+        lap = "%.2f s" % (sum(laps) / len(laps)) if len(laps) == args.seeds else "DNF"
+        print("%-26s %10s %8d %11.1f mm %10.3f" % (name, lap, losses, deviation * 1000, update_cost(controller)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Compares the line position estimators of Sensors (position_mode 'average', 'peak' and
+'centroid') on synthetic frames with a known line position: accuracy, robustness against
+reflections seen by sensors away from the line and cost per call on this host.
+
+The frames come from the sensor model of the simulator (host/simulator.py): the line
+wandering under the sensor row as it does between control steps, sensor noise and, in a
+share of the frames, one sensor at least two spacings from the line seeing a reflection.
+In another share the line jumps by 1.5 to 2.5 sensor spacings from the previous frame, as
+after a missed step or a sharp turn, which the peak search next to the previous peak must
+follow.
+
+Usage (from the repository root):
+    python -m host.bench_position [--frames N] [--reflections SHARE] [--jumps SHARE]
+"""
+import argparse
+import random
+import time
+
+import host
+
+
+def synthetic_frames(count, sensor_model, robot, reflections=0.2, jumps=0.05, line_width=0.019, seed=0):
+    """
+    Returns a list of (true position in sensor units, raw voltages, has reflection, follows a jump).
+    """
+    rng = random.Random(seed)
+    spacing = robot.sensor_spacing
+    frames = []
+    position = (1 + robot.sensor_count) / 2.0
+    for _ in range(count):
+        # Random walk of about 1 mm per step, kept under the sensor row
+        position += rng.gauss(0.0, 0.1)
+        jump = rng.random() < jumps
+        if jump:
+            position += rng.choice((-1.0, 1.0)) * rng.uniform(1.5, 2.5)
+        if position < 1.0:
+            position = 2.0 - position
+        elif position > robot.sensor_count:
+            position = 2.0 * robot.sensor_count - position
+        voltages = []
+        for i in range(robot.sensor_count):
+            distance = abs(i + 1 - position) * spacing
+            edge = sensor_model.edge_width
+            coverage = max(0.0, min(1.0, (line_width / 2 + edge / 2 - distance) / edge))
+            voltage = sensor_model.background_voltage \
+                + (sensor_model.line_voltage - sensor_model.background_voltage) * coverage
+            voltages.append(voltage + rng.gauss(0.0, sensor_model.noise))
+        reflection = rng.random() < reflections
+        if reflection:
+            # A sensor at least two spacings from the line sees a strong reflection
+            far = [i for i in range(robot.sensor_count) if abs(i + 1 - position) >= 2.0]
+            if far:
+                voltages[rng.choice(far)] = rng.uniform(4.0, 5.0)
+            else:
+                reflection = False
+        frames.append((position, voltages, reflection, jump))
+    return frames
+
+
+def evaluate(sensors, frames, repeats=20):
+    """
+    Returns (mean error, p95 error, max error, mean error with reflections, mean error after
+    jumps, us per call).
+    """
+    weights = []
+    for _, voltages, _, _ in frames:
+        weights.append([sensors.to_sensor_units(sensors.truncate(v, i)) for i, v in enumerate(voltages)])
+
+    errors = []
+    reflected = []
+    jumped = []
+    sensors.reset_smoothing()
+    for (position, _, reflection, jump), frame in zip(frames, weights):
+        error = abs(sensors.get_position(frame) - position)
+        if jump:
+            jumped.append(error)
+        elif reflection:
+            reflected.append(error)
+        else:
+            errors.append(error)
+
+    estimate = sensors.get_position
+    sensors.reset_smoothing()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for frame in weights:
+            estimate(frame)
+    cost = (time.perf_counter() - start) / (repeats * len(weights)) * 1e6
+
+    errors.sort()
+    mean = sum(errors) / len(errors)
+    p95 = errors[int(len(errors) * 0.95)]
+    reflected_mean = sum(reflected) / len(reflected) if reflected else 0.0
+    jumped_mean = sum(jumped) / len(jumped) if jumped else 0.0
+    return mean, p95, errors[-1], reflected_mean, jumped_mean, cost
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--reflections", type=float, default=0.2, help="share of frames with a reflection")
+    parser.add_argument("--jumps", type=float, default=0.05, help="share of frames after a jump of the line")
+    args = parser.parse_args()
+
+    host.install()
+    from host.simulator import RobotModel, SensorModel
+    import main as robot_main
+    from sensors import Sensors
+
+    frames = synthetic_frames(args.frames, SensorModel(), RobotModel(), args.reflections, args.jumps)
+
+    print("errors in sensor spacings (12 mm), reflections on %.0f%% of the frames, jumps on %.0f%%" % (
+        100 * args.reflections, 100 * args.jumps))
+    print("%-10s %-8s %10s %10s %10s %16s %12s %10s" % ("estimator", "pipeline", "mean", "p95", "max",
+                                                         "with reflection", "after jump", "us/call"))
+    for integer_mode in (False, True):
+        for mode in ("average", "peak", "centroid"):
+            sensors = Sensors(robot_main.positions_to_mux_channel, robot_main.select_pins, robot_main.adc_pin,
+                              threshold_min=robot_main.THRESHOLD_MIN, threshold_max=robot_main.THRESHOLD_MAX,
+                              settle_us=0, integer_mode=integer_mode, position_mode=mode)
+            print("%-10s %-8s %10.4f %10.4f %10.4f %16.4f %12.4f %10.2f" % (
+                (mode, "integer" if integer_mode else "float") + evaluate(sensors, frames)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares settings of the lost-line recovery (code/recovery.py) on simulated laps on which
+the robot loses the line: the original stop for one step after a sharp turn, following the
+line at once and braking pulses against the turn. Reports the mean lap time, the line
+losses and the time per loss spent turning in place and braking, over several seeds.
+
+Usage (from the repository root):
+    python -m host.bench_recovery [--seeds N]
+"""
+import argparse
+
+import host
+
+SETTINGS = (
+    ("stop 1 step (original)", 1, 0.0),
+    ("follow at once", 0, 0.0),
+    ("brake 1 step x0.2", 1, 0.2),
+    ("brake 1 step x0.4", 1, 0.4),
+    ("brake 2 steps x0.2", 2, 0.2),
+    ("main.py constants", None, None),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seeds", type=int, default=4)
+    args = parser.parse_args()
+
+    host.install()
+    from host.run_lap import simulate_follower
+    from host.track import default_track, sharp_track
+    import main as robot_main
+    from recovery import RecoveryStateMachine
+
+    scenarios = (
+        ("sharp track, base 150", sharp_track(), {"BASE_SPEED": 150.0}),
+        ("sharp track, base 200", sharp_track(), {"BASE_SPEED": 200.0}),
+        ("sharp track, base 150, soft slowdown", sharp_track(), {"BASE_SPEED": 150.0, "K_se": 0.05, "K_sd": 0.05}),
+        ("default track, base 200, soft slowdown", default_track(), {"BASE_SPEED": 200.0, "K_se": 0.05, "K_sd": 0.05}),
+    )
+
+    print("%-24s %12s %8s %16s %12s" % ("recovery", "mean lap", "losses", "ms per loss", "unfinished"))
+    for name, brake_steps, brake_gain in SETTINGS:
+        if brake_steps is None:
+            brake_steps, brake_gain = robot_main.RECOVERY_BRAKE_STEPS, robot_main.RECOVERY_BRAKE_GAIN
+        total_time = 0.0
+        laps = 0
+        losses = 0
+        recovery_steps = 0
+        recoveries = 0
+        unfinished = 0
+        for _, track, constants in scenarios:
+            for seed in range(args.seeds):
+                recovery = RecoveryStateMachine(brake_steps, brake_gain)
+                result = simulate_follower(constants, max_time=60.0, seed=seed, track=track, recovery=recovery)
+                if not result.finished:
+                    unfinished += 1
+                    continue
+                total_time += result.lap_time
+                laps += 1
+                losses += result.line_losses
+                recovery_steps += recovery.recovery_steps
+                recoveries += recovery.losses
+        per_loss = 1000.0 * robot_main.dt * recovery_steps / recoveries if recoveries else 0.0
+        print("%-24s %10.2f s %8d %13.0f ms %12d" % (name, total_time / laps if laps else 0.0, losses,
+                                                       per_loss, unfinished))
+
+
+if __name__ == "__main__":
+    main()
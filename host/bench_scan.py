@@ -0,0 +1,108 @@
+"""
+Compares the multiplexer scan of the original Sensors.read_sensors (all select lines
+written, fixed 250 us settle, channels in position order) with the Gray-code ordered
+scan using calibrated settle times. Reports the scan latency on the virtual clock,
+select line writes per scan and the error against the noise-free sensor voltages.
+
+Usage (from the repository root):
+    python -m host.bench_scan [--poses N]
+"""
+import argparse
+import math
+import random
+
+import host
+
+
+def legacy_scan(sensors, utime):
+    """
+    The scan as it was before Gray ordering and calibration.
+    """
+    for i, channel in enumerate(sensors.backend.mux_channels):
+        sensors.backend.select_channel(channel)
+        utime.sleep_us(250)
+        sensors.voltages[i] = sensors.backend.adc.read_u16() / 65535.0 * 5
+    sensors.get_truncated_and_smoothed_voltages()
+    return sensors.voltages
+
+
+def measure(scan, sensors, simulation, poses):
+    from host.clock import clock
+    from host.machine import board
+
+    latency = 0
+    writes = 0
+    worst = 0.0
+    squares = 0.0
+    for index, x, y, heading in poses:
+        simulation.x, simulation.y, simulation.heading = x, y, heading
+        simulation.track_index = index
+        simulation.sensor_hints = [index] * len(simulation.sensor_hints)
+        expected = [sensors.truncate(simulation.sensor_voltage(i), i) for i in range(len(sensors.voltages))]
+        start_us = clock.now_us
+        start_writes = board.writes
+        voltages = scan()
+        latency += clock.now_us - start_us
+        writes += board.writes - start_writes
+        for got, want in zip(voltages, expected):
+            worst = max(worst, abs(got - want))
+            squares += (got - want) ** 2
+    count = len(poses)
+    return latency / count, writes / count, worst, math.sqrt(squares / (count * len(sensors.voltages)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--poses", type=int, default=500)
+    args = parser.parse_args()
+
+    host.install()
+    from host.simulator import Simulation, SensorModel
+    from host.track import default_track
+    import main as robot_main
+    import utime
+    from sensors import Sensors
+
+    track = default_track()
+    simulation = Simulation(track, robot_main.motor_pins, robot_main.motor_enable_pins, robot_main.select_pins,
+                            robot_main.adc_pin, robot_main.positions_to_mux_channel, sensor=SensorModel(noise=0.0),
+                            max_time=1e9, off_track_distance=1e9)
+    simulation.attach()
+
+    # Poses scattered along the track, up to 4 cm off the line and 30 degrees off its direction
+    rng = random.Random(1)
+    poses = []
+    for _ in range(args.poses):
+        i = rng.randrange(track.n)
+        j = (i + 1) % track.n
+        direction = math.atan2(track.ys[j] - track.ys[i], track.xs[j] - track.xs[i])
+        offset = rng.uniform(-0.04, 0.04)
+        poses.append((i, track.xs[i] - offset * math.sin(direction) - 0.07 * math.cos(direction),
+                      track.ys[i] + offset * math.cos(direction) - 0.07 * math.sin(direction),
+                      direction + math.radians(rng.uniform(-30, 30))))
+
+    def make_sensors(**kwargs):
+        return Sensors(robot_main.positions_to_mux_channel, robot_main.select_pins, robot_main.adc_pin,
+                       threshold_min=robot_main.THRESHOLD_MIN, threshold_max=robot_main.THRESHOLD_MAX, **kwargs)
+
+    legacy = make_sensors(settle_us=250, gray_order=False)
+    old = measure(lambda: legacy_scan(legacy, utime), legacy, simulation, poses)
+
+    # Calibrate standing on the line as on the robot
+    simulation.x, simulation.y, simulation.heading = track.start_pose()
+    fast = make_sensors(settle_us=250)
+    settle = fast.calibrate_settle(250)
+    new = measure(fast.read_sensors, fast, simulation, poses)
+
+    print("scan order (mux channels): %s" % fast.backend.scan_channels)
+    print("calibrated settle times (us): %s" % settle)
+    print()
+    print("%-24s %12s %14s %12s %12s" % ("scan", "latency us", "select writes", "max error", "rms error"))
+    print("%-24s %12.0f %14.1f %12.4f %12.4f" % (("original",) + old))
+    print("%-24s %12.0f %14.1f %12.4f %12.4f" % (("gray + calibrated",) + new))
+    print()
+    print("latency reduced by %.0f%%" % (100.0 * (1.0 - new[0] / old[0])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Host stand-in for the `breakout_ioexpander` module of the Pimoroni MicroPython firmware,
+and a model of the expander itself on the I2C stand-in of host/machine.py.
+
+The driver issues the register transfers of the Pimoroni library, so the bus transactions
+and their time on the virtual clock can be compared with code/backends.py. Only the ADC is
+modelled; the port mode registers are not.
+"""
+from host.clock import clock
+from host.machine import board
+
+REG_ADCRL = 0x82
+REG_ADCRH = 0x83
+REG_ADCCON1 = 0xA1
+REG_ADCCON0 = 0xA8
+REG_AINDIDS = 0xB6
+ADCF = 0x80
+ADCS = 0x40
+ADCEN = 0x01
+# Duration of a conversion on the virtual clock, shorter than the read which follows at 400 kHz
+CONVERSION_US = 20
+
+# ADC channel of the pins 7-14
+ADC_CHANNELS = {7: 7, 8: 6, 9: 5, 10: 1, 11: 3, 12: 4, 13: 2, 14: 0}
+
+
+class IOExpanderModel:
+    """
+    Registers of the expander behind its I2C address. The register address advances with
+    every byte of a transfer. Setting ADCS in ADCCON0 with the ADC enabled starts a conversion
+    of the selected channel, which ends conversion_us later on the virtual clock: the result
+    registers and ADCF are set by the first read from then on. A read of the result before
+    that gets the previous one.
+
+    Attributes:
+        registers (bytearray): The 256 registers.
+        volts (list[float]): Input voltage of every ADC channel.
+        vref (float): Full scale of the ADC.
+        conversion_us (int): Duration of a conversion.
+        converting (int): Channel being converted, -1 when the ADC is idle.
+        done_us (int): Time at which the conversion ends.
+        conversions (int): Number of conversions done.
+    """
+
+    def __init__(self, vref=3.3, conversion_us=CONVERSION_US):
+        self.registers = bytearray(256)
+        self.volts = [0.0] * 8
+        self.vref = vref
+        self.conversion_us = conversion_us
+        self.converting = -1
+        self.done_us = 0
+        self.conversions = 0
+
+    def attach(self, address=0x18):
+        board.i2c_devices[address] = self
+
+    def read(self, register, n):
+        if self.converting >= 0 and clock.now_us >= self.done_us:
+            self.convert(self.converting)
+        return bytes(self.registers[(register + k) & 0xFF] for k in range(n))
+
+    def write(self, register, data):
+        for k in range(len(data)):
+            reg = (register + k) & 0xFF
+            self.registers[reg] = data[k]
+            if reg == REG_ADCCON0 and data[k] & ADCS and self.registers[REG_ADCCON1] & ADCEN:
+                self.converting = data[k] & 0x0F
+                self.done_us = clock.now_us + self.conversion_us
+
+    def convert(self, channel):
+        code = int(self.volts[channel] / self.vref * 4095 + 0.5)
+        code = max(0, min(4095, code))
+        self.registers[REG_ADCRH] = code >> 4
+        self.registers[REG_ADCRL] = code & 0x0F
+        self.registers[REG_ADCCON0] = (self.registers[REG_ADCCON0] & ~ADCS) | ADCF
+        self.converting = -1
+        self.conversions += 1
+
+
+class BreakoutIOExpander:
+    PIN_IN = 1
+    PIN_IN_PULL_UP = 2
+    PIN_OUT = 3
+    PIN_OD = 4
+    PIN_PWM = 5
+    PIN_ADC = 10
+
+    def __init__(self, i2c, address=0x18, interrupt=None):
+        self.i2c = i2c
+        self.address = address
+        self.modes = {}
+        self.vref = 3.3
+
+    def _read8(self, reg):
+        return self.i2c.readfrom_mem(self.address, reg, 1)[0]
+
+    def _write8(self, reg, value):
+        self.i2c.writeto_mem(self.address, reg, bytes([value & 0xFF]))
+
+    def _set_bits(self, reg, bits):
+        self._write8(reg, self._read8(reg) | bits)
+
+    def _clr_bits(self, reg, bits):
+        self._write8(reg, self._read8(reg) & ~bits)
+
+    def set_mode(self, pin, mode, schmitt_trigger=False, invert=False):
+        self.modes[pin] = mode
+
+    def get_adc_vref(self):
+        return self.vref
+
+    def set_adc_vref(self, vref):
+        self.vref = vref
+
+    def input(self, pin, adc_timeout=1):
+        """
+        The ADC read of the Pimoroni library, 16 transactions when the first poll sees the flag.
+        """
+        if self.modes.get(pin) != self.PIN_ADC:
+            raise ValueError("pin is not in ADC mode")
+        channel = ADC_CHANNELS[pin]
+        self._clr_bits(REG_ADCCON0, 0x0F)
+        self._set_bits(REG_ADCCON0, channel)
+        self._write8(REG_AINDIDS, 0)
+        self._set_bits(REG_AINDIDS, 1 << channel)
+        self._set_bits(REG_ADCCON1, ADCEN)
+        self._clr_bits(REG_ADCCON0, ADCF)
+        self._set_bits(REG_ADCCON0, ADCS)
+        polls = 0
+        while not self._read8(REG_ADCCON0) & ADCF:
+            polls += 1
+            if polls > adc_timeout * 1000:
+                raise RuntimeError("timeout waiting for the ADC conversion")
+        high = self._read8(REG_ADCRH)
+        low = self._read8(REG_ADCRL)
+        return (high << 4) | low
+
+    def input_as_voltage(self, pin, adc_timeout=1):
+        return self.input(pin, adc_timeout) / 4095.0 * self.vref
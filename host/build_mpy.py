@@ -0,0 +1,107 @@
+"""
+Precompiles the modules of the robot to .mpy files with mpy-cross, so that the Pico loads
+bytecode (and the machine code of the native and viper variants in fastpath.py) instead of
+compiling the sources on every boot. Optionally writes a manifest to freeze them into a
+custom MicroPython firmware instead.
+
+main.py stays a source file: the Pico only runs main.py as a script. It is small next to the
+modules it imports.
+
+The .mpy format must match the firmware: mpy-cross of the same MicroPython release (e.g.
+`pip install mpy-cross==1.22.2` for firmware 1.22.2). A mismatch is reported at import time
+as "incompatible .mpy file". On the Pico a .py file is imported before a .mpy of the same
+name, so the sources of the modules must be removed from the flash:
+
+    mpremote rm :sensors.py ... + cp build/pico/*.mpy : + cp code/main.py :
+
+Usage (from the repository root):
+    python -m host.build_mpy [--out build/pico] [--mpy-cross PATH] [--manifest FILE]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code")
+
+# The modules imported by main.py and the boot benchmark
+MODULES = ("autotune.py", "backends.py", "battery.py", "buffer.py", "calibration.py", "console.py", "fastpath.py",
+           "follower.py", "lap_profile.py", "lookahead.py", "memory.py", "motors.py", "pid.py", "pipeline.py",
+           "profiler.py", "recovery.py", "remote.py", "scheduler.py", "sensors.py", "telemetry.py",
+           "bench_fastpath.py")
+
+# Architecture of the machine code of the native and viper emitters on the RP2040 (Cortex-M0+)
+ARCH = "armv6m"
+
+
+def compiler(path=None):
+    """
+    Returns the command running mpy-cross: the given executable, the one on the PATH or the
+    one of the mpy_cross Python package.
+    """
+    if path:
+        return [path]
+    executable = shutil.which("mpy-cross")
+    if executable:
+        return [executable]
+    try:
+        import mpy_cross
+    except ImportError:
+        sys.exit("mpy-cross not found: pip install mpy-cross==<firmware version>, or pass --mpy-cross")
+    return [sys.executable, "-c", "import mpy_cross, sys; mpy_cross.run(*sys.argv[1:]).wait()"]
+
+
+def build(command, out, optimize=0):
+    """
+    Compiles the modules into out. Returns a list of (module, source size, .mpy size).
+    """
+    os.makedirs(out, exist_ok=True)
+    sizes = []
+    for module in MODULES:
+        source = os.path.join(CODE_DIR, module)
+        target = os.path.join(out, module[:-3] + ".mpy")
+        result = subprocess.run(command + ["-march=" + ARCH, "-O%d" % optimize, "-o", target, source],
+                                capture_output=True, text=True)
+        if result.returncode != 0 or not os.path.exists(target):
+            sys.exit("%s: %s" % (module, (result.stderr or result.stdout).strip()))
+        sizes.append((module, os.path.getsize(source), os.path.getsize(target)))
+    return sizes
+
+
+def write_manifest(path, optimize=0):
+    """
+    Writes a freezing manifest for a firmware build (make BOARD=RPI_PICO FROZEN_MANIFEST=path).
+    """
+    with open(path, "w") as file:
+        file.write('# Robot modules frozen into the firmware, written by host/build_mpy.py\n')
+        file.write('include("$(PORT_DIR)/boards/manifest.py")\n')
+        for module in MODULES:
+            file.write('module("%s", base_path="%s", opt=%d)\n' % (module, CODE_DIR, optimize))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=os.path.join("build", "pico"), help="directory of the .mpy files")
+    parser.add_argument("--mpy-cross", help="mpy-cross executable")
+    parser.add_argument("-O", "--optimize", type=int, default=0,
+                        help="optimisation level of mpy-cross, 1 and above drop the asserts")
+    parser.add_argument("--manifest", help="also write a manifest to freeze the modules into a firmware")
+    args = parser.parse_args()
+
+    command = compiler(args.mpy_cross)
+    version = subprocess.run(command + ["--version"], capture_output=True, text=True).stdout.strip()
+    print(version or "mpy-cross")
+    sizes = build(command, args.out, args.optimize)
+    print("%-20s %8s %8s" % ("module", ".py", ".mpy"))
+    for module, source, compiled in sizes:
+        print("%-20s %8d %8d" % (module, source, compiled))
+    print("%-20s %8d %8d" % ("total", sum(s[1] for s in sizes), sum(s[2] for s in sizes)))
+    print("written to", args.out, "- the firmware must be of the same release as mpy-cross")
+    if args.manifest:
+        write_manifest(args.manifest, args.optimize)
+        print("manifest written to", args.manifest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Regression check of the allocating instructions of the control loop. Simulated laps are
+driven while every bytecode instruction executed in ./code is traced, and after a warm-up
+the instructions which build a heap object on MicroPython are reported with their file and
+line: tuples, lists, dicts, sets, slices and strings being built, functions, closures and
+generators being created, and the calls of builtins which return a new object (enumerate,
+zip, sorted, str, print...). The laps are main.py as it is, and the LineFollower with
+GC_CONTROL in the float and integer sensor modes, with the interpreted hot paths and those
+of main.py's HOT_PATHS, on the default and the sharp track, scanning in full and adaptively.
+
+This is not a measurement of the heap, and a pass does not mean that the steps allocate
+nothing. The boxed floats are invisible at this level: on the RP2040 every float result of
+the float arithmetic (the PID, the speeds, the float sensor mode) is a new heap object, and
+they make up most of what a step allocates. Only gc.mem_alloc() on the robot measures them,
+as MemoryManager does with GC_CONTROL (the bytes per step printed when the loop stops).
+
+Usage (from the repository root):
+    python -m host.check_alloc [--warmup SECONDS]
+
+Exits with status 1 if a step after the warm-up executes one of these instructions.
+"""
+import argparse
+import contextlib
+import dis
+import io
+import sys
+
+import host
+
+OPCODES = {
+    "BUILD_TUPLE": "tuple",
+    "BUILD_LIST": "list",
+    "BUILD_SET": "set",
+    "BUILD_MAP": "dict",
+    "BUILD_CONST_KEY_MAP": "dict",
+    "BUILD_SLICE": "slice",
+    "BUILD_STRING": "string",
+    "FORMAT_VALUE": "string",
+    "LIST_EXTEND": "list",
+    "CALL_FUNCTION_EX": "argument tuple",
+    "MAKE_FUNCTION": "function, closure or generator expression",
+    "RETURN_GENERATOR": "generator",
+}
+BUILTINS = ("bytearray", "bytes", "dict", "enumerate", "filter", "format", "list", "map", "memoryview", "print",
+            "repr", "reversed", "set", "sorted", "str", "tuple", "zip")
+
+
+class AllocationAudit:
+    """
+    Traces the instructions of the functions in a directory and counts the allocating ones
+    by (file, line, what) while active.
+
+    Attributes:
+        directory (str): Only code from files in it is traced.
+        active (bool): Instructions are counted, until the simulation stops.
+        sites (dict): (file, line, what) -> number of times executed.
+        tables (dict): Code object -> {instruction offset: what it allocates}.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.active = False
+        self.sites = {}
+        self.tables = {}
+
+    def table(self, code):
+        table = self.tables.get(code)
+        if table is None:
+            table = {}
+            for instruction in dis.get_instructions(code):
+                if instruction.opname in OPCODES:
+                    table[instruction.offset] = OPCODES[instruction.opname]
+                elif instruction.opname in ("LOAD_GLOBAL", "LOAD_NAME") and instruction.argval in BUILTINS:
+                    table[instruction.offset] = instruction.argval + "()"
+            self.tables[code] = table
+        return table
+
+    def trace_calls(self, frame, event, arg):
+        if event == "call" and frame.f_code.co_filename.startswith(self.directory):
+            frame.f_trace_opcodes = True
+            return self.trace_instructions
+        return None
+
+    def trace_instructions(self, frame, event, arg):
+        if event == "exception" and arg[0].__name__ == "SimulationStop":
+            # The end of the lap, what follows are the reports of main.py
+            self.active = False
+        elif event == "opcode" and self.active:
+            what = self.table(frame.f_code).get(frame.f_lasti)
+            if what is not None:
+                key = (frame.f_code.co_filename, frame.f_lineno, what)
+                self.sites[key] = self.sites.get(key, 0) + 1
+        return self.trace_instructions
+
+    def start(self):
+        sys.settrace(self.trace_calls)
+
+    def stop(self):
+        sys.settrace(None)
+
+
+def audit(run, warmup_us):
+    """
+    Runs run() with the audit active after warmup_us on the virtual clock.
+    Returns the sites found.
+    """
+    from host.clock import clock
+
+    checker = AllocationAudit(host.CODE_DIR)
+
+    def activate(start_us, end_us):
+        if end_us >= warmup_us:
+            checker.active = True
+
+    checker.start()
+    try:
+        # The simulation resets the clock when it attaches, so the listener is added by run()
+        run(lambda: clock.listeners.append(activate))
+    finally:
+        checker.stop()
+    return checker.sites
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds of a lap before the check starts")
+    args = parser.parse_args()
+
+    host.install()
+    from host import simulator
+    from host.run_lap import simulate_follower, simulate_main
+    from host.track import default_track, sharp_track
+    import main as robot_main
+
+    attach = simulator.Simulation.attach
+
+    def armed(lap):
+        """
+        A run() of lap() which adds the listener once the simulation has attached.
+        """
+        def run(arm):
+            def attached(self):
+                attach(self)
+                arm()
+            simulator.Simulation.attach = attached
+            try:
+                lap()
+            finally:
+                simulator.Simulation.attach = attach
+        return run
+
+    def main_lap():
+        with contextlib.redirect_stdout(io.StringIO()):
+            simulate_main(max_time=60.0)
+
+    laps = [("main.py", armed(main_lap))]
+    for hot_paths in ("bytecode", robot_main.HOT_PATHS):
+        for integer_mode in (False, True):
+            for track_name, track in (("default track", default_track()), ("sharp track", sharp_track())):
+                for adaptive_scan in (False, True):
+                    constants = {"GC_CONTROL": True, "INTEGER_SENSORS": integer_mode, "HOT_PATHS": hot_paths,
+                                 "ADAPTIVE_SCAN": adaptive_scan}
+                    laps.append(("GC_CONTROL, %s, %s sensors, %s%s" % (
+                        hot_paths, "integer" if integer_mode else "float", track_name,
+                        ", adaptive scan" if adaptive_scan else ""),
+                        armed(lambda constants=constants, track=track: simulate_follower(constants, max_time=60.0,
+                                                                                         track=track))))
+
+    failed = False
+    for name, run in laps:
+        sites = audit(run, int(args.warmup * 1000000))
+        print("%-70s %s" % (name, "no allocating instructions" if not sites else "%d allocating sites" % len(sites)))
+        for (filename, line, what), count in sorted(sites.items()):
+            print("  %s:%d %s, %d times" % (filename[len(host.CODE_DIR) + 1:], line, what, count))
+        if sites:
+            failed = True
+    if failed:
+        sys.exit(1)
+    print("OK (the boxed floats are not checked)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+End-to-end check of the relay autotune (code/autotune.py) against the simulated robot.
+The relay test runs with the Sensors and Motors configured like main.py on the first
+straight of the track. The constants it saves are loaded back like on the next boot, and
+laps are driven with them next to the hand-tuned constants of main.py.
+
+Usage (from the repository root):
+    python -m host.check_autotune [--rule zn|tl|no_overshoot] [--seeds N]
+
+Exits with status 1 if the test finds no oscillation or a lap with the tuned constants fails.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+import host
+
+
+def tune(rule, seed):
+    """
+    Runs autotune.autotune on a fresh simulation. Returns (printed text, (Kp, Kd, BASE_SPEED)
+    as loaded back from the saved file or None, distance driven in m).
+    """
+    from host.simulator import Simulation
+    from host.track import default_track
+    import autotune
+    import main as robot_main
+    from motors import Motors
+    from sensors import Sensors
+
+    c = robot_main
+    simulation = Simulation(default_track(), c.motor_pins, c.motor_enable_pins, c.select_pins, c.adc_pin,
+                            c.positions_to_mux_channel, max_time=30.0, seed=seed)
+    simulation.attach()
+    motors = Motors(c.motor_pins, c.motor_enable_pins, slew_limit=c.MOTOR_SLEW_LIMIT)
+    sensors = Sensors(c.positions_to_mux_channel, c.select_pins, c.adc_pin, threshold_min=c.THRESHOLD_MIN,
+                      memory_length=c.N_smoothing_memory, threshold_max=c.THRESHOLD_MAX, alpha=c.smoothing_alpha,
+                      settle_us=c.MUX_SETTLE_US, smoothing=c.smoothing_mode, integer_mode=c.INTEGER_SENSORS,
+                      position_mode=c.POSITION_MODE)
+    path = os.path.join(tempfile.mkdtemp(), c.AUTOTUNE_FILE)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        autotune.autotune(sensors, motors, c.middle_of_line, c.dt, path, rule, c.AUTOTUNE_SPEED, c.AUTOTUNE_RELAY,
+                          epsilon=sensors.to_sensor_units(c.EPSILON), battery_constant=c.battery_constant)
+    return output.getvalue(), autotune.load_gains(path), simulation.distance
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rule", default=None, help="rule of main.py if not given")
+    parser.add_argument("--seeds", type=int, default=3)
+    args = parser.parse_args()
+
+    host.install()
+    from host.run_lap import simulate_follower
+    from host.track import default_track, sharp_track
+    import main as robot_main
+
+    rule = args.rule or robot_main.AUTOTUNE_RULE
+    failed = False
+    tuned = None
+    for seed in range(args.seeds):
+        text, tuned, distance = tune(rule, seed)
+        print("seed %d, relay test over %.2f m:" % (seed, distance))
+        print("  " + text.strip().replace("\n", "\n  "))
+        if tuned is None:
+            failed = True
+    if tuned is None:
+        sys.exit(1)
+
+    hand = (robot_main.Kp, robot_main.Kd, robot_main.BASE_SPEED)
+    print("%-44s %8s %8s %8s %10s %8s %10s" % ("constants", "Kp", "Kd", "base", "mean lap", "losses",
+                                             "unfinished"))
+    for name, (kp, kd, base_speed) in (("main.py (hand-tuned)", hand), ("autotune, %s rule" % rule, tuned)):
+        for track_name, track in (("default track", default_track()), ("sharp track", sharp_track())):
+            results = [simulate_follower({"Kp": kp, "Kd": kd, "BASE_SPEED": base_speed}, max_time=90.0, seed=seed,
+                                         track=track) for seed in range(args.seeds)]
+            laps = [r.lap_time for r in results if r.finished]
+            unfinished = len(results) - len(laps)
+            if name != "main.py (hand-tuned)" and unfinished:
+                failed = True
+            print("%-44s %8.2f %8.3f %8.1f %8.2f s %8d %10d" % (
+                "%s, %s" % (name, track_name), kp, kd, base_speed, sum(laps) / len(laps) if laps else 0.0,
+                sum(r.line_losses for r in results), unfinished))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+End-to-end check of the live tuning console (code/console.py) on simulated laps driven by
+the LineFollower. Commands are typed into the console during a lap through a pipe, which
+the console polls like the USB serial. Checks that:
+
+- an idle console leaves the lap unchanged and costs little per step,
+- the commands are answered and change the live values (a higher base speed shortens the lap),
+- malformed commands are rejected without disturbing the lap.
+
+Usage (from the repository root):
+    python -m host.check_console [--every N]
+
+Exits with status 1 if a check fails.
+"""
+import argparse
+import contextlib
+import io
+import sys
+
+import host
+
+COMMANDS = (
+    (1.0, "base 120"),
+    (1.0, "kp -28"),
+    (1.5, "eps 0.4"),
+    (2.0, "dump"),
+    (2.5, "kd x"),
+    (2.5, "fly 3"),
+    (3.0, "tmin 3.3"),
+)
+
+EXPECTED = ("base 120.0", "kp -28.0", "eps 0.4", "not a number: x", "unknown command: fly 3", "tmin 3.3")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--every", type=int, default=None, help="CONSOLE_EVERY of main.py if not given")
+    args = parser.parse_args()
+
+    host.install()
+    from host.run_lap import simulate_follower
+    import main as robot_main
+
+    constants = {"CONSOLE_EVERY": args.every or robot_main.CONSOLE_EVERY}
+    failed = False
+
+    plain = simulate_follower(constants)
+    idle = simulate_follower(constants, console_commands=[])
+    print("no console:   lap %.2f s, host cost %.1f us per step" % (plain.lap_time, plain.step_cost_us()))
+    print("idle console: lap %.2f s, host cost %.1f us per step" % (idle.lap_time, idle.step_cost_us()))
+    if idle.lap_time != plain.lap_time or idle.line_losses != plain.line_losses:
+        print("FAIL: the idle console changed the lap")
+        failed = True
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        tuned = simulate_follower(constants, console_commands=list(COMMANDS))
+    replies = output.getvalue().splitlines()
+    print("tuned lap:    lap %.2f s, %d line losses, %s" % (tuned.lap_time, tuned.line_losses,
+                                                          "finished" if tuned.finished else "not finished"))
+    print("replies:")
+    for reply in replies:
+        print("  " + reply)
+    for expected in EXPECTED:
+        if expected not in replies:
+            print("FAIL: no reply %r" % expected)
+            failed = True
+    if not any(reply.startswith("ksd ") for reply in replies):
+        print("FAIL: dump did not list the values")
+        failed = True
+    if not tuned.finished or tuned.lap_time >= plain.lap_time:
+        print("FAIL: the higher base speed did not shorten the lap")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Check of the native and viper variants of code/fastpath.py against the methods they replace.
+The emitters are directives of the MicroPython compiler, they cannot be applied to a method
+which is already compiled, so the variants are copies of the method bodies under the
+decorators. This check keeps the copies in step with the originals:
+
+- every variant which is not a VIPER_REWRITES entry must have the syntax tree of the method
+  it replaces, apart from the name, the decorator and the docstring, so a change to one of
+  the two fails until it is made to the other as well;
+- simulated laps with every emitter must give the same results as the interpreted methods,
+  in the float and integer sensor modes, with the PD and the full PID controller, scanning
+  in full and adaptively. On CPython the decorators do nothing, so the rewritten viper
+  variants have to compute exactly what the methods do.
+
+Usage (from the repository root):
+    python -m host.check_fastpath
+
+Exits with status 1 on a difference.
+"""
+import ast
+import inspect
+import sys
+import textwrap
+
+import host
+
+# Variants of the viper emitter which type a part of the method and are checked by the laps only
+VIPER_REWRITES = ("read_sensors_viper", "get_position_weighted_average_viper")
+
+LAPS = (
+    ("float sensors, PD", "default", {}),
+    ("integer sensors, PD", "default", {"INTEGER_SENSORS": True}),
+    ("float sensors, PID", "default", {"Ki": -5.0, "KD_TAU": 0.02, "INTEGRAL_LIMIT": 0.5}),
+    ("float sensors, adaptive scan, look-ahead", "sharp", {"ADAPTIVE_SCAN": True, "LOOKAHEAD": True,
+                                                          "BASE_SPEED": 150.0}),
+    ("integer sensors, adaptive scan", "sharp", {"INTEGER_SENSORS": True, "ADAPTIVE_SCAN": True,
+                                                 "BASE_SPEED": 150.0}),
+)
+
+
+def body(function):
+    """
+    Dump of the arguments and the statements of a function, without its docstring.
+    """
+    tree = ast.parse(textwrap.dedent(inspect.getsource(function))).body[0]
+    statements = tree.body
+    if statements and isinstance(statements[0], ast.Expr) and isinstance(statements[0].value, ast.Constant) \
+            and isinstance(statements[0].value.value, str):
+        statements = statements[1:]
+    return ast.dump(tree.args) + "".join(ast.dump(statement) for statement in statements)
+
+
+def main():
+    host.install()
+    import fastpath
+    from host.run_lap import simulate_follower
+    from host.track import default_track, sharp_track
+
+    failed = False
+    print("%-72s %s" % ("variant", "body"))
+    for (cls, name, native, viper), method in zip(fastpath.VARIANTS, fastpath.BYTECODE):
+        for variant in (native, viper) if viper is not native else (native,):
+            if variant.__name__ in VIPER_REWRITES:
+                result = "rewritten, checked by the laps"
+            elif body(variant) == body(method):
+                result = "same as the method"
+            else:
+                result = "DIFFERS from the method"
+                failed = True
+            print("%-72s %s" % ("%s.%s: %s" % (cls.__name__, name, variant.__name__), result))
+
+    print()
+    tracks = {"default": default_track(), "sharp": sharp_track()}
+    for name, track_name, constants in LAPS:
+        results = {}
+        for emitter in fastpath.EMITTERS:
+            result = simulate_follower(dict(constants, HOT_PATHS=emitter), max_time=60.0,
+                                       track=tracks[track_name]).as_dict()
+            # The host time of a step is the only result which may differ
+            del result["step_cost_us"]
+            results[emitter] = result
+        same = all(results[emitter] == results["bytecode"] for emitter in fastpath.EMITTERS)
+        print("%-72s %s" % ("%s, %s track" % (name, track_name),
+                            "same laps with every emitter" if same else "DIFFERENT laps"))
+        if not same:
+            failed = True
+            for emitter in fastpath.EMITTERS:
+                print("  %-10s %s" % (emitter, results[emitter]))
+    fastpath.select("bytecode")
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Stress check of the dual-core SensorPipeline (code/pipeline.py) on the host, where
+MicroPython's _thread is CPython's thread module. The acquisition thread scans real
+Sensors through an ADC which returns the same code for every channel of a scan and a
+new code for every scan, so a frame mixing two scans is detected as torn. The control
+thread takes frames as fast as it can and checks them, and resets the smoothing (a sliding
+window) every few steps as LineFollower.reset does, which must not tear a frame either.
+
+Usage (from the repository root):
+    python -m host.check_pipeline [--seconds S] [--integer]
+
+Exits with status 1 if a torn frame or a sequence number going backwards is seen, or if the
+acquisition thread dies.
+"""
+import argparse
+import sys
+import time
+
+import host
+
+# Control steps between resets of the smoothing
+RESET_EVERY = 7
+
+
+class ScanCounterADC:
+    """
+    Returns one code for all channels of a scan and the next code for the next scan.
+    """
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.reads = 0
+
+    def read_u16(self):
+        scan = self.reads // self.channels
+        self.reads += 1
+        # Sweep the whole range so the truncated values change from scan to scan
+        return 20000 + (scan * 997) % 45000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--integer", action="store_true", help="use the integer sensor pipeline")
+    args = parser.parse_args()
+
+    host.install()
+    import main as robot_main
+    from pipeline import SensorPipeline
+    from sensors import Sensors
+
+    # Switch threads as often as possible to provoke races
+    sys.setswitchinterval(1e-6)
+
+    sensors = Sensors(robot_main.positions_to_mux_channel, robot_main.select_pins, robot_main.adc_pin,
+                      threshold_min=0.0, threshold_max=5.0, settle_us=0, integer_mode=args.integer,
+                      smoothing="window", memory_length=4)
+    sensors.backend.adc = ScanCounterADC(len(sensors.voltages))
+    pipeline = SensorPipeline(sensors)
+    pipeline.start()
+
+    steps = 0
+    torn = 0
+    backwards = 0
+    last_sequence = 0
+    died = False
+    end = time.perf_counter() + args.seconds
+    try:
+        while time.perf_counter() < end and not died:
+            voltages = pipeline.read_sensors()
+            steps += 1
+            if steps % RESET_EVERY == 0:
+                pipeline.reset_smoothing()
+            if any(v != voltages[0] for v in voltages):
+                torn += 1
+            if pipeline.sequence < last_sequence:
+                backwards += 1
+            last_sequence = pipeline.sequence
+            died = pipeline.finished
+    finally:
+        pipeline.stop()
+
+    frames = pipeline.sequence
+    print("control steps: %d, frames published: %d" % (steps, frames))
+    print("steps without a new frame: %d, frames never taken: %d" % (pipeline.reused, pipeline.skipped))
+    print("torn frames: %d, sequence going backwards: %d" % (torn, backwards))
+    if died:
+        print("the acquisition stopped by itself")
+    if torn or backwards or died or frames == 0:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Check of the interrupt-driven remote (code/remote.py) on the virtual clock. Random presses
+of the remote, with contact bounce before them and short noise pulses between them, are
+applied to the receiver pin while a loop polls Remote.is_on every control period as
+main.py does. Every press must toggle the state within one period and the noise never.
+Also checks that a full schedule queue and a decoder falling behind the edge ring lose
+no press and are counted.
+
+Usage (from the repository root):
+    python -m host.check_remote [--presses N] [--seed N]
+
+Exits with status 1 if a check fails.
+"""
+import argparse
+import random
+import sys
+
+import host
+
+
+def pulse_train(rng, presses, toggle_us):
+    """
+    Returns the edges [(time in us, level)] of the presses and the noise between them and
+    the times at which the state must toggle.
+    """
+    edges = []
+    toggles = []
+    now = 100000
+    for _ in range(presses):
+        for _ in range(rng.randint(0, 3)):
+            # Noise pulses well below the toggle length
+            now += rng.randint(20000, 200000)
+            edges.append((now, 1))
+            now += rng.randint(100, toggle_us // 2)
+            edges.append((now, 0))
+        now += rng.randint(50000, 400000)
+        for _ in range(rng.randint(0, 4)):
+            # Bounce at the start of the press
+            edges.append((now, 1))
+            now += rng.randint(50, 2000)
+            edges.append((now, 0))
+            now += rng.randint(50, 2000)
+        edges.append((now, 1))
+        now += rng.randint(int(toggle_us * 1.2), 4 * toggle_us)
+        edges.append((now, 0))
+        toggles.append(now)
+    return edges, toggles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presses", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    host.install()
+    from host import micropython
+    from host.clock import clock
+    from host.machine import board
+    import main as robot_main
+    from remote import Remote
+
+    clock.reset()
+    board.reset()
+    period_us = int(robot_main.dt * 1000000)
+    remote = Remote(robot_main.rc_pin, toggle_us=robot_main.REMOTE_TOGGLE_US)
+    pin = board.pins[robot_main.rc_pin]
+    edges, toggles = pulse_train(random.Random(args.seed), args.presses, remote.toggle_us)
+
+    # Poll once per period, the edges arriving while the loop sleeps
+    failures = 0
+    latencies = []
+    expected = remote.is_on
+    pending = list(toggles)
+    k = 0
+    deadline = period_us
+    while k < len(edges) or pending:
+        while k < len(edges) and edges[k][0] <= deadline:
+            clock.advance(edges[k][0] - clock.now_us)
+            pin.drive(edges[k][1])
+            k += 1
+        clock.advance(deadline - clock.now_us)
+        while pending and pending[0] <= clock.now_us:
+            expected = not expected
+            latencies.append(clock.now_us - pending.pop(0))
+        if remote.is_on != expected:
+            failures += 1
+        deadline += period_us
+
+    print("presses: %d, edges: %d, pulses decoded: %d, overruns: %d"
+          % (len(toggles), len(edges), remote.pulses, remote.overruns))
+    print("steps with a wrong state: %d, latency of the loop: max %d us (period %d us)"
+          % (failures, max(latencies), period_us))
+    ok = failures == 0 and max(latencies) <= period_us and remote.pulses * 2 == len(edges)
+
+    # A full schedule queue: the press edge cannot schedule the decoder, the release does
+    state = remote.is_on
+    for _ in range(micropython.SCHEDULER_DEPTH):
+        micropython.schedule(lambda arg: None, 0)
+    pin.drive(1)
+    clock.advance(2 * remote.toggle_us)
+    pin.drive(0)
+    queue_ok = remote.is_on != state and not remote.pending
+    print("press with a full schedule queue decoded:", queue_ok)
+
+    # A decoder held off for more edges than the ring holds
+    remote.pending = True
+    overruns = remote.overruns
+    capacity = len(remote.times)
+    for level in [1, 0] * capacity:
+        clock.advance(1000)
+        pin.drive(level)
+    remote.decode(0)
+    overrun_ok = remote.overruns - overruns == capacity and remote.tail == remote.head
+    print("edges lost behind a stalled decoder counted:", overrun_ok)
+    remote.close()
+
+    if not (ok and queue_ok and overrun_ok):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+class VirtualClock:
+    """
+    Simulated time source shared by the host stand-ins of `utime` and `machine`.
+    Time only moves forward when something sleeps (or waits for a pulse), so
+    a lap is simulated as fast as the host can run the control code.
+
+    Attributes:
+        now_us (int): Microseconds elapsed since the last reset.
+        listeners (list[callable]): Called as listener(start_us, end_us) on every advance.
+    """
+
+    def __init__(self):
+        self.now_us = 0
+        self.listeners = []
+
+    def reset(self):
+        """
+        Rewinds the clock to zero and forgets all listeners.
+        """
+        self.now_us = 0
+        self.listeners = []
+
+    def advance(self, us):
+        """
+        Moves the clock forward by us microseconds and notifies the listeners.
+        Negative or zero durations are ignored, as sleeping for them would be.
+        """
+        us = int(us)
+        if us <= 0:
+            return
+        start_us = self.now_us
+        self.now_us += us
+        for listener in self.listeners:
+            listener(start_us, self.now_us)
+
+
+# The single clock every stand-in module reads from
+clock = VirtualClock()
@@ -0,0 +1,48 @@
+"""
+Host stand-in for the MicroPython `gc` module: CPython's collector with the heap queries of
+MicroPython. The heap is measured with tracemalloc while it is tracing (start it to see the
+allocations), otherwise nothing reads as allocated. A collection takes COLLECT_US on the
+virtual clock, about what one of the robot's heap takes on the RP2040. Everything else is
+the CPython module's. Only the modules of ./code get it for `import gc` (see host.install()),
+the rest of the process keeps CPython's gc and its collections cost no virtual time.
+"""
+import gc as _gc
+import tracemalloc
+
+from host.clock import clock
+
+# Heap of the MicroPython firmware on the RP2040 with the robot modules loaded, in bytes
+HEAP_SIZE = 160 * 1024
+# Duration of a collection on the virtual clock
+COLLECT_US = 1500
+
+
+def collect():
+    _gc.collect()
+    clock.advance(COLLECT_US)
+
+
+def enable():
+    _gc.enable()
+
+
+def disable():
+    _gc.disable()
+
+
+def isenabled():
+    return _gc.isenabled()
+
+
+def mem_alloc():
+    if not tracemalloc.is_tracing():
+        return 0
+    return tracemalloc.get_traced_memory()[0]
+
+
+def mem_free():
+    return max(0, HEAP_SIZE - mem_alloc())
+
+
+def __getattr__(name):
+    return getattr(_gc, name)
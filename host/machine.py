@@ -0,0 +1,223 @@
+"""
+Host stand-in for the MicroPython `machine` module.
+Every peripheral registers itself on `board`, where a simulator can find the
+pins by number, read the duties written by the robot code and provide ADC
+samples and input levels.
+"""
+from host import micropython
+from host.clock import clock
+
+
+class Board:
+    """
+    Registry of the peripherals created by the robot code.
+
+    Attributes:
+        pins (dict): GPIO number -> Pin.
+        pwms (dict): GPIO number -> PWM.
+        adc_sources (dict): GPIO number -> callable returning a 16-bit sample.
+        input_sources (dict): GPIO number -> callable returning the input level.
+        output_listeners (dict): GPIO number -> callable(pin, value) notified of every level or duty written.
+        writes (int): Number of pin and duty writes issued since the last reset.
+        i2c_devices (dict): I2C address -> device with read(register, n) and write(register, data).
+        i2c_transactions (int): Number of I2C transfers (start to stop) since the last reset.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.pins = {}
+        self.pwms = {}
+        self.adc_sources = {}
+        self.input_sources = {}
+        self.output_listeners = {}
+        self.writes = 0
+        self.i2c_devices = {}
+        self.i2c_transactions = 0
+
+
+board = Board()
+
+
+def _pin_id(pin):
+    return pin.id if isinstance(pin, Pin) else pin
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        self._value = 0
+        if value is not None:
+            self._value = 1 if value else 0
+        self.input_level = None
+        self.irq_handler = None
+        self.irq_trigger = 0
+        board.pins[id] = self
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode != -1:
+            self.mode = mode
+        if pull != -1:
+            self.pull = pull
+        if value is not None:
+            self.value(value)
+
+    def value(self, x=None):
+        if x is None:
+            if self.input_level is not None:
+                return self.input_level
+            source = board.input_sources.get(self.id)
+            if source is not None:
+                return source()
+            if self.mode == Pin.IN and self.pull == Pin.PULL_UP:
+                return 1
+            return self._value
+        board.writes += 1
+        self._value = 1 if x else 0
+        listener = board.output_listeners.get(self.id)
+        if listener is not None:
+            listener(self.id, self._value)
+
+    def __call__(self, x=None):
+        return self.value(x)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def low(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+    def toggle(self):
+        self.value(0 if self._value else 1)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self.irq_handler = handler
+        self.irq_trigger = trigger
+
+    def drive(self, level):
+        """
+        Host only: applies a level to the pin from outside, as a receiver would. On an edge
+        matching the trigger, calls the interrupt handler and then the callbacks it scheduled.
+        """
+        level = 1 if level else 0
+        previous = self.value()
+        self.input_level = level
+        if level != previous and self.irq_handler is not None:
+            if self.irq_trigger & (Pin.IRQ_RISING if level else Pin.IRQ_FALLING):
+                self.irq_handler(self)
+                micropython.run_scheduled()
+
+    def __repr__(self):
+        return "Pin(%d)" % self.id
+
+
+class PWM:
+    def __init__(self, dest, freq=None, duty_u16=None):
+        self.pin_id = _pin_id(dest)
+        self._freq = 0
+        self._duty = 0
+        if freq is not None:
+            self.freq(freq)
+        if duty_u16 is not None:
+            self.duty_u16(duty_u16)
+        board.pwms[self.pin_id] = self
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty
+        value = int(value)
+        if value < 0 or value > 65535:
+            raise ValueError("duty must be 0-65535")
+        board.writes += 1
+        self._duty = value
+        listener = board.output_listeners.get(self.pin_id)
+        if listener is not None:
+            listener(self.pin_id, value)
+
+    def deinit(self):
+        self._duty = 0
+
+
+class ADC:
+    def __init__(self, dest):
+        self.pin_id = _pin_id(dest)
+
+    def read_u16(self):
+        source = board.adc_sources.get(self.pin_id)
+        if source is None:
+            return 0
+        return source()
+
+
+class I2C:
+    """
+    I2C controller with the memory transfers of machine.I2C. A transfer goes to the device
+    at its address on board.i2c_devices and takes the time of its bits on the virtual clock:
+    9 clock cycles per byte (8 bits and the acknowledge) and one per start and stop condition.
+    """
+
+    def __init__(self, id=0, scl=None, sda=None, freq=400000):
+        self.id = id
+        self.frequency = freq
+        self.bit_us = 1000000.0 / freq
+        # Bus time not yet advanced on the clock, which counts whole microseconds
+        self.pending_us = 0.0
+
+    def _transfer(self, addr, nbytes, starts):
+        device = board.i2c_devices.get(addr)
+        board.i2c_transactions += 1
+        self.pending_us += (9 * nbytes + starts + 1) * self.bit_us
+        whole = int(self.pending_us)
+        self.pending_us -= whole
+        clock.advance(whole)
+        if device is None:
+            # No acknowledge of the address
+            raise OSError(5)
+        return device
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        device = self._transfer(addr, 2 + len(buf), 1)
+        device.write(memaddr, bytes(buf))
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        # Address and register written, a repeated start, the address again and the data read
+        device = self._transfer(addr, 3 + len(buf), 2)
+        data = device.read(memaddr, len(buf))
+        for i in range(len(buf)):
+            buf[i] = data[i]
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        buf = bytearray(nbytes)
+        self.readfrom_mem_into(addr, memaddr, buf, addrsize)
+        return bytes(buf)
+
+
+def time_pulse_us(pin, pulse_level, timeout_us=1000000):
+    """
+    No pulses are simulated: waits for the whole timeout and reports it
+    the way MicroPython does.
+    """
+    clock.advance(timeout_us)
+    return -2
@@ -0,0 +1,42 @@
+"""
+Host stand-in for the MicroPython `micropython` module. The code emitter decorators
+return the function unchanged, so the native and viper variants run as plain Python.
+Scheduled callbacks wait in a queue until run_scheduled(), which the pin stand-in calls
+when its interrupt handler returns, as MicroPython runs them right after the interrupt.
+"""
+
+# Length of the schedule queue of MicroPython (MICROPY_SCHEDULER_DEPTH)
+SCHEDULER_DEPTH = 8
+
+_scheduled = []
+
+
+def native(function):
+    return function
+
+
+def viper(function):
+    return function
+
+
+def const(value):
+    return value
+
+
+def schedule(function, arg):
+    if len(_scheduled) >= SCHEDULER_DEPTH:
+        raise RuntimeError("schedule queue full")
+    _scheduled.append((function, arg))
+
+
+def run_scheduled():
+    """
+    Host only: runs the scheduled callbacks in order.
+    """
+    while _scheduled:
+        function, arg = _scheduled.pop(0)
+        function(arg)
+
+
+def alloc_emergency_exception_buf(size):
+    pass
@@ -0,0 +1,9 @@
+"""
+Host stand-in for the `pimoroni_i2c` module of the Pimoroni MicroPython firmware.
+"""
+from host.machine import I2C
+
+
+class PimoroniI2C(I2C):
+    def __init__(self, sda, scl, baudrate=400000):
+        I2C.__init__(self, 0, scl=scl, sda=sda, freq=baudrate)
@@ -0,0 +1,110 @@
+"""
+Turns the dump written by Profiler.dump (code/profiler.py) into a report of where the
+control period goes. The dump may be a serial log, lines not belonging to it are skipped.
+
+Usage (from the repository root):
+    python -m host.profile_report DUMP_FILE
+    python -m host.profile_report --simulate
+
+With --simulate a lap is driven on the simulated track with profiling on. Only sleeps move
+the virtual clock, so the simulated dump shows the settle and period sleeps, not compute time.
+"""
+import argparse
+import io
+import sys
+
+
+def parse(lines):
+    """
+    Returns (header dict, stage names, list of sample rows).
+    """
+    header = {}
+    names = None
+    rows = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("# profile "):
+            header = dict(field.split("=", 1) for field in line[len("# profile "):].split())
+            names = header["stages"].split(",") + ["step"]
+            rows = []
+        elif names is not None and line and not line.startswith("#"):
+            fields = line.split(",")
+            if len(fields) != len(names):
+                continue
+            try:
+                rows.append([int(field) for field in fields])
+            except ValueError:
+                continue
+    if names is None:
+        raise ValueError("no profiler dump found")
+    return header, names, rows
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def report(header, names, rows, out=sys.stdout):
+    deadline = int(header.get("deadline_us", 0))
+    steps = int(header.get("steps", len(rows)))
+    overruns = int(header.get("overruns", 0))
+    out.write("%d steps recorded, %d kept in the ring buffer\n" % (steps, len(rows)))
+    if steps:
+        out.write("deadline %d us, overruns %d (%.1f%%)\n" % (deadline, overruns, 100.0 * overruns / steps))
+    out.write("\n%-10s %8s %8s %8s %8s %8s %8s\n" % ("stage", "min", "mean", "p50", "p99", "max", "budget"))
+
+    step_mean = 0.0
+    for index, name in enumerate(names):
+        values = sorted(row[index] for row in rows)
+        mean = sum(values) / len(values) if values else 0.0
+        if name == "step":
+            step_mean = mean
+        share = 100.0 * mean / deadline if deadline else 0.0
+        out.write("%-10s %8d %8.0f %8d %8d %8d %7.1f%%\n" % (
+            name, values[0] if values else 0, mean, percentile(values, 0.5),
+            percentile(values, 0.99), values[-1] if values else 0, share))
+
+    if rows:
+        step_index = len(names) - 1
+        worst = sorted(rows, key=lambda row: row[step_index], reverse=True)[:5]
+        out.write("\nslowest steps (us):\n")
+        for row in worst:
+            parts = ["%s=%d" % (names[i], row[i]) for i in range(step_index) if row[i]]
+            out.write("  %6d  %s\n" % (row[step_index], " ".join(parts)))
+        if deadline:
+            out.write("\nmean slack before the deadline: %.0f us\n" % (deadline - step_mean))
+
+
+def simulated_dump(max_time=30.0):
+    import host
+    host.install()
+    from host.run_lap import simulate_follower
+    from profiler import Profiler
+
+    profiler = Profiler(capacity=4096)
+    simulate_follower(max_time=max_time, profiler=profiler)
+    buffer = io.StringIO()
+    stdout = sys.stdout
+    sys.stdout = buffer
+    try:
+        profiler.dump()
+    finally:
+        sys.stdout = stdout
+    return buffer.getvalue().splitlines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dump", nargs="?", help="file with the profiler dump or a serial log containing it")
+    parser.add_argument("--simulate", action="store_true", help="profile a simulated lap instead")
+    args = parser.parse_args()
+    if args.simulate:
+        lines = simulated_dump()
+    elif args.dump:
+        with open(args.dump) as f:
+            lines = f.readlines()
+    else:
+        parser.error("give a dump file or --simulate")
+    report(*parse(lines))
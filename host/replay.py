@@ -0,0 +1,429 @@
+"""
+Offline replay of recorded raw sensor frames through the math of the control loop:
+Sensors.truncate, the smoothing, get_position_weighted_average, PIDController.update,
+the lost-line detection and the left/right decision of the LineFollower. The replay is
+vectorized with NumPy across all the parameter sets of a sweep at once, the frames are
+stepped through in order as the robot would.
+
+The frames are the raw readings recorded with the debug MODE 'raw frames' of main.py
+(a telemetry dump or serial log, or a CSV/npz written by host/telemetry_decode.py), or a
+simulated lap (--simulate), which also knows where the line really was. Recorded frames
+do not: the side of a lost line is taken from where the raw readings last saw it.
+
+The replay is open loop: the frames do not change with the parameters, so it tells how
+well the sensing and the decisions would follow the recorded motion, not how the robot
+would then drive. The lost-line timeout of the recovery is not replayed. The arithmetic is
+that of the robot code run on the host, double precision with the single precision arrays
+of Sensors, so --check reproduces the decisions exactly.
+
+Usage (from the repository root):
+    python -m host.replay (FRAMES | --simulate) [--search grid|random] [--samples N]
+                          [--set NAME=LOW:HIGH[:COUNT]] ... [--csv FILE] [--check]
+
+Example:
+    python -m host.replay --simulate --search grid --samples 8 --csv replay.csv
+"""
+import argparse
+import csv
+import random
+import sys
+import time
+
+# Replayed constants of main.py with their default (low, high) ranges
+DEFAULT_RANGES = {
+    "THRESHOLD_MIN": (2.6, 4.0),
+    "THRESHOLD_MAX": (4.2, 5.0),
+    "EPSILON": (0.1, 2.0),
+    "EPSILON_UPPER": (3.0, 4.99),
+    "N_direction_memory": (1, 30),
+    "smoothing_alpha": (0.2, 1.0),
+    "Kp": (-40.0, -10.0),
+    "Kd": (-1.0, 0.0),
+}
+
+# Constants not mentioned on the command line are held at their main.py values
+DEFAULT_SEARCHED = ["THRESHOLD_MIN", "THRESHOLD_MAX", "EPSILON", "N_direction_memory"]
+
+# Level in volts above which a raw reading is taken to see the line, for the reference side
+RAW_LINE_LEVEL = 3.75
+
+METRIC_FIELDS = ["error_rms", "output_rms", "position_rms", "losses", "wrong_direction", "wrong_share",
+                 "lost_steps"]
+
+
+def load_frames(path):
+    """
+    Loads raw frames from a telemetry dump or serial log, or from the CSV or npz written by
+    host/telemetry_decode.py. Only the records of raw frames are used.
+    Returns (times in s, voltages as a (frames, sensors) array, None for the unknown line positions).
+    """
+    import numpy
+    from telemetry import FLAG_RAW
+
+    if path.endswith(".npz"):
+        data = numpy.load(path)
+        table = {name: data[name] for name in data.files}
+    elif path.endswith(".csv"):
+        with open(path, newline="") as f:
+            rows = list(csv.reader(f))
+        table = {name: numpy.array([float(row[k]) for row in rows[1:]]) for k, name in enumerate(rows[0])}
+    else:
+        from host.telemetry_decode import decode, columns
+        with open(path, "rb") as f:
+            header, records = decode(f.read())
+        names, rows = columns(header, records)
+        rows = numpy.array(rows, dtype=float).reshape(len(rows), len(names))
+        table = {name: rows[:, k] for k, name in enumerate(names)}
+
+    raw = (table["flags"].astype(int) & FLAG_RAW) != 0
+    if not raw.any():
+        raise ValueError("no raw frames found, record them with the debug MODE 'raw frames'")
+    count = 0
+    while "s%d" % (count + 1) in table:
+        count += 1
+    volts = numpy.stack([table["s%d" % (i + 1)][raw] for i in range(count)], axis=1)
+    return table["t_s"][raw], volts, None
+
+
+def simulated_frames(max_time=60.0, seed=0, track=None):
+    """
+    Drives a simulated lap with main.py's constants and records the raw frames of every step.
+    Returns (times in s, voltages as a (frames, sensors) array, true line positions in sensor units).
+    """
+    import numpy
+    import host
+    host.install()
+    from host.run_lap import simulate_follower
+    from host.simulator import RobotModel
+
+    robot = RobotModel()
+    frames = []
+    simulate_follower(max_time=max_time, seed=seed, track=track, robot=robot, raw_frames=frames)
+    times = numpy.array([frame[0] for frame in frames])
+    volts = numpy.array([frame[1] for frame in frames], dtype=float) / 65535.0 * 5
+    middle = (1 + robot.sensor_count) / 2.0
+    # A line to the left is at a smaller position
+    positions = middle - numpy.array([frame[2] for frame in frames]) / robot.sensor_spacing
+    return times, volts, positions
+
+
+def reference_sides(volts, positions, middle):
+    """
+    Whether the line is to the left of the middle in every frame. From the true positions if
+    known, else from the last frame in which a raw reading saw the line.
+    """
+    import numpy
+
+    if positions is not None:
+        return positions < middle
+    strongest = volts.argmax(axis=1)
+    seen = volts.max(axis=1) > RAW_LINE_LEVEL
+    # Carry the last seen position forward over the frames without the line
+    index = numpy.where(seen, numpy.arange(len(volts)), 0)
+    numpy.maximum.accumulate(index, out=index)
+    return strongest[index] + 1.0 < middle
+
+
+def replay(volts, params, dt, middle=4.0, smoothing="ema", memory_length=2, border_mode="average",
+           brake_steps=0, positions=None):
+    """
+    Replays the frames with every parameter set.
+    * volts: (frames, sensors) raw readings in volts, the sensors numbered from the left
+    * params: Dictionary of the DEFAULT_RANGES names to arrays with one value per parameter set
+    * dt: Time step of the PID controller in seconds
+    * middle, smoothing, memory_length, border_mode, brake_steps: As middle_of_line, smoothing_mode,
+      N_smoothing_memory, border_mode and RECOVERY_BRAKE_STEPS of main.py, the same for all sets
+    * positions: True line position of every frame in sensor units, None if unknown
+    Returns a dictionary of the METRIC_FIELDS names to arrays with one value per parameter set.
+    """
+    import numpy
+
+    f32 = numpy.float32
+    frames, n = volts.shape
+    count = len(params["Kp"])
+    sets = numpy.arange(count)
+
+    # Per-set constants; what Sensors keeps in array('f') is rounded to single precision
+    threshold_min = numpy.asarray(params["THRESHOLD_MIN"], dtype=float)
+    scale = (5.0 / (numpy.asarray(params["THRESHOLD_MAX"], dtype=float) - threshold_min)).astype(f32)
+    offset = (-threshold_min * scale).astype(f32).astype(float)[:, None]
+    scale = scale.astype(float)[:, None]
+    epsilon = numpy.asarray(params["EPSILON"], dtype=float)[:, None]
+    epsilon_upper = numpy.asarray(params["EPSILON_UPPER"], dtype=float)[:, None]
+    alpha = numpy.asarray(params["smoothing_alpha"], dtype=float)[:, None]
+    memory = numpy.maximum(1, numpy.round(params["N_direction_memory"]).astype(int))
+    Kp = numpy.asarray(params["Kp"], dtype=float)
+    Kd = numpy.asarray(params["Kd"], dtype=float)
+    weights = numpy.arange(1, n + 1, dtype=float)
+    sides = reference_sides(volts, positions, middle)
+
+    # Smoothing state, single precision as in Sensors
+    smoothed = numpy.zeros((count, n), dtype=f32)
+    window = numpy.zeros((memory_length, count, n), dtype=f32)
+
+    # Controller and recovery state
+    previous = numpy.full(count, middle)
+    lost = numpy.zeros(count, dtype=bool)
+    brake = numpy.zeros(count, dtype=int)
+    left = numpy.ones(count, dtype=bool)
+
+    # Outermost sensor memory: a CyclicBuffer of N_direction_memory readings per side and set,
+    # with the running sums updated the same way so that ties come out the same
+    buffer_left = numpy.zeros((memory.max(), count))
+    buffer_right = numpy.zeros((memory.max(), count))
+    sum_left = numpy.zeros(count)
+    sum_right = numpy.zeros(count)
+    index = numpy.zeros(count, dtype=int)
+    steps_left = numpy.zeros(count, dtype=int)
+    steps_right = numpy.zeros(count, dtype=int)
+
+    error_sq = numpy.zeros(count)
+    output_sq = numpy.zeros(count)
+    position_sq = numpy.zeros(count)
+    position_count = numpy.zeros(count, dtype=int)
+    following_count = numpy.zeros(count, dtype=int)
+    losses = numpy.zeros(count, dtype=int)
+    wrong = numpy.zeros(count, dtype=int)
+    lost_steps = numpy.zeros(count, dtype=int)
+
+    for t in range(frames):
+        # Sensors.truncate
+        v = volts[t] * scale + offset
+        numpy.clip(v, 0.0, 5.0, out=v)
+
+        # Sensors.smooth_exponential / smooth_window
+        if smoothing == "ema":
+            if t == 0:
+                smoothed[:] = v
+            else:
+                v = smoothed + alpha * (v - smoothed)
+                smoothed[:] = v
+        elif smoothing == "window":
+            window[t % memory_length] = v
+            v = window[:min(t + 1, memory_length)].mean(axis=0, dtype=float)
+
+        # Sensors.get_position_weighted_average
+        total = v.sum(axis=1)
+        weighted = v @ weights
+        has_weight = total != 0
+        position = numpy.where(has_weight, weighted / numpy.where(has_weight, total, 1), 0.0)
+
+        # PIDController.update
+        error = middle - position
+        derivative = (previous - position) / dt
+        output = Kp * error + Kd * derivative
+
+        # RecoveryStateMachine: lost, reacquiring for brake_steps steps or following
+        seen = ~((v < epsilon).all(axis=1) | (v > epsilon_upper).all(axis=1))
+        onset = ~seen & ~lost
+        losses += onset
+        wrong += onset & (left != sides[t])
+        brake = numpy.where(seen & lost, brake_steps, numpy.where(seen, brake, 0))
+        reacquire = seen & (brake > 0)
+        brake -= reacquire
+        following = seen & ~reacquire
+        lost = ~seen
+        lost_steps += lost
+        # The neutral update of the controller while turning in place
+        previous = numpy.where(lost, middle, position)
+
+        # Outermost sensor memory of the LineFollower, only updated while following
+        if border_mode == "last":
+            steps_left = numpy.where(following, numpy.where(v[:, 0] > epsilon_upper[:, 0], 0, steps_left + 1),
+                                     steps_left)
+            steps_right = numpy.where(following, numpy.where(v[:, n - 1] > epsilon_upper[:, 0], 0, steps_right + 1),
+                                      steps_right)
+            left = numpy.where(following, steps_left < steps_right, left)
+        else:
+            value_left = v[:, 0]
+            value_right = v[:, n - 1]
+            old_left = buffer_left[index, sets]
+            old_right = buffer_right[index, sets]
+            sum_left = numpy.where(following, sum_left - old_left + value_left, sum_left)
+            sum_right = numpy.where(following, sum_right - old_right + value_right, sum_right)
+            buffer_left[index, sets] = numpy.where(following, value_left, old_left)
+            buffer_right[index, sets] = numpy.where(following, value_right, old_right)
+            index = numpy.where(following, (index + 1) % memory, index)
+            # Both averages divide by the same count
+            left = numpy.where(following, sum_left > sum_right, left)
+
+        following_count += following
+        error_sq += numpy.where(following, error * error, 0.0)
+        output_sq += numpy.where(following, output * output, 0.0)
+        if positions is not None and 1.0 <= positions[t] <= n:
+            position_sq += numpy.where(following, (position - positions[t]) ** 2, 0.0)
+            position_count += following
+
+    def rms(total, samples):
+        return numpy.sqrt(total / numpy.maximum(samples, 1))
+
+    return {
+        "error_rms": rms(error_sq, following_count),
+        "output_rms": rms(output_sq, following_count),
+        "position_rms": rms(position_sq, position_count) if positions is not None else numpy.full(count, numpy.nan),
+        "losses": losses,
+        "wrong_direction": wrong,
+        "wrong_share": wrong / numpy.maximum(losses, 1),
+        "lost_steps": lost_steps,
+    }
+
+
+def reference_replay(volts, constants, positions=None):
+    """
+    Replays the frames through the robot code itself (Sensors, PIDController, LineFollower and
+    RecoveryStateMachine) with one set of constants, to check replay() against.
+    Returns a dictionary like replay() without output_rms and position_rms.
+    """
+    import math
+    import host
+    host.install()
+    from backends import ReplayBackend
+    from follower import LineFollower
+    from motors import Motors
+    from pid import PIDController
+    from recovery import RecoveryStateMachine, FOLLOWING, LOST_LEFT, LOST_RIGHT
+    from sensors import Sensors
+
+    c = constants
+
+    # The recorded frames in place of the multiplexer
+    sensors = Sensors(c["positions_to_mux_channel"], c["select_pins"], c["adc_pin"],
+                      threshold_min=c["THRESHOLD_MIN"], memory_length=c["N_smoothing_memory"],
+                      threshold_max=c["THRESHOLD_MAX"], alpha=c["smoothing_alpha"], smoothing=c["smoothing_mode"],
+                      backend=ReplayBackend.from_voltages(volts, loop=False))
+    motors = Motors(c["motor_pins"], c["motor_enable_pins"])
+    pid_controller = PIDController(c["Kp"], c["Kd"], 0.0, c["dt"], setpoint=c["middle_of_line"])
+    recovery = RecoveryStateMachine(c["RECOVERY_BRAKE_STEPS"], 0.0, None)
+    follower = LineFollower(sensors, motors, pid_controller, middle_of_line=c["middle_of_line"], dt=c["dt"],
+                            epsilon=c["EPSILON"], epsilon_upper=c["EPSILON_UPPER"], border_mode=c["border_mode"],
+                            n_direction_memory=max(1, int(round(c["N_direction_memory"]))), recovery=recovery)
+    sides = reference_sides(volts, positions, c["middle_of_line"])
+
+    error_sq = 0.0
+    following_count = wrong = lost_steps = 0
+    for t in range(len(volts)):
+        losses = recovery.losses
+        follower.step(c["dt"])
+        if recovery.losses != losses:
+            wrong += recovery.turned_left != sides[t]
+        if recovery.state == FOLLOWING:
+            following_count += 1
+            error = pid_controller.setpoint - pid_controller.prev_measured
+            error_sq += error * error
+        elif recovery.state == LOST_LEFT or recovery.state == LOST_RIGHT:
+            lost_steps += 1
+    return {
+        "error_rms": math.sqrt(error_sq / max(following_count, 1)),
+        "losses": recovery.losses,
+        "wrong_direction": wrong,
+        "lost_steps": lost_steps,
+    }
+
+
+def parse_range(text):
+    name, _, spec = text.partition("=")
+    if name not in DEFAULT_RANGES:
+        raise argparse.ArgumentTypeError("unknown constant %s, choose from %s" % (name, ", ".join(DEFAULT_RANGES)))
+    parts = spec.split(":")
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError("expected NAME=LOW:HIGH[:COUNT], got %s" % text)
+    low, high = float(parts[0]), float(parts[1])
+    count = int(parts[2]) if len(parts) == 3 else 0
+    return name, (min(low, high), max(low, high), count)
+
+
+def write_csv(path, candidates, metrics, order):
+    names = list(DEFAULT_RANGES)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank"] + names + METRIC_FIELDS)
+        for rank, k in enumerate(order, 1):
+            writer.writerow([rank] + ["%.6g" % candidates[k][name] for name in names]
+                            + ["%.6g" % metrics[field][k] for field in METRIC_FIELDS])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("frames", nargs="?", help="telemetry dump, serial log, CSV or npz with raw frames")
+    parser.add_argument("--simulate", action="store_true", help="record the frames of a simulated lap instead")
+    parser.add_argument("--seed", type=int, default=0, help="sensor noise of the simulated lap")
+    parser.add_argument("--track", choices=["default", "sharp"], default="default", help="simulated track")
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument("--samples", type=int, default=8,
+                        help="grid points per constant, or random parameter sets")
+    parser.add_argument("--set", dest="ranges", type=parse_range, action="append", default=[],
+                        help="sweep NAME over LOW:HIGH, COUNT grid points (repeatable)")
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=10, help="parameter sets printed")
+    parser.add_argument("--csv", help="write all parameter sets with their metrics, ranked, to this file")
+    parser.add_argument("--check", action="store_true",
+                        help="also replay main.py's constants through the robot code and compare")
+    args = parser.parse_args()
+
+    try:
+        import numpy
+    except ImportError:
+        sys.exit("the replay needs NumPy")
+    import host
+    host.install()
+    import main as robot_main
+    from host.tune import grid, random_samples
+
+    if args.simulate:
+        from host.track import default_track, sharp_track
+        track = sharp_track() if args.track == "sharp" else default_track()
+        times, volts, positions = simulated_frames(seed=args.seed, track=track)
+    elif args.frames:
+        times, volts, positions = load_frames(args.frames)
+    else:
+        parser.error("give a frames file or --simulate")
+
+    ranges = dict(args.ranges) if args.ranges else {
+        name: DEFAULT_RANGES[name] + (0,) for name in DEFAULT_SEARCHED
+    }
+    base = {name: getattr(robot_main, name) for name in DEFAULT_RANGES}
+    if args.search == "grid":
+        candidates = grid(ranges, args.samples)
+    else:
+        candidates = random_samples(ranges, args.samples, random.Random(args.random_seed))
+    # The truncation needs THRESHOLD_MIN below THRESHOLD_MAX
+    candidates = [dict(base, **candidate) for candidate in candidates]
+    candidates = [candidate for candidate in candidates if candidate["THRESHOLD_MIN"] < candidate["THRESHOLD_MAX"]]
+    for candidate in candidates:
+        candidate["N_direction_memory"] = max(1, int(round(candidate["N_direction_memory"])))
+    # Always replay the current constants as the reference, first
+    candidates.insert(0, dict(base))
+    params = {name: numpy.array([candidate[name] for candidate in candidates], dtype=float)
+              for name in DEFAULT_RANGES}
+
+    start = time.perf_counter()
+    metrics = replay(volts, params, robot_main.dt, middle=robot_main.middle_of_line,
+                     smoothing=robot_main.smoothing_mode, memory_length=robot_main.N_smoothing_memory,
+                     border_mode=robot_main.border_mode, brake_steps=robot_main.RECOVERY_BRAKE_STEPS,
+                     positions=positions)
+    elapsed = time.perf_counter() - start
+    print("%d frames (%.1f s) replayed with %d parameter sets in %.2f s"
+          % (len(volts), times[-1] - times[0], len(candidates), elapsed))
+
+    # Fewest wrong turns first, then the fewest losses of the line and the smallest error
+    order = sorted(range(len(candidates)),
+                   key=lambda k: (metrics["wrong_direction"][k], metrics["losses"][k], metrics["error_rms"][k]))
+    columns = ["rank"] + list(ranges) + METRIC_FIELDS
+    print(" ".join("%14s" % name for name in columns))
+    for rank, k in [(order.index(0) + 1, 0)] + [(rank + 1, k) for rank, k in enumerate(order[:args.top])]:
+        print(" ".join(["%14s" % ("%d%s" % (rank, " (main.py)" if k == 0 else ""))]
+                       + ["%14.4g" % candidates[k][name] for name in ranges]
+                       + ["%14.4g" % metrics[field][k] for field in METRIC_FIELDS]))
+    if args.csv:
+        write_csv(args.csv, candidates, metrics, order)
+        print("written to %s" % args.csv)
+
+    if args.check:
+        c = {name: getattr(robot_main, name) for name in dir(robot_main) if not name.startswith("_")}
+        reference = reference_replay(volts, c, positions)
+        print("robot code with main.py's constants: " + ", ".join(
+            "%s %.4g (replay %.4g)" % (name, value, metrics[name][0]) for name, value in reference.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Drives one simulated lap with the unmodified ./code/main.py.
+
+Usage (from the repository root):
+    python -m host.run_lap [--max-time SECONDS] [--seed N] [--verbose] [--follower] [--learn]
+
+With --learn two laps are driven with the LineFollower: the first records a LapProfile,
+the second follows it.
+"""
+import argparse
+import contextlib
+import io
+import os
+import runpy
+import sys
+import time
+
+import host
+
+
+def simulate_main(max_time=120.0, seed=0, track=None, robot=None, sensor=None, verbose=False):
+    """
+    Runs main.py as the Pico would, against a simulated track.
+    Returns a LapResult.
+    """
+    host.install()
+    from host.simulator import Simulation, SimulationStop
+    from host.track import default_track
+    import main
+    from scheduler import Scheduler
+
+    simulation = Simulation(
+        track if track is not None else default_track(),
+        main.motor_pins, main.motor_enable_pins, main.select_pins, main.adc_pin,
+        main.positions_to_mux_channel, robot=robot, sensor=sensor, max_time=max_time, seed=seed,
+    )
+    simulation.attach()
+
+    # main.py waits for the deadline once per step, the steps are counted there
+    wait = Scheduler.wait
+
+    def counted_wait(self):
+        simulation.on_step()
+        return wait(self)
+
+    output = sys.stdout if verbose else io.StringIO()
+    start = time.perf_counter()
+    Scheduler.wait = counted_wait
+    try:
+        with contextlib.redirect_stdout(output):
+            try:
+                runpy.run_path(main.__file__, run_name="__main__")
+            except SimulationStop:
+                pass
+    finally:
+        Scheduler.wait = wait
+    return simulation.result(time.perf_counter() - start)
+
+
+def simulate_follower(constants=None, max_time=120.0, seed=0, track=None, robot=None, sensor=None,
+                      profiler=None, telemetry=None, lap_profile=None, battery=None, recovery=None,
+                      raw_frames=None, console_commands=None, memory_report=False):
+    """
+    Drives one lap with a LineFollower configured like main.py, without the remote
+    handling and printing. Faster than simulate_main and the constants can be changed.
+    * constants: Dictionary of main.py constant names to override, e.g. {"Kp": -30.0}
+    * profiler: Optional Profiler timing every step
+    * telemetry: Optional Telemetry recording every step
+    * lap_profile: Optional LapProfile, recording or following
+    * battery: Optional BatteryModel of the simulation, sampled with BATTERY_COMPENSATION
+    * recovery: Optional RecoveryStateMachine, built from the RECOVERY_* constants if not given
+    * raw_frames: Optional list to append (time in s, raw ADC codes by sensor, line offset in m)
+      to after every step, as replayed by host/replay.py
+    * console_commands: Optional list of (time in s, command line) typed into a Console polled
+      after every step, whose replies are printed
+    * memory_report: Print the report of the MemoryManager at the end with GC_CONTROL
+    Returns a LapResult.
+    """
+    host.install()
+    from host.clock import clock
+    from host.simulator import Simulation, SimulationStop
+    from host.track import default_track
+    import main
+    from follower import LineFollower
+    from motors import Motors
+    from battery import Battery
+    import fastpath
+    from pid import PIDController
+    from recovery import RecoveryStateMachine
+    from lookahead import LookAhead
+    from memory import MemoryManager
+    from scheduler import Scheduler
+    from sensors import Sensors
+
+    c = {name: getattr(main, name) for name in dir(main) if not name.startswith("_")}
+    if constants:
+        c.update(constants)
+
+    simulation = Simulation(
+        track if track is not None else default_track(),
+        c["motor_pins"], c["motor_enable_pins"], c["select_pins"], c["adc_pin"],
+        c["positions_to_mux_channel"], robot=robot, sensor=sensor, max_time=max_time, seed=seed,
+        battery=battery,
+    )
+    simulation.attach()
+
+    start = time.perf_counter()
+    fastpath.select(c["HOT_PATHS"])
+    motors = Motors(c["motor_pins"], c["motor_enable_pins"], slew_limit=c["MOTOR_SLEW_LIMIT"])
+    motors.start()
+    sensors = Sensors(c["positions_to_mux_channel"], c["select_pins"], c["adc_pin"],
+                      threshold_min=c["THRESHOLD_MIN"], memory_length=c["N_smoothing_memory"],
+                      threshold_max=c["THRESHOLD_MAX"], alpha=c["smoothing_alpha"], settle_us=c["MUX_SETTLE_US"],
+                      smoothing=c["smoothing_mode"], integer_mode=c["INTEGER_SENSORS"],
+                      position_mode=c["POSITION_MODE"], adaptive_scan=c["ADAPTIVE_SCAN"],
+                      full_scan_every=c["FULL_SCAN_EVERY"], scan_margin=c["SCAN_MARGIN"])
+    if c["CALIBRATE_SETTLE"]:
+        sensors.calibrate_settle(c["MUX_SETTLE_US"])
+    battery_monitor = None
+    if c["BATTERY_COMPENSATION"]:
+        battery_monitor = Battery(
+            lambda: sensors.read_channel(c["BATTERY_MUX_CHANNEL"], c["MUX_SETTLE_US"]) / 65535 * 5 * c["BATTERY_DIVIDER"],
+            c["BATTERY_GAIN_POINTS"], motors, sample_every=c["BATTERY_SAMPLE_STEPS"])
+        battery_monitor.sample()
+    if recovery is None:
+        recovery = RecoveryStateMachine(c["RECOVERY_BRAKE_STEPS"], c["RECOVERY_BRAKE_GAIN"], c["RECOVERY_LOST_TIMEOUT"])
+    lookahead = None
+    if c["LOOKAHEAD"]:
+        lookahead = LookAhead(c["LOOKAHEAD_WINDOW"], c["LOOKAHEAD_HORIZON"], c["LOOKAHEAD_MARGIN"],
+                              c["middle_of_line"] - 1.0, c["LOOKAHEAD_MIN_SCALE"], c["LOOKAHEAD_RECOVER"])
+    pid_controller = PIDController(c["Kp"], c["Kd"], c["Ki"], c["dt"], setpoint=c["middle_of_line"],
+                                   derivative_tau=c["KD_TAU"], integral_limit=c["INTEGRAL_LIMIT"],
+                                   schedule=c["GAIN_SCHEDULE"])
+    follower = LineFollower(sensors, motors, pid_controller, middle_of_line=c["middle_of_line"], dt=c["dt"],
+                            epsilon=c["EPSILON"], epsilon_upper=c["EPSILON_UPPER"], border_mode=c["border_mode"],
+                            n_direction_memory=c["N_direction_memory"], k_se=c["K_se"], k_sd=c["K_sd"],
+                            base_speed=c["BASE_SPEED"], tight_turn_speed=c["TIGHT_TURN_SPEED"],
+                            proportion=c["PROPORTION"],
+                            battery_constant=1.0 if c["BATTERY_COMPENSATION"] else c["battery_constant"],
+                            profiler=profiler, telemetry=telemetry, lap_profile=lap_profile,
+                            recovery=recovery, lookahead=lookahead)
+    console = None
+    if console_commands is not None:
+        from console import Console
+        # The commands come through a pipe, read unbuffered like the USB serial
+        read_fd, write_fd = os.pipe()
+        console = Console(follower, sensors, c["CONSOLE_EVERY"], stream=os.fdopen(read_fd, "rb", buffering=0))
+        pending = sorted(console_commands)
+    scheduler = Scheduler(c["dt"])
+    memory = MemoryManager(scheduler, c["GC_COLLECT_US"], reserve=c["GC_RESERVE"]) if c["GC_CONTROL"] else None
+    try:
+        while True:
+            if profiler is not None:
+                profiler.start()
+            follower.step(scheduler.dt)
+            simulation.on_step()
+            if profiler is not None:
+                profiler.end()
+            if raw_frames is not None:
+                raw_frames.append((clock.now_us * 1e-6, tuple(simulation.last_codes), simulation.line_offset()))
+            if battery_monitor is not None:
+                battery_monitor.update()
+            if console is not None:
+                while pending and clock.now_us >= pending[0][0] * 1e6:
+                    os.write(write_fd, (pending.pop(0)[1] + "\n").encode())
+                console.poll()
+            if memory is not None:
+                memory.step()
+            scheduler.wait()
+    except SimulationStop:
+        pass
+    finally:
+        motors.stop()
+        if memory is not None:
+            memory.stop()
+            if memory_report:
+                memory.report()
+        if console is not None:
+            console.stream.close()
+            os.close(write_fd)
+    return simulation.result(time.perf_counter() - start)
+
+
+def simulate_learning(max_time=120.0, seed=0, track=None, robot=None, sensor=None):
+    """
+    Records a LapProfile on one lap and follows it on a second one, configured like main.py.
+    Returns (LapResult of the recording lap, LapResult of the following lap).
+    """
+    host.install()
+    import main
+    from lap_profile import LapProfile
+
+    lap_profile = LapProfile(straight_speed=main.LAP_STRAIGHT_SPEED, turn_speed=main.LAP_TURN_SPEED,
+                             curve_gain=main.LAP_CURVE_GAIN, lookahead_bins=main.LAP_LOOKAHEAD_BINS)
+    recorded = simulate_follower(max_time=max_time, seed=seed, track=track, robot=robot, sensor=sensor,
+                                 lap_profile=lap_profile)
+    lap_profile.finish()
+    followed = simulate_follower(max_time=max_time, seed=seed, track=track, robot=robot, sensor=sensor,
+                                 lap_profile=lap_profile)
+    return recorded, followed
+
+
+def report(result):
+    status = "finished" if result.finished else "did not finish"
+    print("lap %s: %.2f s simulated, %.2f m driven" % (status, result.lap_time, result.distance))
+    print("line losses: %d, max deviation: %.1f mm" % (result.line_losses, result.max_deviation * 1000))
+    print("control steps: %d, host cost per step: %.1f us, wall time: %.3f s"
+          % (result.steps, result.step_cost_us(), result.wall_time))
+    print("pin and duty writes: %d (%.1f per step)"
+          % (result.writes, result.writes / result.steps if result.steps else 0.0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-time", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show what main.py prints")
+    parser.add_argument("--follower", action="store_true", help="drive the LineFollower directly instead of main.py")
+    parser.add_argument("--learn", action="store_true", help="record a lap profile, then drive a lap following it")
+    args = parser.parse_args()
+    if args.learn:
+        recorded, followed = simulate_learning(max_time=args.max_time, seed=args.seed)
+        print("recording lap:")
+        report(recorded)
+        print("following lap:")
+        report(followed)
+    elif args.follower:
+        report(simulate_follower(max_time=args.max_time, seed=args.seed))
+    else:
+        report(simulate_main(max_time=args.max_time, seed=args.seed, verbose=args.verbose))
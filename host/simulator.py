@@ -0,0 +1,357 @@
+import math
+import random
+
+from host.clock import clock
+from host.machine import board
+
+
+class SimulationStop(KeyboardInterrupt):
+    """
+    Raised from inside a sleep when the lap is over, so the control loop in
+    main.py leaves through its KeyboardInterrupt handler and stops the motors.
+    """
+
+
+class RobotModel:
+    """
+    Geometry and drive characteristics of the robot.
+
+    Attributes:
+        wheel_base (float): Distance between the wheels in meters.
+        max_wheel_speed (float): Wheel surface speed at full duty in meters per second.
+        motor_tau (float): Time constant of the wheel speed response in seconds.
+        sensor_offset (float): Distance of the sensor row ahead of the axle in meters.
+        sensor_spacing (float): Distance between neighbouring sensors in meters.
+        sensor_count (int): Number of sensors, the first one is the leftmost.
+    """
+
+    def __init__(self, wheel_base=0.1, max_wheel_speed=0.6, motor_tau=0.05,
+                 sensor_offset=0.07, sensor_spacing=0.012, sensor_count=7):
+        self.wheel_base = wheel_base
+        self.max_wheel_speed = max_wheel_speed
+        self.motor_tau = motor_tau
+        self.sensor_offset = sensor_offset
+        self.sensor_spacing = sensor_spacing
+        self.sensor_count = sensor_count
+
+
+class SensorModel:
+    """
+    KTIR0711S reflective sensor as seen through the analog multiplexer.
+
+    Attributes:
+        background_voltage (float): Output over the bare track in volts.
+        line_voltage (float): Output fully over the tape in volts.
+        edge_width (float): Width of the transition at the tape edge in meters.
+        settle_tau_us (float): Time constant of the mux output after a channel switch.
+        noise (float): Standard deviation of the output noise in volts.
+    """
+
+    def __init__(self, background_voltage=2.6, line_voltage=4.9, edge_width=0.006,
+                 settle_tau_us=15.0, noise=0.01):
+        self.background_voltage = background_voltage
+        self.line_voltage = line_voltage
+        self.edge_width = edge_width
+        self.settle_tau_us = settle_tau_us
+        self.noise = noise
+
+
+class BatteryModel:
+    """
+    Battery behind a divider on a spare multiplexer channel. The wheel speeds scale with
+    its voltage, which falls linearly with time.
+
+    Attributes:
+        voltage (float): Voltage at the start of the run.
+        drain (float): Fall of the voltage in volts per second.
+        nominal_voltage (float): Voltage at which the wheels reach RobotModel.max_wheel_speed.
+        mux_channel (int): Multiplexer channel the divider output is wired to.
+        divider (float): Battery volts per volt at the ADC.
+    """
+
+    def __init__(self, voltage=8.0, drain=0.0, nominal_voltage=8.0, mux_channel=7, divider=3.0):
+        self.voltage = voltage
+        self.drain = drain
+        self.nominal_voltage = nominal_voltage
+        self.mux_channel = mux_channel
+        self.divider = divider
+
+    def voltage_at(self, t):
+        return self.voltage - self.drain * t
+
+
+class LapResult:
+    """
+    Outcome of one simulated run.
+
+    Attributes:
+        finished (bool): Whether the robot completed the lap.
+        lap_time (float): Simulated time of the run in seconds.
+        distance (float): Distance driven along the track in meters.
+        line_losses (int): Number of times no sensor saw the line.
+        max_deviation (float): Largest distance of the axle from the line in meters.
+        steps (int): Number of control steps, counted by Simulation.on_step.
+        adc_reads (int): Number of sensor readings taken.
+        wall_time (float): Host time spent simulating in seconds.
+        writes (int): Pin and duty writes issued by the robot code.
+    """
+
+    def __init__(self, finished, lap_time, distance, line_losses, max_deviation, steps, wall_time, writes,
+                 adc_reads=0):
+        self.finished = finished
+        self.lap_time = lap_time
+        self.distance = distance
+        self.line_losses = line_losses
+        self.max_deviation = max_deviation
+        self.steps = steps
+        self.wall_time = wall_time
+        self.writes = writes
+        self.adc_reads = adc_reads
+
+    def step_cost_us(self):
+        """
+        Host time spent per control step in microseconds.
+        """
+        return self.wall_time / self.steps * 1e6 if self.steps else 0.0
+
+    def as_dict(self):
+        return {
+            "finished": self.finished,
+            "lap_time": self.lap_time,
+            "distance": self.distance,
+            "line_losses": self.line_losses,
+            "max_deviation": self.max_deviation,
+            "steps": self.steps,
+            "step_cost_us": self.step_cost_us(),
+            "writes": self.writes,
+            "adc_reads": self.adc_reads,
+        }
+
+
+class Simulation:
+    """
+    Differential drive kinematic simulation wired to the host `machine` stand-ins.
+    Reads the duties written to the motor PWMs, integrates the robot pose whenever
+    the virtual clock advances and answers ADC reads with the voltage of the sensor
+    currently selected on the multiplexer.
+    """
+
+    def __init__(self, track, motor_pins, enable_pins, select_pins, adc_pin, mux_channels,
+                 robot=None, sensor=None, max_time=120.0, off_track_distance=0.25, seed=0, battery=None):
+        """
+        * track: Track to drive on
+        * motor_pins, enable_pins, select_pins, adc_pin, mux_channels: The wiring, as in main.py
+        * robot: RobotModel, defaults are close to the competition robot
+        * sensor: SensorModel of the reflective sensors
+        * max_time: Simulated seconds after which the run is abandoned
+        * off_track_distance: Distance from the line in meters at which the run is abandoned
+        * seed: Seed of the sensor noise
+        * battery: Optional BatteryModel, without it the wheel speeds do not depend on the supply
+        """
+        self.track = track
+        self.motor_pins = motor_pins
+        self.enable_pins = enable_pins
+        self.select_pins = select_pins
+        self.adc_pin = adc_pin
+        self.robot = robot if robot is not None else RobotModel()
+        self.sensor = sensor if sensor is not None else SensorModel()
+        self.max_time = max_time
+        self.off_track_distance = off_track_distance
+        self.random = random.Random(seed)
+        self.battery = battery
+
+        # Which sensor sits behind each of the eight mux channels
+        self.channel_to_sensor = [None] * 8
+        for sensor_index, channel in enumerate(mux_channels):
+            self.channel_to_sensor[channel] = sensor_index
+
+        self.x, self.y, self.heading = track.start_pose()
+        self.v_left = 0.0
+        self.v_right = 0.0
+        self.track_index = 0
+        self.distance = 0.0
+        self.max_deviation = 0.0
+        self.sensor_hints = [0] * self.robot.sensor_count
+        self.row_hint = 0
+        self.last_codes = [0] * self.robot.sensor_count
+        self.sensor_seen = [True] * self.robot.sensor_count
+        self.line_lost = False
+        self.line_losses = 0
+        self.adc_reads = 0
+        self.steps = 0
+        self.finished = False
+        self.failed = False
+
+        # Mux output state for the settling model
+        self.mux_voltage = 0.0
+        self.mux_start_voltage = 0.0
+        self.mux_channel = 0
+        self.mux_switch_us = 0
+
+        # Last level or duty written to every watched pin
+        self.outputs = {}
+        self.target_left = 0.0
+        self.target_right = 0.0
+
+    def attach(self):
+        """
+        Resets the virtual clock and the board and hooks the simulation into both.
+        Must be called before the robot code creates its peripherals.
+        """
+        clock.reset()
+        board.reset()
+        clock.listeners.append(self.on_advance)
+        board.adc_sources[self.adc_pin] = self.read_adc
+        for pin in list(self.select_pins) + list(self.enable_pins) + list(self.motor_pins.values()):
+            board.output_listeners[pin] = self.on_output
+
+    def on_output(self, pin, value):
+        """
+        Tracks the levels and duties written by the robot code.
+        """
+        self.outputs[pin] = value
+        if pin in self.select_pins:
+            channel = 0
+            for bit, select_pin in enumerate(self.select_pins):
+                if self.outputs.get(select_pin, 0):
+                    channel |= 1 << bit
+            if channel != self.mux_channel:
+                self.mux_channel = channel
+                self.mux_switch_us = clock.now_us
+                self.mux_start_voltage = self.mux_voltage
+            return
+
+        enabled = True
+        for enable_pin in self.enable_pins:
+            if not self.outputs.get(enable_pin, 0):
+                enabled = False
+        if enabled:
+            self.target_left = self.wheel_command(self.motor_pins["left_forward"], self.motor_pins["left_reverse"])
+            self.target_right = self.wheel_command(self.motor_pins["right_forward"], self.motor_pins["right_reverse"])
+        else:
+            self.target_left = self.target_right = 0.0
+
+    def wheel_command(self, forward_pin, reverse_pin):
+        duty = self.outputs.get(forward_pin, 0) - self.outputs.get(reverse_pin, 0)
+        return duty / 65535.0 * self.robot.max_wheel_speed
+
+    def on_step(self):
+        """
+        Called by the driver of the robot code at the end of every control step. Steps are
+        counted here rather than from the ADC reads, as the adaptive scan reads fewer sensors.
+        """
+        self.steps += 1
+
+    def on_advance(self, start_us, end_us):
+        if self.finished or self.failed:
+            raise SimulationStop()
+
+        # Integrate in steps of at most 2 ms
+        remaining = (end_us - start_us) * 1e-6
+        robot = self.robot
+        supply = 1.0
+        if self.battery is not None:
+            supply = self.battery.voltage_at(start_us * 1e-6) / self.battery.nominal_voltage
+        while remaining > 0.0:
+            h = min(remaining, 0.002)
+            remaining -= h
+            response = 1.0 - math.exp(-h / robot.motor_tau)
+            self.v_left += (self.target_left * supply - self.v_left) * response
+            self.v_right += (self.target_right * supply - self.v_right) * response
+            v = (self.v_left + self.v_right) / 2
+            omega = (self.v_right - self.v_left) / robot.wheel_base
+            self.heading += omega * h
+            self.x += v * math.cos(self.heading) * h
+            self.y += v * math.sin(self.heading) * h
+
+        previous_index = self.track_index
+        self.track_index, deviation = self.track.nearest(self.x, self.y, self.track_index)
+        n = self.track.n
+        step = (self.track_index - previous_index) % n
+        if step > n // 2:
+            step -= n
+        self.distance += step * self.track.length / n
+        if deviation > self.max_deviation:
+            self.max_deviation = deviation
+
+        if self.distance >= self.track.length:
+            self.finished = True
+        elif deviation > self.off_track_distance or end_us * 1e-6 > self.max_time:
+            self.failed = True
+        if self.finished or self.failed:
+            raise SimulationStop()
+
+    def sensor_voltage(self, sensor_index):
+        """
+        Noise-free output of one sensor at the current pose in volts.
+        """
+        robot = self.robot
+        lateral = ((robot.sensor_count - 1) / 2 - sensor_index) * robot.sensor_spacing
+        cos_h = math.cos(self.heading)
+        sin_h = math.sin(self.heading)
+        sx = self.x + robot.sensor_offset * cos_h - lateral * sin_h
+        sy = self.y + robot.sensor_offset * sin_h + lateral * cos_h
+        self.sensor_hints[sensor_index], distance = self.track.nearest(sx, sy, self.sensor_hints[sensor_index])
+
+        edge = self.sensor.edge_width
+        coverage = (self.track.line_width / 2 + edge / 2 - distance) / edge
+        coverage = max(0.0, min(1.0, coverage))
+
+        # Count a line loss whenever no sensor sees the tape at all
+        self.sensor_seen[sensor_index] = coverage > 0.0
+        if not any(self.sensor_seen):
+            if not self.line_lost:
+                self.line_lost = True
+                self.line_losses += 1
+        else:
+            self.line_lost = False
+
+        return self.sensor.background_voltage + (self.sensor.line_voltage - self.sensor.background_voltage) * coverage
+
+    def line_offset(self):
+        """
+        Signed distance of the center line from the middle of the sensor row in meters,
+        positive when the line is to the left of the robot.
+        """
+        robot = self.robot
+        cos_h = math.cos(self.heading)
+        sin_h = math.sin(self.heading)
+        cx = self.x + robot.sensor_offset * cos_h
+        cy = self.y + robot.sensor_offset * sin_h
+        self.row_hint, distance = self.track.nearest(cx, cy, self.row_hint)
+        side = (self.track.xs[self.row_hint] - cx) * -sin_h + (self.track.ys[self.row_hint] - cy) * cos_h
+        return distance if side >= 0.0 else -distance
+
+    def read_adc(self):
+        sensor_index = self.channel_to_sensor[self.mux_channel]
+        if sensor_index is not None:
+            self.adc_reads += 1
+            target = self.sensor_voltage(sensor_index)
+        elif self.battery is not None and self.mux_channel == self.battery.mux_channel:
+            target = self.battery.voltage_at(clock.now_us * 1e-6) / self.battery.divider
+        else:
+            target = 0.0
+
+        # The mux output relaxes towards the selected sensor after a switch
+        elapsed = clock.now_us - self.mux_switch_us
+        settled = 1.0 - math.exp(-elapsed / self.sensor.settle_tau_us) if self.sensor.settle_tau_us > 0 else 1.0
+        self.mux_voltage = self.mux_start_voltage + (target - self.mux_start_voltage) * settled
+        voltage = self.mux_voltage + self.random.gauss(0.0, self.sensor.noise)
+
+        code = max(0, min(65535, int(voltage / 5.0 * 65535)))
+        if sensor_index is not None:
+            self.last_codes[sensor_index] = code
+        return code
+
+    def result(self, wall_time):
+        return LapResult(
+            finished=self.finished,
+            lap_time=clock.now_us * 1e-6,
+            distance=self.distance,
+            line_losses=self.line_losses,
+            max_deviation=self.max_deviation,
+            steps=self.steps,
+            wall_time=wall_time,
+            writes=board.writes,
+            adc_reads=self.adc_reads,
+        )
@@ -0,0 +1,164 @@
+"""
+Turns the records written by Telemetry.drain/dump (code/telemetry.py) into CSV or NumPy
+arrays. The input may be a serial log with hex lines ('T ...', other lines are skipped)
+or a raw file written by Telemetry.dump to the flash.
+
+Usage (from the repository root):
+    python -m host.telemetry_decode DUMP_FILE [-o OUT.csv] [--npz OUT.npz]
+    python -m host.telemetry_decode --simulate [-o OUT.csv] [--npz OUT.npz]
+
+Sensor values are converted to volts. Records of raw frames (debug MODE 'raw frames') are
+replayed with host/replay.py. The t_s column is the time since the first record
+with the ticks_us wrap-around undone. --npz needs NumPy.
+"""
+import argparse
+import binascii
+import csv
+import struct
+import sys
+
+TICKS_PERIOD = 1 << 30
+
+
+def parse_header(line):
+    return dict(field.split("=", 1) for field in line[len("# telemetry "):].split())
+
+
+def decode(data):
+    """
+    Decodes a serial log or a raw dump given as bytes.
+    Returns (header dict of the last header seen, list of record tuples).
+    """
+    header = None
+    records = []
+    position = 0
+    while position < len(data):
+        end = data.find(b"\n", position)
+        if end < 0:
+            end = len(data)
+        line = data[position:end].strip()
+        position = end + 1
+        if line.startswith(b"# telemetry "):
+            header = parse_header(line.decode())
+            size = struct.calcsize(header["format"])
+            if header["encoding"] == "raw":
+                count = int(header["records"])
+                payload = data[position:position + count * size]
+                records.extend(struct.iter_unpack(header["format"], payload[:len(payload) // size * size]))
+                position += count * size
+        elif header is not None and line.startswith(b"T "):
+            try:
+                record = binascii.unhexlify(line[2:])
+            except (binascii.Error, ValueError):
+                continue
+            if len(record) == struct.calcsize(header["format"]):
+                records.append(struct.unpack(header["format"], record))
+    if header is None:
+        raise ValueError("no telemetry found")
+    return header, records
+
+
+def columns(header, records):
+    """
+    Returns (column names, rows) with the time in seconds and the sensor values in volts.
+    """
+    from telemetry import record_fields, FLAG_RAW
+
+    scale = float(header.get("scale", 1))
+    # Dumps from before the sensor count was in the header hold seven sensors
+    sensors = int(header.get("sensors", 7))
+    names = ("t_s",) + record_fields(sensors)
+    rows = []
+    elapsed = 0
+    previous = None
+    for record in records:
+        if previous is not None:
+            elapsed += (record[0] - previous) % TICKS_PERIOD
+        previous = record[0]
+        # Raw frames are recorded in volts whatever the scale of the sensor pipeline
+        divisor = 1.0 if record[-1] & FLAG_RAW else scale
+        values = tuple(value / divisor for value in record[1:1 + sensors])
+        rows.append((elapsed / 1e6,) + record[:1] + values + record[1 + sensors:])
+    return names, rows
+
+
+def write_csv(names, rows, out):
+    writer = csv.writer(out)
+    writer.writerow(names)
+    for row in rows:
+        writer.writerow(["%.6g" % value if isinstance(value, float) else value for value in row])
+
+
+def to_arrays(names, rows):
+    """
+    Returns a dictionary of column name to NumPy array.
+    """
+    import numpy
+
+    table = numpy.array(rows, dtype=float).reshape(len(rows), len(names))
+    arrays = {name: table[:, index] for index, name in enumerate(names)}
+    arrays["ticks_us"] = arrays["ticks_us"].astype(numpy.int64)
+    arrays["flags"] = arrays["flags"].astype(numpy.uint8)
+    return arrays
+
+
+def simulated_dump(max_time=30.0):
+    """
+    Drives a simulated lap with telemetry on and returns the raw dump as bytes.
+    """
+    import os
+    import tempfile
+
+    import host
+    host.install()
+    from host.run_lap import simulate_follower
+    from telemetry import Telemetry
+
+    telemetry = Telemetry(capacity=4096)
+    simulate_follower(max_time=max_time, telemetry=telemetry)
+    handle, path = tempfile.mkstemp(suffix=".bin")
+    os.close(handle)
+    try:
+        telemetry.dump(path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dump", nargs="?", help="serial log or raw telemetry file")
+    parser.add_argument("--simulate", action="store_true", help="record a simulated lap instead")
+    parser.add_argument("-o", "--output", help="CSV file to write, standard output if not given")
+    parser.add_argument("--npz", help="also save the columns as NumPy arrays to this file")
+    args = parser.parse_args()
+
+    import host
+    host.install()
+    if args.simulate:
+        data = simulated_dump()
+    elif args.dump:
+        with open(args.dump, "rb") as f:
+            data = f.read()
+    else:
+        parser.error("give a dump file or --simulate")
+
+    header, records = decode(data)
+    names, rows = columns(header, records)
+    if args.output:
+        with open(args.output, "w", newline="") as out:
+            write_csv(names, rows, out)
+    elif not args.npz:
+        write_csv(names, rows, sys.stdout)
+    if args.npz:
+        try:
+            import numpy
+        except ImportError:
+            sys.exit("--npz needs NumPy")
+        numpy.savez(args.npz, **to_arrays(names, rows))
+    print("%d records decoded" % len(rows), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import math
+
+
+class Track:
+    """
+    Closed track given as a densely sampled center line of the black tape.
+
+    Attributes:
+        xs, ys (list[float]): Center line points in meters, the last point connects back to the first.
+        s (list[float]): Arc length from the start line to each point in meters.
+        length (float): Length of the whole lap in meters.
+        line_width (float): Width of the tape in meters.
+    """
+
+    def __init__(self, points, line_width=0.019):
+        self.xs = [float(p[0]) for p in points]
+        self.ys = [float(p[1]) for p in points]
+        self.line_width = line_width
+        self.n = len(self.xs)
+
+        self.s = [0.0] * self.n
+        for i in range(1, self.n):
+            self.s[i] = self.s[i - 1] + math.hypot(self.xs[i] - self.xs[i - 1], self.ys[i] - self.ys[i - 1])
+        self.length = self.s[-1] + math.hypot(self.xs[0] - self.xs[-1], self.ys[0] - self.ys[-1])
+
+    @classmethod
+    def from_polygon(cls, vertices, radii, step=0.005, line_width=0.019):
+        """
+        Builds a track running along a polygon with its corners rounded.
+        The lap starts in the middle of the edge from vertices[0] to vertices[1].
+        * vertices: Polygon corners in meters, in driving order
+        * radii: Fillet radius of each corner in meters (a single number applies to all)
+        * step: Spacing of the sampled center line points in meters
+        """
+        n = len(vertices)
+        if not isinstance(radii, (list, tuple)):
+            radii = [radii] * n
+
+        # Tangent points and arc of every rounded corner
+        corners = []
+        for i in range(n):
+            vx, vy = vertices[i]
+            px, py = vertices[i - 1]
+            nx, ny = vertices[(i + 1) % n]
+            ax, ay = _unit(px - vx, py - vy)
+            bx, by = _unit(nx - vx, ny - vy)
+            half_angle = math.acos(max(-1.0, min(1.0, ax * bx + ay * by))) / 2
+            tangent = radii[i] / math.tan(half_angle)
+            cx_dir, cy_dir = _unit(ax + bx, ay + by)
+            center_distance = radii[i] / math.sin(half_angle)
+            corners.append((
+                (vx + ax * tangent, vy + ay * tangent),
+                (vx + bx * tangent, vy + by * tangent),
+                (vx + cx_dir * center_distance, vy + cy_dir * center_distance),
+                radii[i],
+            ))
+
+        points = []
+        x0, y0 = vertices[0]
+        x1, y1 = vertices[1]
+        start = ((x0 + x1) / 2, (y0 + y1) / 2)
+        position = start
+        for k in range(1, n + 1):
+            entry, exit, center, radius = corners[k % n]
+            _sample_line(points, position, entry, step)
+            _sample_arc(points, entry, exit, center, radius, step)
+            position = exit
+        _sample_line(points, position, start, step)
+        return cls(points, line_width=line_width)
+
+    def start_pose(self):
+        """
+        Returns (x, y, heading) of a robot standing on the start line facing the driving direction.
+        """
+        return self.xs[0], self.ys[0], math.atan2(self.ys[1] - self.ys[0], self.xs[1] - self.xs[0])
+
+    def nearest(self, x, y, hint=0):
+        """
+        Finds the center line point closest to (x, y) by walking downhill from the hint index,
+        so successive queries from a moving point cost only a few steps.
+        Returns (index, distance to the center line in meters).
+        """
+        xs, ys, n = self.xs, self.ys, self.n
+        i = hint % n
+        best = (xs[i] - x) ** 2 + (ys[i] - y) ** 2
+        while True:
+            j = (i + 1) % n
+            d = (xs[j] - x) ** 2 + (ys[j] - y) ** 2
+            if d < best:
+                i, best = j, d
+                continue
+            j = (i - 1) % n
+            d = (xs[j] - x) ** 2 + (ys[j] - y) ** 2
+            if d < best:
+                i, best = j, d
+                continue
+            break
+
+        # Refine against the two segments adjacent to the nearest point
+        for j in ((i - 1) % n, (i + 1) % n):
+            ex, ey = xs[j] - xs[i], ys[j] - ys[i]
+            length2 = ex * ex + ey * ey
+            if length2 == 0.0:
+                continue
+            t = ((x - xs[i]) * ex + (y - ys[i]) * ey) / length2
+            if 0.0 < t < 1.0:
+                d = (xs[i] + t * ex - x) ** 2 + (ys[i] + t * ey - y) ** 2
+                if d < best:
+                    best = d
+        return i, math.sqrt(best)
+
+
+def default_track():
+    """
+    A lap of about 11 m in the spirit of the competition track: long straights,
+    right-angle corners, a narrow hairpin and a chevron with an acute turn.
+    """
+    vertices = [
+        (0.0, 0.0), (3.0, 0.0), (3.0, 1.6), (2.2, 1.6), (2.2, 0.6),
+        (1.6, 0.6), (1.6, 1.6), (0.0, 1.6), (0.5, 0.8),
+    ]
+    radii = [0.15, 0.1, 0.1, 0.05, 0.05, 0.1, 0.05, 0.04, 0.1]
+    return Track.from_polygon(vertices, radii)
+
+
+def sharp_track():
+    """
+    A lap of about 7 m with right-angle corners and a narrow hairpin, all nearly without
+    rounding, on which a fast robot loses the line in the corners.
+    """
+    vertices = [
+        (0.0, 0.0), (2.0, 0.0), (2.0, 1.0), (1.3, 1.0), (1.3, 0.4),
+        (1.1, 0.4), (1.1, 1.0), (0.0, 1.0),
+    ]
+    return Track.from_polygon(vertices, [0.01] * len(vertices))
+
+
+def _unit(x, y):
+    length = math.hypot(x, y)
+    return x / length, y / length
+
+
+def _sample_line(points, start, end, step):
+    length = math.hypot(end[0] - start[0], end[1] - start[1])
+    count = max(1, int(length / step))
+    for k in range(count):
+        t = k / count
+        points.append((start[0] + (end[0] - start[0]) * t, start[1] + (end[1] - start[1]) * t))
+
+
+def _sample_arc(points, start, end, center, radius, step):
+    a0 = math.atan2(start[1] - center[1], start[0] - center[0])
+    a1 = math.atan2(end[1] - center[1], end[0] - center[0])
+    sweep = (a1 - a0 + math.pi) % (2 * math.pi) - math.pi
+    count = max(1, int(abs(sweep) * radius / step))
+    for k in range(count):
+        a = a0 + sweep * k / count
+        points.append((center[0] + radius * math.cos(a), center[1] + radius * math.sin(a)))
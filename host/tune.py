@@ -0,0 +1,223 @@
+"""
+Parameter sweep of the PD gains and speed constants of main.py on the simulated track.
+Runs a grid or random search followed by coarse-to-fine refinement rounds around the
+best candidates, spreads the laps over all cores and writes the ranked results to CSV.
+
+Usage (from the repository root):
+    python -m host.tune [--search grid|random] [--samples N] [--grid-points N] [--rounds N]
+                        [--set NAME=LOW:HIGH[:COUNT]] ... [--csv FILE]
+
+The grid has --grid-points values of every constant without a COUNT of its own, so its size
+grows as grid-points to the power of the number of constants: 3 points of the 5 default
+constants are 243 candidates. The refinement rounds of the grid search use the same points.
+
+Candidates which finish are ranked by their line losses over all seeds first and by the lap
+time among those with as few losses, so the constants printed are the fastest reliable ones.
+
+Example:
+    python -m host.tune --search random --samples 200 --rounds 2 --set Kp=-40:-15 --set BASE_SPEED=90:140
+"""
+import argparse
+import csv
+import itertools
+import math
+import multiprocessing
+import os
+import random
+
+# Searched constants of main.py with their default (low, high) ranges
+DEFAULT_RANGES = {
+    "Kp": (-40.0, -10.0),
+    "Kd": (-1.0, 0.0),
+    "K_se": (0.0, 0.4),
+    "K_sd": (0.0, 0.4),
+    "BASE_SPEED": (70.0, 130.0),
+    "TIGHT_TURN_SPEED": (80.0, 140.0),
+    "PROPORTION": (1.0, 3.0),
+    "battery_constant": (0.6, 1.0),
+}
+
+# Constants not mentioned on the command line are held at their main.py values
+DEFAULT_SEARCHED = ["Kp", "Kd", "K_se", "K_sd", "BASE_SPEED"]
+
+RESULT_FIELDS = ["finished", "lap_time", "distance", "line_losses", "max_deviation", "steps"]
+
+
+def evaluate(job):
+    """
+    Worker: drives the laps of one candidate and averages them.
+    * job: (constants, seeds, max_time)
+    """
+    constants, seeds, max_time = job
+    from host.run_lap import simulate_follower
+
+    results = [simulate_follower(constants, max_time=max_time, seed=seed) for seed in seeds]
+    return {
+        "constants": constants,
+        "finished": all(r.finished for r in results),
+        "lap_time": sum(r.lap_time for r in results) / len(results),
+        "distance": min(r.distance for r in results),
+        "line_losses": sum(r.line_losses for r in results),
+        "max_deviation": max(r.max_deviation for r in results),
+        "steps": sum(r.steps for r in results),
+    }
+
+
+def rank_key(row):
+    """
+    Finished laps first, by line losses and then lap time, then the rest by the distance they
+    made. The losses come first because a lap which loses the line gets round the simulated
+    track by the recovery turns, which a real track does not always forgive: a faster lap with
+    more losses is the less reliable setting, not the better one.
+    """
+    if row["finished"]:
+        return (0, row["line_losses"], row["lap_time"])
+    return (1, -row["distance"], row["line_losses"])
+
+
+def grid(ranges, count):
+    """
+    All combinations of count evenly spaced values in every range.
+    """
+    axes = []
+    for name, (low, high, n) in ranges.items():
+        n = n or count
+        if n == 1 or low == high:
+            axes.append([(name, (low + high) / 2)])
+        else:
+            axes.append([(name, low + (high - low) * k / (n - 1)) for k in range(n)])
+    return [dict(combination) for combination in itertools.product(*axes)]
+
+
+def random_samples(ranges, count, rng):
+    return [{name: rng.uniform(low, high) for name, (low, high, _) in ranges.items()} for _ in range(count)]
+
+
+def refine(ranges, best, shrink):
+    """
+    Ranges of the same shape as ranges, shrunk by shrink and centered on the best candidate,
+    cut off where they leave the original ranges.
+    """
+    refined = {}
+    for name, (low, high, n) in ranges.items():
+        half = (high - low) * shrink / 2
+        center = best[name]
+        refined[name] = (max(low, center - half), min(high, center + half), n)
+    return refined
+
+
+def sweep(candidates, base, seeds, max_time, pool, processes):
+    jobs = [(dict(base, **candidate), seeds, max_time) for candidate in candidates]
+    chunksize = max(1, len(jobs) // (8 * processes))
+    return list(pool.imap_unordered(evaluate, jobs, chunksize=chunksize))
+
+
+def write_csv(path, rows, names):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank"] + names + RESULT_FIELDS)
+        for rank, row in enumerate(rows, 1):
+            writer.writerow([rank] + [row["constants"][name] for name in names] + [row[field] for field in RESULT_FIELDS])
+
+
+def constants_block(constants):
+    """
+    Lines ready to be pasted over the constants in main.py.
+    """
+    lines = ["# Tuned in simulation"]
+    for name in DEFAULT_RANGES:
+        if name in constants:
+            lines.append("%s = %s" % (name, _round(constants[name])))
+    return "\n".join(lines)
+
+
+def _round(value):
+    if value == 0.0:
+        return 0.0
+    digits = max(0, 3 - int(math.floor(math.log10(abs(value)))))
+    return round(value, digits)
+
+
+def parse_range(text):
+    name, _, spec = text.partition("=")
+    if name not in DEFAULT_RANGES:
+        raise argparse.ArgumentTypeError("unknown constant %s, choose from %s" % (name, ", ".join(DEFAULT_RANGES)))
+    parts = spec.split(":")
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError("expected NAME=LOW:HIGH[:COUNT], got %s" % text)
+    low, high = float(parts[0]), float(parts[1])
+    count = int(parts[2]) if len(parts) == 3 else 0
+    return name, (min(low, high), max(low, high), count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--search", choices=["grid", "random"], default="random")
+    parser.add_argument("--samples", type=int, default=64, help="random candidates per round")
+    parser.add_argument("--grid-points", type=int, default=3,
+                        help="grid values of every constant without a COUNT in --set, in every round")
+    parser.add_argument("--set", dest="ranges", type=parse_range, action="append", default=[],
+                        help="search NAME over LOW:HIGH, COUNT grid points (repeatable)")
+    parser.add_argument("--rounds", type=int, default=2, help="refinement rounds after the first sweep")
+    parser.add_argument("--top", type=int, default=4, help="candidates refined in every round")
+    parser.add_argument("--shrink", type=float, default=0.4, help="range shrink factor per round")
+    parser.add_argument("--seeds", type=int, default=1, help="laps with different sensor noise per candidate")
+    parser.add_argument("--max-time", type=float, default=60.0)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--csv", default="tune_results.csv")
+    args = parser.parse_args()
+
+    import host
+    host.install()
+    import main as robot_main
+
+    ranges = dict(args.ranges) if args.ranges else {
+        name: DEFAULT_RANGES[name] + (0,) for name in DEFAULT_SEARCHED
+    }
+    names = list(DEFAULT_RANGES)
+    base = {name: getattr(robot_main, name) for name in names}
+    seeds = list(range(args.seeds))
+    rng = random.Random(args.random_seed)
+
+    if args.search == "grid":
+        candidates = grid(ranges, args.grid_points)
+    else:
+        candidates = random_samples(ranges, args.samples, rng)
+    # Always measure the current constants as the reference
+    candidates.append({name: base[name] for name in ranges})
+
+    rows = []
+    with multiprocessing.Pool(args.processes) as pool:
+        print("round 0: %d candidates on %d processes" % (len(candidates), args.processes))
+        rows += sweep(candidates, base, seeds, args.max_time, pool, args.processes)
+
+        for round_index in range(1, args.rounds + 1):
+            rows.sort(key=rank_key)
+            candidates = []
+            for k in range(min(args.top, len(rows))):
+                local = refine(ranges, rows[k]["constants"], args.shrink ** round_index)
+                if args.search == "grid":
+                    candidates += grid(local, args.grid_points)
+                else:
+                    candidates += random_samples(local, max(1, args.samples // args.top), rng)
+            print("round %d: %d candidates" % (round_index, len(candidates)))
+            rows += sweep(candidates, base, seeds, args.max_time, pool, args.processes)
+
+    rows.sort(key=rank_key)
+    write_csv(args.csv, rows, names)
+
+    reference = [row for row in rows if all(row["constants"][name] == base[name] for name in names)]
+    if reference:
+        r = reference[0]
+        print("current constants: lap %.2f s, finished %s, line losses %d"
+              % (r["lap_time"], r["finished"], r["line_losses"]))
+    best = rows[0]
+    print("best: lap %.2f s, finished %s, line losses %d (%d candidates, written to %s)"
+          % (best["lap_time"], best["finished"], best["line_losses"], len(rows), args.csv))
+    print()
+    print(constants_block(best["constants"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Host stand-in for the MicroPython `utime` module, running on the virtual clock.
+"""
+from host.clock import clock
+
+# MicroPython tick counters wrap around at 2**30
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+def ticks_us():
+    return clock.now_us & TICKS_MAX
+
+
+def ticks_ms():
+    return (clock.now_us // 1000) & TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    """
+    Signed difference ticks1 - ticks2 which survives counter wraparound.
+    """
+    diff = (ticks1 - ticks2) & TICKS_MAX
+    if diff >= TICKS_HALFPERIOD:
+        diff -= TICKS_PERIOD
+    return diff
+
+
+def sleep(seconds):
+    clock.advance(seconds * 1000000)
+
+
+def sleep_ms(ms):
+    clock.advance(ms * 1000)
+
+
+def sleep_us(us):
+    clock.advance(us)
+
+
+def time():
+    return clock.now_us // 1000000
+
+
+def time_ns():
+    return clock.now_us * 1000